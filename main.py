@@ -1,20 +1,21 @@
 import os
-import fitz
+from pageindex.document import Document
 import treeStructure_within_toc
 import treeStructure_without_toc
 
 def process_pdf(pdf_path):
     """Process a single PDF file."""
     print(f"\nProcessing: {pdf_path}")
-    doc = fitz.open(pdf_path)
+    # opened once, the tree builders reuse this handle
+    doc = Document(pdf_path, pdf_parser="PyMuPDF")
 
     # Check if the PDF has a table of contents (outline)
-    if doc.get_toc(simple=True):
+    if doc.outline():
         print('PDF has an outline.')
-        treeStructure_within_toc.extract_tree(pdf_path)
+        treeStructure_within_toc.extract_tree(doc)
     else:
         print('PDF has no outline.')
-        treeStructure_without_toc.extract_tree(pdf_path)
+        treeStructure_without_toc.extract_tree(doc)
 
 def main(folder_path):
     """Process all PDF files within a given folder."""
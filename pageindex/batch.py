@@ -0,0 +1,183 @@
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .models import resolve_backend
+from .tree_writer import write_tree
+from .utils import ConfigLoader, ResponseCache
+
+DOCUMENT_EXTENSIONS = ('.pdf', '.md', '.markdown')
+STATE_FILE = 'batch_state.json'
+REPORT_FILE = 'batch_report.json'
+
+
+def collect_documents(inputs, manifest=None):
+    """
+    Resolve directories (searched recursively), glob patterns and file paths, plus the
+    paths listed in a manifest (a JSON list or one path per line), to a sorted list of
+    unique document paths.
+    """
+    patterns = list(inputs or [])
+    if manifest:
+        with open(manifest, 'r', encoding='utf-8') as f:
+            content = f.read()
+        if content.lstrip().startswith('['):
+            patterns.extend(json.loads(content))
+        else:
+            patterns.extend(line.strip() for line in content.splitlines() if line.strip() and not line.startswith('#'))
+
+    documents = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = glob.glob(os.path.join(pattern, '**', '*'), recursive=True)
+        else:
+            paths = glob.glob(pattern, recursive=True) or [pattern]
+        for path in paths:
+            if os.path.isfile(path) and path.lower().endswith(DOCUMENT_EXTENSIONS):
+                documents.add(os.path.abspath(path))
+    return sorted(documents)
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def options_hash(user_opt):
+    return hashlib.sha256(json.dumps(user_opt, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def output_files(documents, output_dir):
+    """<stem>_structure.json per document, with a short path hash for stems that occur more than once."""
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in documents]
+    outputs = {}
+    for path, stem in zip(documents, stems):
+        if stems.count(stem) > 1:
+            stem = f"{stem}_{hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]}"
+        outputs[path] = os.path.join(output_dir, f"{stem}_structure.json")
+    return outputs
+
+
+def default_workers(model):
+    """One process per core for API models; local models hold their weights per process, so one."""
+    try:
+        backend = resolve_backend(model)
+    except ValueError:
+        return 1
+    return (os.cpu_count() or 1) if backend == 'openai' else 1
+
+
+def index_document(doc_path, output_file, user_opt):
+    """Index one document and write its structure; runs inside a worker process."""
+    from .page_index import page_index_main
+    from .page_index_md import md_to_tree
+
+    start = time.perf_counter()
+    if doc_path.lower().endswith('.pdf'):
+        # documents are already spread over processes, parse each one serially
+        opt = ConfigLoader().load(dict(user_opt, page_parse_workers=1))
+        result = page_index_main(doc_path, opt, lazy_text=True)
+    else:
+        opt = ConfigLoader().load(user_opt)
+        result = asyncio.run(md_to_tree(
+            md_path=doc_path,
+            if_add_node_summary=opt.if_add_node_summary,
+            model=opt.model,
+            if_add_doc_description=opt.if_add_doc_description,
+            if_add_node_text=opt.if_add_node_text,
+            if_add_node_id=opt.if_add_node_id,
+        ))
+
+    tmp_file = output_file + '.tmp'
+    write_tree(result, tmp_file, compression=None)
+    os.replace(tmp_file, output_file)
+    return time.perf_counter() - start
+
+
+def _load_state(output_dir):
+    path = os.path.join(output_dir, STATE_FILE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_state(output_dir, state):
+    path = os.path.join(output_dir, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def index_corpus(documents, output_dir, user_opt=None, workers=0, force=False):
+    """
+    Index documents across a process pool and return the report that is also written
+    to <output_dir>/batch_report.json. A document is skipped when its content hash and
+    the options match the last successful run and its output file still exists.
+    workers=0 picks default_workers() for the configured model.
+    """
+    user_opt = dict(user_opt or {})
+    opt = ConfigLoader().load(user_opt)
+    if opt.llm_cache == 'clear':
+        # empty the shared cache once here, the workers then only reuse it
+        ResponseCache(opt.llm_cache_path, max_size_mb=opt.llm_cache_max_mb).clear()
+        user_opt['llm_cache'] = 'yes'
+        opt = ConfigLoader().load(user_opt)
+    # config.yaml defaults are part of the hash, editing them re-indexes the corpus
+    opt_hash = options_hash(vars(opt))
+    os.makedirs(output_dir, exist_ok=True)
+    state = _load_state(output_dir)
+    outputs = output_files(documents, output_dir)
+
+    entries = {}
+    pending = {}
+    for path in documents:
+        content_hash = file_sha256(path)
+        previous = state.get(path, {})
+        if (not force and previous.get('sha256') == content_hash and previous.get('options') == opt_hash
+                and os.path.isfile(outputs[path])):
+            entries[path] = {'document': path, 'status': 'skipped', 'output': outputs[path], 'seconds': 0.0}
+        else:
+            pending[path] = content_hash
+
+    workers = workers or default_workers(opt.model)
+    print(f'{len(documents)} documents: {len(entries)} up to date, {len(pending)} to index with {workers} workers')
+
+    start = time.perf_counter()
+    if pending:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            futures = {
+                executor.submit(index_document, path, outputs[path], user_opt): path
+                for path in pending
+            }
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    seconds = future.result()
+                    entries[path] = {'document': path, 'status': 'indexed', 'output': outputs[path], 'seconds': round(seconds, 2)}
+                    state[path] = {'sha256': pending[path], 'options': opt_hash, 'output': outputs[path]}
+                    _save_state(output_dir, state)
+                except Exception as e:
+                    entries[path] = {'document': path, 'status': 'failed', 'error': repr(e),
+                                     'traceback': traceback.format_exc(), 'seconds': None}
+                print(f"[{entries[path]['status']}] {os.path.basename(path)}")
+
+    report = {
+        'total': len(documents),
+        'indexed': sum(entry['status'] == 'indexed' for entry in entries.values()),
+        'skipped': sum(entry['status'] == 'skipped' for entry in entries.values()),
+        'failed': sum(entry['status'] == 'failed' for entry in entries.values()),
+        'wall_seconds': round(time.perf_counter() - start, 2),
+        'documents': [entries[path] for path in documents],
+    }
+    with open(os.path.join(output_dir, REPORT_FILE), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
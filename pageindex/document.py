@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+from io import BytesIO
+
+import PyPDF2
+import pymupdf
+
+
+class Document:
+    """
+    A PDF opened once from a path, bytes or BytesIO.
+
+    The parser objects are created on first use and kept, page text is extracted
+    lazily and memoized per page, so helpers that are handed the same Document
+    never re-parse the file. Page numbers follow the helpers they serve:
+    page_text()/page_texts() are 0-based like page_list, get_text_range() is
+    1-based and inclusive like get_text_of_pages().
+    """
+
+    def __init__(self, source, pdf_parser="PyPDF2"):
+        if isinstance(source, BytesIO):
+            source = source.getvalue()
+        if isinstance(source, (bytes, bytearray)):
+            self.path = None
+            self.data = bytes(source)
+        elif isinstance(source, str):
+            if not os.path.isfile(source):
+                raise ValueError(f"PDF file not found: {source}")
+            self.path = source
+            self.data = None
+        else:
+            raise ValueError(f"Unsupported PDF source: {type(source).__name__}")
+        if pdf_parser not in ("PyPDF2", "PyMuPDF"):
+            raise ValueError(f"Unsupported PDF parser: {pdf_parser}")
+        self.pdf_parser = pdf_parser
+        self._reader = None
+        self._fitz_doc = None
+        self._outline = None
+        self._page_texts = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def open(cls, source, pdf_parser="PyPDF2"):
+        """
+        Return source itself if it is already a Document (its parser is kept, helpers
+        pass theirs per call), else open it.
+        """
+        if isinstance(source, cls):
+            return source
+        return cls(source, pdf_parser=pdf_parser)
+
+    @property
+    def source(self):
+        """Path or raw bytes, cheap to send to worker processes that open their own handle."""
+        return self.path if self.path is not None else self.data
+
+    def _stream(self):
+        return self.path if self.path is not None else BytesIO(self.data)
+
+    @property
+    def reader(self):
+        with self._lock:
+            if self._reader is None:
+                self._reader = PyPDF2.PdfReader(self._stream())
+            return self._reader
+
+    @property
+    def fitz_doc(self):
+        with self._lock:
+            if self._fitz_doc is None:
+                if self.path is not None:
+                    self._fitz_doc = pymupdf.open(self.path)
+                else:
+                    self._fitz_doc = pymupdf.open(stream=self.data, filetype="pdf")
+            return self._fitz_doc
+
+    @property
+    def page_count(self):
+        if self.pdf_parser == "PyMuPDF":
+            return self.fitz_doc.page_count
+        return len(self.reader.pages)
+
+    def __len__(self):
+        return self.page_count
+
+    @property
+    def metadata(self):
+        if self.pdf_parser == "PyMuPDF":
+            return dict(self.fitz_doc.metadata or {})
+        meta = self.reader.metadata
+        return {key.lstrip('/'): value for key, value in (meta or {}).items()}
+
+    @property
+    def title(self):
+        return self.metadata.get('title') or self.metadata.get('Title') or 'Untitled'
+
+    @property
+    def name(self):
+        if self.path is not None:
+            return os.path.basename(self.path)
+        # In Linux, only '/' and '\0' are invalid in file names
+        return self.title.replace('/', '-')
+
+    def outline(self):
+        """Embedded bookmarks as [[level, title, page]] with 1-based pages, [] if there are none."""
+        with self._lock:
+            if self._outline is None:
+                try:
+                    self._outline = self.fitz_doc.get_toc(simple=True)
+                except Exception as e:
+                    logging.warning(f"Could not read the PDF outline: {e}")
+                    self._outline = []
+            return self._outline
+
+    def page_text(self, page_num, pdf_parser=None):
+        """Text of one page, 0-based; pdf_parser overrides the document's parser for this call."""
+        pdf_parser = pdf_parser or self.pdf_parser
+        with self._lock:
+            text = self._page_texts.get((pdf_parser, page_num))
+            if text is None:
+                if pdf_parser == "PyMuPDF":
+                    text = self.fitz_doc.load_page(page_num).get_text()
+                elif pdf_parser == "PyPDF2":
+                    text = self.reader.pages[page_num].extract_text()
+                else:
+                    raise ValueError(f"Unsupported PDF parser: {pdf_parser}")
+                self._page_texts[(pdf_parser, page_num)] = text
+            return text
+
+    def page_texts(self, start_page=0, end_page=None, pdf_parser=None):
+        """Text of pages [start_page, end_page), 0-based."""
+        end_page = self.page_count if end_page is None else end_page
+        return [self.page_text(page_num, pdf_parser) for page_num in range(start_page, end_page)]
+
+    def get_text_range(self, start_page, end_page, pdf_parser=None):
+        """Text of pages start_page..end_page, 1-based and inclusive."""
+        return ''.join(self.page_texts(start_page - 1, end_page, pdf_parser))
+
+    def forget_page_texts(self):
+        """Drop the memoized page text, e.g. once it has been copied to a PageStore."""
+        with self._lock:
+            self._page_texts.clear()
+
+    def close(self):
+        with self._lock:
+            if self._fitz_doc is not None:
+                self._fitz_doc.close()
+                self._fitz_doc = None
+            self._reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
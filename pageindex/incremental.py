@@ -0,0 +1,132 @@
+import difflib
+import hashlib
+import json
+import os
+import re
+import unicodedata
+
+STATE_VERSION = 1
+# fields of a TOC item kept in the index state, text and summaries are rebuilt from the pages
+STATE_ITEM_FIELDS = ('structure', 'title', 'physical_index', 'node_id')
+
+
+def page_fingerprint(page_text):
+    """Hash of a page's text that ignores whitespace and Unicode form differences from re-extraction."""
+    normalized = ' '.join(unicodedata.normalize('NFKC', page_text or '').split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def page_fingerprints(page_list):
+    return [page_fingerprint(page_text) for page_text, _ in page_list]
+
+
+def index_state_path(state_dir, doc_name):
+    return os.path.join(state_dir, f"{os.path.splitext(doc_name)[0]}.index.json")
+
+
+def load_index_state(path):
+    """Return the state saved by save_index_state, or None if there is no usable one."""
+    if not path or not os.path.isfile(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    if state.get('version') != STATE_VERSION:
+        return None
+    return state
+
+
+def save_index_state(path, page_hashes, toc_items, model):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    state = {
+        'version': STATE_VERSION,
+        'model': model,
+        'page_hashes': page_hashes,
+        'structure': [
+            {field: item[field] for field in STATE_ITEM_FIELDS if field in item}
+            for item in toc_items
+        ],
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def diff_pages(old_hashes, new_hashes):
+    """
+    Align two versions of a document page by page.
+    Returns (page_map, changes): page_map maps unchanged old pages to their new page
+    number, changes lists {'old': (start, end), 'new': (start, end)} for every edited
+    region (1-based, inclusive; an empty range has end < start).
+    """
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    page_map = {}
+    changes = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            page_map.update({i1 + k + 1: j1 + k + 1 for k in range(i2 - i1)})
+        else:
+            changes.append({'old': (i1 + 1, i2), 'new': (j1 + 1, j2)})
+    return page_map, changes
+
+
+def _depth(item):
+    return len([part for part in str(item.get('structure') or '1').split('.') if part])
+
+
+def _title_key(title):
+    return re.sub(r'\W+', ' ', unicodedata.normalize('NFKC', str(title)).lower()).strip()
+
+
+def splice_toc_items(old_items, page_map, changes, regenerated):
+    """
+    Carry the previous TOC over to the new version: items on unchanged pages are kept
+    with their node_id and moved to their new page, items on edited pages are replaced
+    by regenerated[i], the TOC generated for changes[i]['new'].
+
+    New items are placed at the depth of the items they replace (or beside the item
+    before them) and reuse the node_id of a replaced item with the same title.
+    Structure codes only encode depth and have to be renumbered by the caller.
+    """
+    toc_items = []
+    for item in old_items:
+        page = item.get('physical_index')
+        if page in page_map:
+            toc_items.append(dict(item, physical_index=page_map[page]))
+
+    node_ids = [int(item['node_id']) for item in old_items if str(item.get('node_id', '')).isdigit()]
+    id_width = max((len(item['node_id']) for item in old_items if item.get('node_id')), default=4)
+    next_node_id = max(node_ids, default=-1) + 1
+
+    for change, new_items in zip(changes, regenerated):
+        old_start, old_end = change['old']
+        new_start, new_end = change['new']
+        replaced = [item for item in old_items
+                    if isinstance(item.get('physical_index'), int) and old_start <= item['physical_index'] <= old_end]
+        new_items = [item for item in new_items if isinstance(item.get('physical_index'), int)]
+        if not new_items:
+            continue
+
+        position = next((i for i, item in enumerate(toc_items) if item['physical_index'] > new_end), len(toc_items))
+        if replaced:
+            base_depth = min(_depth(item) for item in replaced)
+        elif position > 0:
+            base_depth = _depth(toc_items[position - 1])
+        else:
+            base_depth = 1
+        min_depth = min(_depth(item) for item in new_items)
+        reusable_ids = {_title_key(item['title']): item['node_id'] for item in replaced if item.get('node_id')}
+
+        spliced = []
+        for item in new_items:
+            depth = base_depth + _depth(item) - min_depth
+            new_item = {'structure': '.'.join(['1'] * depth), 'title': item['title'], 'physical_index': item['physical_index']}
+            if node_ids:
+                node_id = reusable_ids.pop(_title_key(item['title']), None)
+                if node_id is None:
+                    node_id = str(next_node_id).zfill(id_width)
+                    next_node_id += 1
+                new_item['node_id'] = node_id
+            spliced.append(new_item)
+        toc_items[position:position] = spliced
+    return toc_items
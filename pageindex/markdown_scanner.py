@@ -0,0 +1,173 @@
+import re
+
+ATX_HEADING = re.compile(r'^ {0,3}(#{1,6})(?:[ \t]+(.*?))?[ \t]*$')
+ATX_CLOSING = re.compile(r'(?:^|[ \t]+)#+$')
+SETEXT_UNDERLINE = re.compile(r'^ {0,3}(=+|-+)[ \t]*$')
+THEMATIC_BREAK = re.compile(r'^ {0,3}([-*_])(?:[ \t]*\1){2,}[ \t]*$')
+FENCE_OPEN = re.compile(r'^ {0,3}(`{3,}|~{3,})(.*)$')
+FENCE_CLOSE = re.compile(r'^ {0,3}(`{3,}|~{3,})[ \t]*$')
+# list items and block quotes, their lines are never setext heading text
+CONTAINER_START = re.compile(r'^ {0,3}(?:[-+*]|\d{1,9}[.)])(?:[ \t]|$)|^ {0,3}>')
+FRONT_MATTER_OPEN = '---'
+FRONT_MATTER_CLOSE = ('---', '...')
+
+HTML_BLOCK_TAGS = (
+    'address|article|aside|base|basefont|blockquote|body|caption|center|col|colgroup|dd|details|'
+    'dialog|dir|div|dl|dt|fieldset|figcaption|figure|footer|form|frame|frameset|h1|h2|h3|h4|h5|h6|'
+    'head|header|hr|html|iframe|legend|li|link|main|menu|menuitem|nav|noframes|ol|optgroup|option|'
+    'p|param|search|section|summary|table|tbody|td|tfoot|th|thead|title|tr|track|ul'
+)
+BLANK_LINE = None
+# (start, end, can interrupt a paragraph) for the CommonMark HTML block kinds;
+# end BLANK_LINE means the block runs until the next blank line
+HTML_BLOCKS = (
+    (re.compile(r'^ {0,3}<(?:script|pre|style|textarea)(?:[ \t>]|$)', re.I),
+     re.compile(r'</(?:script|pre|style|textarea)>', re.I), True),
+    (re.compile(r'^ {0,3}<!--'), re.compile(r'-->'), True),
+    (re.compile(r'^ {0,3}<\?'), re.compile(r'\?>'), True),
+    (re.compile(r'^ {0,3}<![A-Za-z]'), re.compile(r'>'), True),
+    (re.compile(r'^ {0,3}<!\[CDATA\['), re.compile(r'\]\]>'), True),
+    (re.compile(rf'^ {{0,3}}</?(?:{HTML_BLOCK_TAGS})(?:[ \t]|/?>|$)', re.I), BLANK_LINE, True),
+    (re.compile(r'^ {0,3}(?:<[A-Za-z][A-Za-z0-9-]*(?:[ \t][^<>]*)?/?>|</[A-Za-z][A-Za-z0-9-]*[ \t]*>)[ \t]*$'),
+     BLANK_LINE, False),
+)
+
+
+def _indent_width(line):
+    width = 0
+    for char in line:
+        if char == ' ':
+            width += 1
+        elif char == '\t':
+            width += 4 - width % 4
+        else:
+            break
+    return width
+
+
+class MarkdownScanner:
+    """
+    Line-by-line block tokenizer that finds the section headings of a markdown document.
+
+    Recognizes ATX (#) and setext (=== / ---) headings and skips everything that only
+    looks like one: fenced code (``` and ~~~), indented code, HTML blocks and YAML
+    front matter. Feed it the lines in order, without their newline; it keeps a
+    constant amount of state besides the text of the current paragraph, so a document
+    is scanned in one pass. Headings are dicts with node_title, level, line_num
+    (1-based, the first text line for setext headings) and offset, the character
+    offset of that line in the document.
+    """
+
+    def __init__(self):
+        self.line_num = 0
+        self.offset = 0
+        self.fence = None
+        self.html_end = None
+        self.in_html = False
+        self.paragraph = None
+        self.front_matter = None
+
+    def feed(self, line):
+        """Scan the next line, return the headings it completes (zero or one)."""
+        self.line_num += 1
+        line_num, offset = self.line_num, self.offset
+        self.offset += len(line) + 1
+
+        if self.front_matter is not None:
+            self.front_matter.append((line, line_num, offset))
+            if line_num > 1 and line.rstrip() in FRONT_MATTER_CLOSE:
+                self.front_matter = None
+            return []
+        if line_num == 1 and line.rstrip() == FRONT_MATTER_OPEN:
+            self.front_matter = [(line, line_num, offset)]
+            return []
+        return self._scan_line(line, line_num, offset)
+
+    def close(self):
+        """Finish the document, return the headings still pending."""
+        headings = []
+        if self.front_matter:
+            # the opening --- was never closed, so it was a thematic break after all
+            buffered, self.front_matter = self.front_matter, None
+            for line, line_num, offset in buffered:
+                headings.extend(self._scan_line(line, line_num, offset))
+        return headings
+
+    def _scan_line(self, line, line_num, offset):
+        line = line.rstrip('\r')
+        stripped = line.strip()
+
+        if self.fence is not None:
+            match = FENCE_CLOSE.match(line)
+            if match and match.group(1)[0] == self.fence[0] and len(match.group(1)) >= len(self.fence):
+                self.fence = None
+            return []
+
+        if self.in_html:
+            if self.html_end is BLANK_LINE:
+                self.in_html = bool(stripped)
+            elif self.html_end.search(line):
+                self.in_html = False
+            return []
+
+        if not stripped:
+            self.paragraph = None
+            return []
+
+        if _indent_width(line) >= 4:
+            # indented code, unless it continues a paragraph
+            if self.paragraph is not None:
+                self.paragraph['lines'].append(stripped)
+            return []
+
+        match = FENCE_OPEN.match(line)
+        if match and not (match.group(1)[0] == '`' and '`' in match.group(2)):
+            self.fence = match.group(1)
+            self.paragraph = None
+            return []
+
+        paragraph, self.paragraph = self.paragraph, None
+        if paragraph is not None and paragraph['setext']:
+            match = SETEXT_UNDERLINE.match(line)
+            if match:
+                title = ' '.join(paragraph['lines'])
+                level = 1 if match.group(1)[0] == '=' else 2
+                return [self._heading(title, level, paragraph['line_num'], paragraph['offset'])]
+
+        match = ATX_HEADING.match(line)
+        if match:
+            title = ATX_CLOSING.sub('', match.group(2) or '').strip()
+            if not title:
+                return []
+            return [self._heading(title, len(match.group(1)), line_num, offset)]
+
+        if THEMATIC_BREAK.match(line):
+            return []
+
+        for start, end, interrupts_paragraph in HTML_BLOCKS:
+            match = start.match(line)
+            if match and (paragraph is None or interrupts_paragraph):
+                self.html_end = end
+                self.in_html = end is BLANK_LINE or not end.search(line, match.end())
+                return []
+
+        if CONTAINER_START.match(line):
+            self.paragraph = {'lines': [stripped], 'line_num': line_num, 'offset': offset, 'setext': False}
+        elif paragraph is None:
+            self.paragraph = {'lines': [stripped], 'line_num': line_num, 'offset': offset, 'setext': True}
+        else:
+            paragraph['lines'].append(stripped)
+            self.paragraph = paragraph
+        return []
+
+    @staticmethod
+    def _heading(title, level, line_num, offset):
+        return {'node_title': title, 'level': level, 'line_num': line_num, 'offset': offset}
+
+
+def iter_markdown_headings(lines):
+    """Stream the headings of an iterable of lines (without newlines), e.g. a file being read."""
+    scanner = MarkdownScanner()
+    for line in lines:
+        yield from scanner.feed(line)
+    yield from scanner.close()
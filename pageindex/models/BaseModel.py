@@ -1,10 +1,66 @@
 class BaseModel:
+    # tokens of prompt and reply together, wrappers set their model's limit
+    context_window = 8192
+
     def __init__(self, model_name):
         self.model_name = model_name
+        # ResponseCache shared by all models, set by the model registry
+        self.cache = None
 
-    def generate(self, prompt, chat_history=None):
-        pass
+    def generation_params(self):
+        """Generation settings that change the output; part of the response cache key."""
+        return {}
+
+    def context_limits(self):
+        """(context window, tokens reserved for the reply), what prompt packing has to fit in."""
+        return self.context_window, self.generation_params().get('max_new_tokens', 2048)
+
+    def is_deterministic(self):
+        params = self.generation_params()
+        return params.get('temperature') == 0 or params.get('do_sample') is False
+
+    def _cache_key(self, prompt, chat_history=None):
+        params = dict(self.generation_params(), dtype=getattr(self, 'dtype', None))
+        return self.cache.make_key(self.model_name, prompt, chat_history, params)
+
+    def _use_cache(self):
+        return self.cache is not None and self.is_deterministic()
+
+    def generate(self, prompt, chat_history=None, include_finish_reason=False):
+        if not self._use_cache():
+            return self._generate(prompt, chat_history=chat_history, include_finish_reason=include_finish_reason)
+
+        # the key is taken before _generate, which may append the prompt to chat_history
+        key = self._cache_key(prompt, chat_history)
+        cached = self.cache.get(key)
+        if cached is not None and (cached[1] is not None or not include_finish_reason):
+            response, finish_reason = cached
+            return (response, finish_reason) if include_finish_reason else response
+
+        result = self._generate(prompt, chat_history=chat_history, include_finish_reason=True)
+        if not isinstance(result, tuple):
+            # failed calls return a bare "Error" string and are never cached
+            return result
+        response, finish_reason = result
+        self.cache.set(key, self.model_name, response, finish_reason)
+        return (response, finish_reason) if include_finish_reason else response
 
     async def generate_async(self, prompt):
+        if not self._use_cache():
+            return await self._generate_async(prompt)
+
+        key = self._cache_key(prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached[0]
+
+        response = await self._generate_async(prompt)
+        if response != "Error":
+            self.cache.set(key, self.model_name, response)
+        return response
+
+    def _generate(self, prompt, chat_history=None, include_finish_reason=False):
         pass
 
+    async def _generate_async(self, prompt):
+        pass
@@ -3,19 +3,106 @@ import openai
 import logging
 import time
 import asyncio
+import threading
+import weakref
+from contextlib import nullcontext
+
+from .rate_limiter import backoff_delay
+from .tokenizer_registry import count_tokens_many
+
+
+# (model name prefix, context window, max output tokens), the longest matching prefix wins
+OPENAI_CONTEXT_LIMITS = (
+    ('gpt-3.5-turbo', 16385, 4096),
+    ('gpt-4', 8192, 4096),
+    ('gpt-4-turbo', 128000, 4096),
+    ('gpt-4o', 128000, 16384),
+    ('gpt-4.1', 1047576, 32768),
+    ('gpt-5', 400000, 128000),
+    ('o1', 200000, 100000),
+    ('o3', 200000, 100000),
+    ('o4', 200000, 100000),
+)
+DEFAULT_OPENAI_CONTEXT_LIMITS = (128000, 16384)
 
 
 class GPTModel(BaseModel):
-    def __init__(self, model_name, api_key, max_retries=10, sleep_time=15):
+    def __init__(self, model_name, api_key, max_retries=10, sleep_time=15, base_url=None, base_delay=1.0,
+                 rate_limiter=None):
         super().__init__(model_name)
         self.api_key = api_key
+        self.base_url = base_url
         self.client = None
         self.max_retries = max_retries
+        # upper bound of the backoff between retries
         self.sleep_time = sleep_time
+        self.base_delay = base_delay
+        # RateLimiter shared by the sync and async paths, set by the model registry
+        self.rate_limiter = rate_limiter
+        # one pooled async client per event loop, its connections are bound to the loop;
+        # the entry goes away with the loop and the client is closed when the loop shuts down
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._client_lock = threading.Lock()
+
+    def generation_params(self):
+        return {"temperature": 0}
+
+    def context_limits(self):
+        name = self.model_name.lower().split('/')[-1]
+        matches = [limits for limits in OPENAI_CONTEXT_LIMITS if name.startswith(limits[0])]
+        if not matches:
+            return DEFAULT_OPENAI_CONTEXT_LIMITS
+        _, context_window, max_output_tokens = max(matches, key=lambda limits: len(limits[0]))
+        return context_window, max_output_tokens
+
+    def _get_client(self):
+        with self._client_lock:
+            if self.client is None:
+                # retries are done here, with the rate limiter and Retry-After in mind
+                self.client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+            return self.client
+
+    async def _get_async_client(self):
+        loop = asyncio.get_running_loop()
+        entry = self._async_clients.get(loop)
+        if entry is None:
+            client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+            closer = self._close_with_loop(loop, client)
+            entry = self._async_clients[loop] = (client, closer)
+            # started on the loop, the generator is finalized by loop.shutdown_asyncgens(),
+            # which asyncio.run calls before closing the loop
+            await closer.__anext__()
+        return entry[0]
+
+    async def _close_with_loop(self, loop, client):
+        try:
+            yield
+        finally:
+            self._async_clients.pop(loop, None)
+            await client.close()
 
-    def generate(self, prompt, chat_history=None, include_finish_reason=False):
-        if self.client is None:
-            self.client = openai.OpenAI(api_key=self.api_key)
+    def _limit(self, messages):
+        if self.rate_limiter is None:
+            return nullcontext({})
+        return self.rate_limiter.limit(self._prompt_tokens(messages))
+
+    def _limit_async(self, messages):
+        if self.rate_limiter is None:
+            return nullcontext({})
+        return self.rate_limiter.limit_async(self._prompt_tokens(messages))
+
+    def _prompt_tokens(self, messages):
+        if self.rate_limiter.tokens is None:
+            return 0
+        return sum(count_tokens_many([message["content"] for message in messages], model=self.model_name))
+
+    @staticmethod
+    def _completion_tokens(response):
+        usage = getattr(response, "usage", None)
+        return getattr(usage, "completion_tokens", 0) or 0
+
+    def _generate(self, prompt, chat_history=None, include_finish_reason=False):
+        client = self._get_client()
         for i in range(self.max_retries):
             try:
                 if chat_history:
@@ -24,11 +111,13 @@ class GPTModel(BaseModel):
                 else:
                     messages = [{"role": "user", "content": prompt}]
 
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,
-                    temperature=0,
-                )
+                with self._limit(messages) as usage:
+                    response = client.chat.completions.create(
+                        model=self.model_name,
+                        messages=messages,
+                        **self.generation_params(),
+                    )
+                    usage["extra_tokens"] = self._completion_tokens(response)
                 if include_finish_reason:
                     if response.choices[0].finish_reason == "length":
                         return response.choices[0].message.content, "max_output_reached"
@@ -41,29 +130,36 @@ class GPTModel(BaseModel):
                 print("************* Retrying *************")
                 logging.error(f"Error: {e}")
                 if i < self.max_retries - 1:
-                    print('Sleeping for', self.sleep_time)
-                    time.sleep(self.sleep_time)  # Wait for 1秒 before retrying
+                    if chat_history:
+                        # the prompt is appended again on the next attempt
+                        chat_history.pop()
+                    delay = backoff_delay(i, self.base_delay, self.sleep_time, error=e)
+                    print(f'Sleeping for {delay:.1f}s')
+                    time.sleep(delay)
                 else:
                     logging.error("Max retries reached for prompt: " + prompt)
                     return "Error"
 
-    async def generate_async(self, prompt):
+    async def _generate_async(self, prompt):
         messages = [{"role": "user", "content": prompt}]
+        client = await self._get_async_client()
         for i in range(self.max_retries):
             try:
-                async with openai.AsyncOpenAI(api_key=self.api_key) as client:
+                async with self._limit_async(messages) as usage:
                     response = await client.chat.completions.create(
                         model=self.model_name,
                         messages=messages,
-                        temperature=0,
+                        **self.generation_params(),
                     )
-                    return response.choices[0].message.content
+                    usage["extra_tokens"] = self._completion_tokens(response)
+                return response.choices[0].message.content
             except Exception as e:
                 print("************* Retrying *************")
                 logging.error(f"Error: {e}")
                 if i < self.max_retries - 1:
-                    print('Sleeping for', self.sleep_time)
-                    await asyncio.sleep(self.sleep_time)  # Wait for 1s before retrying
+                    delay = backoff_delay(i, self.base_delay, self.sleep_time, error=e)
+                    print(f'Sleeping for {delay:.1f}s')
+                    await asyncio.sleep(delay)
                 else:
                     logging.error("Max retries reached for prompt: " + prompt)
                     return "Error"
@@ -1,18 +1,52 @@
 from .BaseModel import BaseModel
-from transformers import GPT2Tokenizer, GPT2Model, GPT2LMHeadModel
+from transformers import GPT2LMHeadModel
+from .tokenizer_registry import get_hf_tokenizer
+from .inference_worker import InferenceWorker, hf_generate_batch
 import logging
 
 class GPT2Model(BaseModel):
-    def __init__(self, model_name='gpt2'):
+    context_window = 1024
+
+    def __init__(self, model_name='gpt2', max_new_tokens=8192, max_in_flight=16, max_batch_size=8, max_wait_ms=20):
         super().__init__(model_name)
         self.client = None
+        self.tokenizer = None
+        self.max_new_tokens = max_new_tokens
+        # concurrent prompts are collected into micro-batches and generated together
+        self.worker = InferenceWorker(
+            name=f"{model_name}-inference",
+            max_in_flight=max_in_flight,
+            batch_fn=self._generate_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+        )
     
     def _load_model(self):
         if self.client is None:
-            self.tokenizer = GPT2Tokenizer.from_pretrained('gpt2')
-            self.client = GPT2LMHeadModel.from_pretrained('gpt2')
-    def generate(self, prompt, chat_history=None, include_finish_reason=False):
+            self.tokenizer = get_hf_tokenizer(self.model_name)
+            self.client = GPT2LMHeadModel.from_pretrained(self.model_name)
+
+    def context_limits(self):
+        # max_new_tokens can exceed the 1024 positions of GPT-2, keep half of them for the prompt
+        return self.context_window, min(self.max_new_tokens, self.context_window // 2)
+
+    def generation_params(self):
+        return {"max_new_tokens": self.max_new_tokens, "repetition_penalty": 1.2, "do_sample": False}
+
+    def _generate_batch(self, prompts):
+        # runs on the worker thread with every prompt collected in the current batch window
         self._load_model()
+        logging.debug(f"Using device: {self.client.device}, batch size: {len(prompts)}")
+        batch_output_ids = hf_generate_batch(
+            self.client,
+            self.tokenizer,
+            prompts,
+            pad_token_id=self.tokenizer.eos_token_id,
+            **self.generation_params(),
+        )
+        return [self.tokenizer.decode(output_ids, skip_special_tokens=True) for output_ids in batch_output_ids]
+
+    def _generate(self, prompt, chat_history=None, include_finish_reason=False):
         try:
             if chat_history:
                 messages = chat_history
@@ -26,17 +60,10 @@ class GPT2Model(BaseModel):
             #     add_generation_prompt=True,
             # )
 
-            print('DEVICE:', self.client.device)
-            model_inputs = self.tokenizer(prompt, return_tensors="pt")
-
-            # conduct text completion
-            generated_ids = self.client.generate(**model_inputs, max_new_tokens=8192, repetition_penalty=1.2, pad_token_id=self.tokenizer.eos_token_id)
-            output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist() 
-            response = self.tokenizer.decode(output_ids, skip_special_tokens=True)
-            # response = self.client(**model_inputs)
+            response = self.worker.run_batch_item_sync(prompt)
             output_tokens = len(self.tokenizer.encode(response))
             if include_finish_reason:
-                if output_tokens >= 8192:
+                if output_tokens >= self.max_new_tokens:
                     return response, "max_output_reached"
                 else:
                     return response, "finished"
@@ -47,24 +74,10 @@ class GPT2Model(BaseModel):
             logging.error(f"Error: {e}")
             return "Error"
         
-    def generate_async(self, prompt):
-        self._load_model()
+    async def _generate_async(self, prompt):
         try:
-            messages = [{"role": "user", "content": prompt}]
-            text = self.tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True,
-            )
-            model_inputs = self.tokenizer([text], return_tensors="pt").to('cuda')
-
-            # conduct text completion
-            generated_ids = self.client.generate(**model_inputs, max_new_tokens=8192)
-            output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist() 
-            response = self.tokenizer.decode(output_ids, skip_special_tokens=True)
-
-            return response
-
+            # awaits the batched generate on the inference thread, not on the event loop
+            return await self.worker.run_batch_item(prompt)
         except Exception as e:
             logging.error(f"Error: {e}")
             return "Error"
@@ -75,4 +88,3 @@ if __name__ == "__main__":
     prompt = "what is ChatGPT?"
     response = model.generate(prompt)
     print(response)
-
@@ -1,20 +1,30 @@
 from .BaseModel import BaseModel
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM
+from .tokenizer_registry import get_hf_tokenizer
+from .inference_worker import InferenceWorker, hf_generate_batch
 import logging
 import asyncio
 
 
 class LlamaModel(BaseModel):
-    def __init__(self, model_name="meta-llama/Llama-3.1-8B"):
+    def __init__(self, model_name="meta-llama/Llama-3.1-8B", dtype="auto", max_in_flight=16, max_batch_size=8, max_wait_ms=20):
         super().__init__(model_name)
+        self.dtype = dtype
         self.client = None
         self.tokenizer = None
+        # concurrent prompts are collected into micro-batches and generated together
+        self.worker = InferenceWorker(
+            name=f"{model_name}-inference",
+            max_in_flight=max_in_flight,
+            batch_fn=self._generate_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+        )
 
-    def _load_model(self):
+    def _load_tokenizer(self):
 
-        if self.client is None:
-            logging.info(f"Loading model: {self.model_name}")
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        if self.tokenizer is None:
+            self.tokenizer = get_hf_tokenizer(self.model_name)
 
             if not getattr(self.tokenizer, "chat_template", None):
                 logging.warning("No chat_template found — using default template.")
@@ -31,21 +41,40 @@ class LlamaModel(BaseModel):
                     "{% endfor %}"
                     "<|start_header_id|>assistant<|end_header_id|>\n"
                 )
+        return self.tokenizer
 
+    def _load_model(self):
+
+        if self.client is None:
+            logging.info(f"Loading model: {self.model_name}")
+            self._load_tokenizer()
             self.client = AutoModelForCausalLM.from_pretrained(
                 self.model_name,
-                torch_dtype="auto",
+                torch_dtype=self.dtype,
                 device_map="auto"
             )
             logging.info("Model loaded successfully.")
 
+    def context_limits(self):
+        params = self.generation_params()
+        return params["max_length"], params["max_new_tokens"]
+
+    def generation_params(self):
+        return {
+            "max_new_tokens": 512,
+            "max_length": 4096,
+            "do_sample": True,
+            "temperature": 0.7,
+            "top_p": 0.9,
+        }
+
     def _prepare_prompt(self, prompt, chat_history=None):
 
         messages = chat_history.copy() if chat_history else []
         messages.append({"role": "user", "content": prompt})
 
         try:
-            text = self.tokenizer.apply_chat_template(
+            text = self._load_tokenizer().apply_chat_template(
                 messages, tokenize=False, add_generation_prompt=True
             )
         except Exception as e:
@@ -58,64 +87,41 @@ class LlamaModel(BaseModel):
 
         return text
 
-    def generate(self, prompt, chat_history=None, include_finish_reason=False):
-
+    def _generate_batch(self, texts):
+        # runs on the worker thread with every prompt collected in the current batch window
         self._load_model()
+        logging.debug(f"Using device: {self.client.device}, batch size: {len(texts)}")
+        batch_output_ids = hf_generate_batch(
+            self.client,
+            self.tokenizer,
+            texts,
+            pad_token_id=self.tokenizer.eos_token_id,
+            **self.generation_params(),
+        )
+        return [self.tokenizer.decode(output_ids, skip_special_tokens=True) for output_ids in batch_output_ids]
+
+    def _generate(self, prompt, chat_history=None, include_finish_reason=False):
+
         try:
             text = self._prepare_prompt(prompt, chat_history)
-            model_inputs = self.tokenizer([text], return_tensors="pt").to(self.client.device)
-
-            logging.debug(f"Using device: {self.client.device}")
-            generated_ids = self.client.generate(
-                **model_inputs,
-                max_new_tokens=512,
-                max_length=4096,
-                do_sample=True,
-                temperature=0.7,
-                top_p=0.9,
-                pad_token_id=self.tokenizer.eos_token_id,
-            )
-
-            output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist()
-            response = self.tokenizer.decode(output_ids, skip_special_tokens=True)
-
-            if include_finish_reason:
-                output_tokens = len(self.tokenizer.encode(response))
-                reason = "max_output_reached" if output_tokens >= 8192 else "finished"
-                return response.strip(), reason
-
-            return response.strip()
-
+            response = self.worker.run_batch_item_sync(text)
         except Exception:
             logging.exception("Error during text generation.")
             return "Error"
 
-    async def generate_async(self, prompt):
-        self._load_model()
-        try:
-            text = self._prepare_prompt(prompt)
-            model_inputs = self.tokenizer([text], return_tensors="pt").to(self.client.device)
-
-            logging.debug(f"Using device: {self.client.device}")
-            generated_ids = self.client.generate(
-                **model_inputs,
-                max_new_tokens=512,
-                max_length=4096,
-                do_sample=True,
-                temperature=0.7,
-                top_p=0.9,
-                pad_token_id=self.tokenizer.eos_token_id,
-            )
+        if include_finish_reason:
+            output_tokens = len(self.tokenizer.encode(response, add_special_tokens=False))
+            reason = "max_output_reached" if output_tokens >= self.generation_params()["max_new_tokens"] else "finished"
+            return response.strip(), reason
 
-            output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist()
-            response = self.tokenizer.decode(output_ids, skip_special_tokens=True)
+        return response.strip()
 
-            output_tokens = len(self.tokenizer.encode(response))
-            reason = "max_output_reached" if output_tokens >= 8192 else "finished"
+    async def _generate_async(self, prompt):
+        try:
+            text = self._prepare_prompt(prompt)
+            # awaits the batched generate on the inference thread, not on the event loop
+            response = await self.worker.run_batch_item(text)
             return response.strip()
-
-
-
         except Exception:
             logging.exception("Error during text generation.")
             return "Error"
@@ -1,5 +1,7 @@
 from .BaseModel import BaseModel
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM
+from .tokenizer_registry import get_hf_tokenizer
+from .inference_worker import InferenceWorker, hf_generate_batch
 import logging
 
 #modelname = Qwen/Qwen3-4B-Instruct-2507
@@ -7,39 +9,62 @@ import logging
 
 
 class QwenModel(BaseModel):
-    def __init__(self, model_name="Qwen/Qwen3-8B"):
+    # native context of Qwen3, longer contexts need rope scaling
+    context_window = 32768
+
+    def __init__(self, model_name="Qwen/Qwen3-8B", dtype="auto", max_in_flight=16, max_batch_size=8, max_wait_ms=20):
         super().__init__(model_name)
+        self.dtype = dtype
         self.client = None
+        self.tokenizer = None
+        # concurrent prompts are collected into micro-batches and generated together
+        self.worker = InferenceWorker(
+            name=f"{model_name}-inference",
+            max_in_flight=max_in_flight,
+            batch_fn=self._generate_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+        )
+
+    def _load_tokenizer(self):
+        if self.tokenizer is None:
+            self.tokenizer = get_hf_tokenizer(self.model_name)
+        return self.tokenizer
 
     def _load_model(self):
         if self.client is None:
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self._load_tokenizer()
             self.client = AutoModelForCausalLM.from_pretrained(
-                self.model_name, dtype="auto", device_map="auto"
+                self.model_name, dtype=self.dtype, device_map="auto"
             )
 
-    def generate(self, prompt, chat_history=None, include_finish_reason=False):
-        self._load_model()
-        try:
-            if chat_history:
-                messages = chat_history
-                messages.append({"role": "user", "content": prompt})
-            else:
-                messages = [{"role": "user", "content": prompt}]
+    def generation_params(self):
+        # sampling settings come from the model's generation_config (Qwen3 samples),
+        # so responses are not deterministic and bypass the response cache
+        return {"max_new_tokens": 2048}
 
-            text = self.tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True,
-                enable_thinking=False
-            )
-            print('DEVICE:', self.client.device)
-            model_inputs = self.tokenizer([text], return_tensors="pt").to(self.client.device)
+    def _prepare_prompt(self, prompt, chat_history=None):
+        if chat_history:
+            messages = chat_history
+            messages.append({"role": "user", "content": prompt})
+        else:
+            messages = [{"role": "user", "content": prompt}]
+
+        return self._load_tokenizer().apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True,
+            enable_thinking=False
+        )
 
-            # conduct text completion
-            generated_ids = self.client.generate(**model_inputs, max_new_tokens=2048)
-            output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist() 
+    def _generate_batch(self, texts):
+        # runs on the worker thread with every prompt collected in the current batch window
+        self._load_model()
+        logging.debug(f"Using device: {self.client.device}, batch size: {len(texts)}")
+        batch_output_ids = hf_generate_batch(self.client, self.tokenizer, texts, **self.generation_params())
 
+        responses = []
+        for output_ids in batch_output_ids:
             # parsing thinking content
             try:
                 # rindex finding 151668 (</think>)
@@ -48,55 +73,29 @@ class QwenModel(BaseModel):
                 index = 0
 
             # thinking_content = self.tokenizer.decode(output_ids[:index], skip_special_tokens=True).strip("\n")
-            response = self.tokenizer.decode(output_ids[index:], skip_special_tokens=True).strip("\n")
-            # response = self.tokenizer.decode(output_ids, skip_special_tokens=True)
-
-            if include_finish_reason:
-                if len(response) >= 30000:
-                    return response, "max_output_reached"
-                else:
-                    return response, "finished"
-            output_tokens = len(self.tokenizer.encode(response))
-            if include_finish_reason:
-                if output_tokens >= 30000:
-                    return response, "max_output_reached"
-                else:
-                    return response, "finished"
-            else:
-                return response
+            responses.append(self.tokenizer.decode(output_ids[index:], skip_special_tokens=True).strip("\n"))
+        return responses
 
+    def _generate(self, prompt, chat_history=None, include_finish_reason=False):
+        try:
+            text = self._prepare_prompt(prompt, chat_history)
+            response = self.worker.run_batch_item_sync(text)
         except Exception as e:
             logging.error(f"Error: {e}")
             return "Error"
 
-    async def generate_async(self, prompt):
-        self._load_model()
-        try:
-            messages = [{"role": "user", "content": prompt}]
-            text = self.tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True,
-                enable_thinking=False
-            )
-            model_inputs = self.tokenizer([text], return_tensors="pt").to(self.client.device)
-
-            # conduct text completion
-            generated_ids = self.client.generate(**model_inputs, max_new_tokens=2048)
-            output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist() 
-
-            # parsing thinking content
-            try:
-                # rindex finding 151668 (</think>)
-                index = len(output_ids) - output_ids[::-1].index(151668)
-            except ValueError:
-                index = 0
-
-            # thinking_content = self.tokenizer.decode(output_ids[:index], skip_special_tokens=True).strip("\n")
-            response = self.tokenizer.decode(output_ids[index:], skip_special_tokens=True).strip("\n")
-
-            return response
+        if include_finish_reason:
+            if len(response) >= 30000:
+                return response, "max_output_reached"
+            else:
+                return response, "finished"
+        return response
 
+    async def _generate_async(self, prompt):
+        try:
+            text = self._prepare_prompt(prompt)
+            # awaits the batched generate on the inference thread, not on the event loop
+            return await self.worker.run_batch_item(text)
         except Exception as e:
             logging.error(f"Error: {e}")
             return "Error"
@@ -106,4 +105,4 @@ if __name__ == "__main__":
     model = QwenModel()
     prompt = "Explain the theory of relativity."
     response = model.generate(prompt)
-    print(response)
\ No newline at end of file
+    print(response)
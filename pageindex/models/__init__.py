@@ -1,4 +1,8 @@
 from .GPT import GPTModel
 from .Qwen import QwenModel
 from .GPT2 import GPT2Model
-from .Llama import LlamaModel
\ No newline at end of file
+from .Llama import LlamaModel
+from .tokenizer_registry import get_hf_tokenizer, get_encoder, count_tokens_many
+from .registry import get_model, resolve_backend, set_response_cache, get_response_cache, set_rate_limiter, get_rate_limiter
+from .response_cache import ResponseCache
+from .rate_limiter import RateLimiter
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+
+class InferenceWorker:
+    """
+    Runs batched inference for a local model on one dedicated thread.
+
+    Items sent with submit_batch_item() are put on a queue and micro-batched: the
+    worker waits up to max_wait_ms after the first item for more items and calls
+    batch_fn(items) once with at most max_batch_size of them. batch_fn must return
+    one result per item, in order. Results are concurrent futures; run_batch_item()
+    resolves them back into the caller's event loop, so awaiting a local model does
+    not block the loop, and queues at most max_in_flight items per event loop.
+    """
+
+    def __init__(self, name="inference-worker", max_in_flight=8, batch_fn=None, max_batch_size=8, max_wait_ms=20):
+        if batch_fn is None:
+            raise ValueError(f"{name} needs a batch_fn")
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            results = self.batch_fn([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"batch_fn returned {len(results)} results for {len(batch)} items")
+        except BaseException as e:
+            logging.error(f"{self.name}: batched inference of {len(batch)} items failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def submit_batch_item(self, item):
+        """Queue one item for batch_fn and return a concurrent Future for its result."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def run_batch_item_sync(self, item):
+        """Block until the batch_fn result for one item is ready."""
+        if threading.current_thread() is self._thread:
+            # the worker would wait for a batch only it can run
+            raise RuntimeError(f"{self.name}: blocking inference call from the worker thread itself")
+        return self.submit_batch_item(item).result()
+
+    def _get_semaphore(self):
+        # asyncio primitives are bound to one loop, and every asyncio.run() creates a new one
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def run_batch_item(self, item):
+        """Await the batch_fn result for one item."""
+        async with self._get_semaphore():
+            return await asyncio.wrap_future(self.submit_batch_item(item))
+
+
+# the tokenizers are shared through the registry, padding settings are only changed under this lock
+_padding_lock = threading.Lock()
+
+
+def hf_generate_batch(client, tokenizer, texts, **generation_kwargs):
+    """
+    Left-pad texts into one batch, run a single HF generate and return the
+    newly generated token ids of every row, without trailing padding.
+    The tokenizer's pad token and padding side are restored afterwards.
+    """
+    with _padding_lock:
+        saved = tokenizer.pad_token, tokenizer.padding_side
+        try:
+            if tokenizer.pad_token_id is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            # decoder-only models must be padded on the left so every row continues from its last token
+            tokenizer.padding_side = "left"
+            generation_kwargs.setdefault("pad_token_id", tokenizer.pad_token_id)
+            model_inputs = tokenizer(texts, return_tensors="pt", padding=True)
+        finally:
+            tokenizer.pad_token, tokenizer.padding_side = saved
+
+    model_inputs = model_inputs.to(client.device)
+    generated_ids = client.generate(**model_inputs, **generation_kwargs)
+
+    prompt_length = model_inputs.input_ids.shape[1]
+    batch_output_ids = []
+    for row in generated_ids:
+        output_ids = row[prompt_length:].tolist()
+        while output_ids and output_ids[-1] == generation_kwargs["pad_token_id"]:
+            output_ids.pop()
+        batch_output_ids.append(output_ids)
+    return batch_output_ids
@@ -0,0 +1,167 @@
+import asyncio
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+
+class _TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount can be taken; 0 if it can be taken now."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Request and token budget for an API, shared by threads and event loops.
+
+    requests_per_minute and tokens_per_minute are token buckets refilled
+    continuously; max_concurrency caps the requests in flight. None disables
+    a limit. A caller over budget sleeps exactly until the buckets have refilled
+    enough, one at the concurrency cap until a request is released. The sync path
+    blocks, the async path awaits, so both can share one limiter without blocking
+    an event loop.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_concurrency=None):
+        self.requests = _TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = _TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency or None
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        # wake-up callbacks of callers waiting for a free request slot
+        self._slot_waiters = []
+
+    def _try_acquire_locked(self, tokens):
+        """
+        Take a slot and the budget for one request and return 0, or return the seconds
+        until the buckets cover the deficit, or None if every slot is taken.
+        """
+        if self.max_concurrency is not None and self.in_flight >= self.max_concurrency:
+            return None
+        now = time.monotonic()
+        wait = max(
+            self.requests.wait_time(1, now) if self.requests else 0.0,
+            self.tokens.wait_time(tokens, now) if self.tokens else 0.0,
+        )
+        if wait > 0:
+            return wait
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(tokens)
+        self.in_flight += 1
+        return 0.0
+
+    def acquire(self, tokens=0):
+        # loops only when another caller took the budget or slot that was waited for
+        while True:
+            with self._lock:
+                wait = self._try_acquire_locked(tokens)
+                if wait is None:
+                    released = threading.Event()
+                    self._slot_waiters.append(released.set)
+            if wait == 0:
+                return
+            if wait is None:
+                released.wait()
+            else:
+                time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                wait = self._try_acquire_locked(tokens)
+                if wait is None:
+                    released = loop.create_future()
+                    self._slot_waiters.append(lambda: _set_future_threadsafe(loop, released))
+            if wait == 0:
+                return
+            if wait is None:
+                await released
+            else:
+                await asyncio.sleep(wait)
+
+    def release(self, extra_tokens=0):
+        """Free the request slot; extra_tokens (e.g. completion tokens) are charged to the token budget."""
+        with self._lock:
+            self.in_flight -= 1
+            if self.tokens and extra_tokens:
+                self.tokens._refill(time.monotonic())
+                self.tokens.level -= extra_tokens
+            waiters, self._slot_waiters = self._slot_waiters, []
+        # every waiter retries, the ones that lose the slot wait again
+        for wake in waiters:
+            wake()
+
+    @contextmanager
+    def limit(self, tokens=0):
+        self.acquire(tokens)
+        usage = {'extra_tokens': 0}
+        try:
+            yield usage
+        finally:
+            self.release(usage['extra_tokens'])
+
+    @asynccontextmanager
+    async def limit_async(self, tokens=0):
+        await self.acquire_async(tokens)
+        usage = {'extra_tokens': 0}
+        try:
+            yield usage
+        finally:
+            self.release(usage['extra_tokens'])
+
+
+def _set_future_threadsafe(loop, future):
+    def set_result():
+        if not future.done():
+            future.set_result(None)
+    try:
+        loop.call_soon_threadsafe(set_result)
+    except RuntimeError:
+        # the waiting loop is closed already
+        pass
+
+
+def retry_after_seconds(error):
+    """The server's requested delay from a Retry-After (or retry-after-ms) header, if any."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after') is not None:
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        # HTTP-date values are rare for API rate limits, fall back to backoff
+        return None
+    return None
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0, error=None):
+    """Exponential backoff with full jitter, or the server's Retry-After when it sent one."""
+    retry_after = retry_after_seconds(error) if error is not None else None
+    if retry_after is not None:
+        return min(retry_after, max_delay)
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
@@ -0,0 +1,108 @@
+import os
+import threading
+import logging
+
+from .GPT import GPTModel
+from .GPT2 import GPT2Model
+from .Qwen import QwenModel
+from .Llama import LlamaModel
+
+_models = {}
+_response_cache = None
+_rate_limiter = None
+_lock = threading.Lock()
+
+
+def resolve_backend(model_name):
+    """Pick the model wrapper for a model name, e.g. 'Qwen/Qwen3-8B' -> 'qwen'."""
+    name = model_name.lower()
+    if name.split('/')[-1].startswith('gpt2'):
+        return 'gpt2'
+    if 'gpt' in name or 'openai' in name:
+        return 'openai'
+    if 'qwen' in name:
+        return 'qwen'
+    if 'llama' in name:
+        return 'llama'
+    raise ValueError(f"Cannot infer the backend for model '{model_name}', pass backend explicitly")
+
+
+def _create_model(backend, model_name, dtype, **kwargs):
+    if backend == 'openai':
+        kwargs.setdefault('api_key', os.getenv("CHATGPT_API_KEY"))
+        # point at an OpenAI-compatible server, e.g. a local mock in tests
+        kwargs.setdefault('base_url', os.getenv("CHATGPT_BASE_URL"))
+        kwargs.setdefault('rate_limiter', _rate_limiter)
+        return GPTModel(model_name=model_name, **kwargs)
+    if backend == 'gpt2':
+        return GPT2Model(model_name=model_name, **kwargs)
+    if backend == 'qwen':
+        return QwenModel(model_name=model_name, dtype=dtype, **kwargs)
+    if backend == 'llama':
+        return LlamaModel(model_name=model_name, dtype=dtype, **kwargs)
+    raise ValueError(f"Unsupported backend: {backend}")
+
+
+def _warn_if_uncacheable(model):
+    # only deterministic settings (GPT at temperature 0, greedy GPT2) are cached;
+    # sampling backends such as Qwen and Llama always call the model
+    if not model.is_deterministic():
+        logging.warning(f"LLM cache is enabled but {model.model_name} samples its responses, "
+                        f"they are not cached")
+
+
+def get_model(model_name, backend=None, dtype="auto", **kwargs):
+    """
+    Return the process-wide model instance for (backend, model_name, dtype).
+    The instance is created on first request; weights are still loaded lazily
+    by the wrapper on its first generate call, and only once.
+    """
+    backend = backend or resolve_backend(model_name)
+    key = (backend, model_name, dtype)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            logging.info(f"Creating shared {backend} model: {model_name}")
+            model = _create_model(backend, model_name, dtype, **kwargs)
+            model.cache = _response_cache
+            if _response_cache is not None:
+                _warn_if_uncacheable(model)
+            _models[key] = model
+    return model
+
+
+def set_response_cache(cache):
+    """Route every shared model, current and future, through cache (None disables caching)."""
+    global _response_cache
+    with _lock:
+        _response_cache = cache
+        for model in _models.values():
+            model.cache = cache
+            if cache is not None:
+                _warn_if_uncacheable(model)
+
+
+def get_response_cache():
+    return _response_cache
+
+
+def set_rate_limiter(limiter):
+    """Share limiter between every API-backed model, current and future (None removes the limits)."""
+    global _rate_limiter
+    with _lock:
+        _rate_limiter = limiter
+        for model in _models.values():
+            if isinstance(model, GPTModel):
+                model.rate_limiter = limiter
+
+
+def get_rate_limiter():
+    return _rate_limiter
+
+
+def clear_models():
+    with _lock:
+        _models.clear()
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    On-disk LLM response cache backed by SQLite.
+
+    Entries are keyed by a hash of (model, dtype, chat history, prompt, generation
+    params). Once the stored responses exceed max_size_mb, the least recently
+    used entries are evicted. The file can be shared by several processes.
+    """
+
+    def __init__(self, path="./cache/llm_responses.sqlite", max_size_mb=512):
+        self.path = path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, finish_reason TEXT, "
+            "size INTEGER, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+
+    @staticmethod
+    def make_key(model_name, prompt, chat_history=None, params=None):
+        payload = json.dumps([model_name, chat_history or [], prompt, params or {}], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return (response, finish_reason) for key, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, finish_reason FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0], row[1]
+
+    def set(self, key, model_name, response, finish_reason=None):
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, finish_reason, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, response, finish_reason, size, time.time()),
+            )
+            self._evict()
+
+    def _evict(self):
+        total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+        to_free = total_size - self.max_size_bytes
+        stale_keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            stale_keys.append((key,))
+            to_free -= size
+            if to_free <= 0:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("VACUUM")
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'size_bytes': size}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,94 @@
+import threading
+import logging
+
+DEFAULT_TOKENIZER_MODEL = "Qwen/Qwen3-8B"
+
+_hf_tokenizers = {}
+_tiktoken_encoders = {}
+_lock = threading.Lock()
+
+
+def is_openai_model(model):
+    """OpenAI models are tokenized with tiktoken, everything else with a HF tokenizer."""
+    model = model.lower()
+    return "gpt" in model or "openai" in model
+
+
+def get_hf_tokenizer(model_name=None, **kwargs):
+    """
+    Return the process-wide HF tokenizer for model_name, loading it on first use.
+    The model wrappers in pageindex.models share this instance with count_tokens.
+    """
+    model_name = model_name or DEFAULT_TOKENIZER_MODEL
+    tokenizer = _hf_tokenizers.get(model_name)
+    if tokenizer is not None:
+        return tokenizer
+    with _lock:
+        tokenizer = _hf_tokenizers.get(model_name)
+        if tokenizer is None:
+            from transformers import AutoTokenizer
+            logging.info(f"Loading tokenizer: {model_name}")
+            tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True, **kwargs)
+            _hf_tokenizers[model_name] = tokenizer
+    return tokenizer
+
+
+def get_tiktoken_encoder(model_name):
+    encoder = _tiktoken_encoders.get(model_name)
+    if encoder is not None:
+        return encoder
+    with _lock:
+        encoder = _tiktoken_encoders.get(model_name)
+        if encoder is None:
+            import tiktoken
+            try:
+                encoder = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                encoder = tiktoken.get_encoding("o200k_base")
+            _tiktoken_encoders[model_name] = encoder
+    return encoder
+
+
+def get_encoder(model=None):
+    """Return the cached encoder (tiktoken or HF) used for token counting."""
+    model = model or DEFAULT_TOKENIZER_MODEL
+    if is_openai_model(model):
+        return get_tiktoken_encoder(model)
+    return get_hf_tokenizer(model)
+
+
+def count_tokens(text, model=None):
+    if not text:
+        return 0
+    return len(get_encoder(model).encode(text))
+
+
+def count_tokens_many(texts, model=None, batch_size=256):
+    """
+    Count tokens for a list of texts in one go.
+    Uses tiktoken's encode_batch or the fast HF tokenizer's batch encode.
+    """
+    texts = list(texts)
+    counts = [0] * len(texts)
+    indices = [i for i, text in enumerate(texts) if text]
+    if not indices:
+        return counts
+
+    model = model or DEFAULT_TOKENIZER_MODEL
+    encoder = get_encoder(model)
+    for start in range(0, len(indices), batch_size):
+        batch_indices = indices[start:start + batch_size]
+        batch = [texts[i] for i in batch_indices]
+        if is_openai_model(model):
+            encoded = encoder.encode_batch(batch)
+        else:
+            encoded = encoder(batch)["input_ids"]
+        for i, ids in zip(batch_indices, encoded):
+            counts[i] = len(ids)
+    return counts
+
+
+def clear_tokenizer_cache():
+    with _lock:
+        _hf_tokenizers.clear()
+        _tiktoken_encoders.clear()
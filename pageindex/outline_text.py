@@ -0,0 +1,95 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+NUMBERING_PREFIX = re.compile(r"^\d+(?:\.\d+)*\.\s*")
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(s):
+    s = unicodedata.normalize("NFKC", s)
+    return WHITESPACE.sub(" ", s)
+
+
+@lru_cache(maxsize=4096)
+def make_title_pattern(title):
+    """Pattern for a normalized outline title, with optional section numbering and flexible whitespace."""
+    clean = NUMBERING_PREFIX.sub("", title).strip()
+    flexible = re.escape(clean).replace(r"\ ", r"\s+")
+    return re.compile(r"(?:\d+(?:\.\d+)*\.\s*)?" + flexible, flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
+
+
+class NormalizedPages:
+    """
+    The text of all pages normalized once into a single buffer, with the offset at
+    which every page starts, so a page range is a slice of the buffer instead of a
+    re-joined and re-normalized string.
+    """
+
+    def __init__(self, page_texts):
+        parts = []
+        self.page_offsets = []
+        length = 0
+        ends_with_space = False
+        for text in page_texts:
+            text = normalize(text or "")
+            # whitespace runs across a page break collapse to one space, as in the joined text
+            if ends_with_space and text.startswith(" "):
+                text = text[1:]
+            self.page_offsets.append(length)
+            parts.append(text)
+            length += len(text)
+            if text:
+                ends_with_space = text.endswith(" ")
+        self.page_offsets.append(length)
+        self.text = "".join(parts)
+
+    @property
+    def page_count(self):
+        return len(self.page_offsets) - 1
+
+    def span(self, start_page, end_page):
+        """Buffer offsets of pages start_page..end_page (1-based, inclusive, clamped to the document)."""
+        if self.page_count == 0:
+            return 0, 0
+        start_page = min(max(start_page or 1, 1), self.page_count)
+        end_page = min(max(end_page or start_page, start_page), self.page_count)
+        return self.page_offsets[start_page - 1], self.page_offsets[end_page]
+
+
+def slice_sections(pages, entries):
+    """
+    Text of every outline entry, from its title to the next entry's title.
+
+    entries are (start_page, end_page, title, next_title) in document order. One
+    forward scan assigns all boundaries: a title is searched from the end of the
+    previous title within its page range, and the next title found while closing a
+    section is reused as the start of the following one. An entry whose title is not
+    found gets the whole text of its page range.
+    """
+    texts = []
+    cursor = 0
+    carried = None
+    for start_page, end_page, title, next_title in entries:
+        lo, hi = pages.span(start_page, end_page)
+        norm_title = normalize(title)
+        if carried is not None and carried[0] == norm_title and lo <= carried[1].start() < hi:
+            match = carried[1]
+        else:
+            match = make_title_pattern(norm_title).search(pages.text, max(lo, cursor), hi)
+        carried = None
+
+        if match is None:
+            texts.append(pages.text[lo:hi].strip())
+            continue
+
+        cursor = match.end()
+        end = hi
+        if next_title:
+            norm_next = normalize(next_title)
+            next_match = make_title_pattern(norm_next).search(pages.text, match.end(), hi)
+            if next_match:
+                end = next_match.start()
+                carried = (norm_next, next_match)
+        texts.append(pages.text[match.start():end].strip())
+    return texts
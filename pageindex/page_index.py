@@ -7,18 +7,18 @@ import re
 from .utils import *
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from .toc_heuristics import classify_toc_page, toc_page_score
+from .page_offsets import fit_page_offsets, match_page_pairs, physical_index_for_page
+from .prompt_packer import iter_fitted_groups, join_group, pack_pages, prompt_token_budget
+from .incremental import (diff_pages, index_state_path, load_index_state, page_fingerprints,
+                          save_index_state, splice_toc_items)
 
 
 from .utils import *
-from pageindex.models import GPTModel, QwenModel, LlamaModel
 
 
-# llm_model = GPTModel(model_name="gpt-4o-2024-11-20", api_key=os.getenv("CHATGPT_API_KEY"))
-llm_model = QwenModel()
-# llm_model = LlamaModel()
-
 ################### check title in page #########################################################
-async def check_title_appearance(item, page_list, start_index=1, model=None):    
+async def check_title_appearance(item, page_list, start_index=1, model=None, use_matcher=True):    
     title=item['title']
     if 'physical_index' not in item or item['physical_index'] is None:
         return {'list_index': item.get('list_index'), 'answer': 'no', 'title':title, 'page_number': None}
@@ -27,6 +27,11 @@ async def check_title_appearance(item, page_list, start_index=1, model=None):
     page_number = item['physical_index']
     page_text = page_list[page_number-start_index][0]
 
+    matcher = get_title_matcher() if use_matcher else None
+    answer = matcher.appears(title, page_text) if matcher else None
+    if answer is not None:
+        return {'list_index': item.get('list_index'), 'answer': answer, 'title': title, 'page_number': page_number}
+
     
     prompt = f"""
     Your job is to check if the given section appears or starts in the given page_text.
@@ -45,7 +50,7 @@ async def check_title_appearance(item, page_list, start_index=1, model=None):
     Directly return the final JSON structure. Do not output anything else."""
 
     # response = await ChatGPT_API_async(model=model, prompt=prompt)
-    response = await llm_model.generate_async(prompt)
+    response = await get_llm(model).generate_async(prompt)
     response = extract_json(response)
     if 'answer' in response:
         answer = response['answer']
@@ -54,7 +59,101 @@ async def check_title_appearance(item, page_list, start_index=1, model=None):
     return {'list_index': item['list_index'], 'answer': answer, 'title': title, 'page_number': page_number}
 
 
+def group_items_for_verification(items, page_list, start_index=1, max_tokens=8000):
+    """
+    Group TOC items by physical_index, merging adjacent pages while the page text of
+    a group stays within max_tokens, so that one prompt can verify all of their titles.
+    """
+    by_page = {}
+    for item in items:
+        by_page.setdefault(item['physical_index'], []).append(item)
+
+    groups = []
+    group_pages, group_items, group_tokens = [], [], 0
+    for page_number in sorted(by_page):
+        page_tokens = page_list[page_number - start_index][1]
+        is_adjacent = group_pages and page_number == group_pages[-1] + 1
+        if group_pages and not (is_adjacent and group_tokens + page_tokens <= max_tokens):
+            groups.append((group_pages, group_items))
+            group_pages, group_items, group_tokens = [], [], 0
+        group_pages.append(page_number)
+        group_items.extend(by_page[page_number])
+        group_tokens += page_tokens
+    if group_pages:
+        groups.append((group_pages, group_items))
+    return groups
+
+
+async def check_titles_appearance_batch(items, page_list, start_index=1, model=None):
+    """
+    Check the titles of several TOC items against their pages with a single prompt.
+    Titles the local matcher is sure about are left out of the prompt. Falls back to
+    one check_title_appearance call per item when the reply is not a valid yes/no
+    answer for every title.
+    """
+    results = {}
+    matcher = get_title_matcher()
+    if matcher:
+        for i, item in enumerate(items):
+            answer = matcher.appears(item['title'], page_list[item['physical_index'] - start_index][0])
+            if answer is not None:
+                results[i] = {'list_index': item['list_index'], 'answer': answer, 'title': item['title'], 'page_number': item['physical_index']}
+    pending = [i for i in range(len(items)) if i not in results]
+    if pending:
+        pending_results = await _check_titles_appearance_llm([items[i] for i in pending], page_list, start_index, model)
+        results.update(zip(pending, pending_results))
+    return [results[i] for i in range(len(items))]
+
+
+async def _check_titles_appearance_llm(items, page_list, start_index=1, model=None):
+    if len(items) == 1:
+        return [await check_title_appearance(items[0], page_list, start_index, model, use_matcher=False)]
+
+    page_numbers = sorted({item['physical_index'] for item in items})
+    page_text = ''.join(
+        f"<physical_index_{page_number}>\n{page_list[page_number - start_index][0]}\n<physical_index_{page_number}>\n"
+        for page_number in page_numbers
+    )
+    title_list = '\n'.join(
+        f"{i + 1}. {item['title']} (physical_index_{item['physical_index']})" for i, item in enumerate(items)
+    )
+    prompt = f"""
+    Your job is to check, for each of the given section titles, if the section appears or starts in its page of the given page_text.
+    The pages are separated by <physical_index_X> tags, and each title is followed by the page it should be checked against.
+
+    Note: do fuzzy matching, ignore any space inconsistency in the page_text.
+
+    The given section titles are:
+    {title_list}
+
+    The given page_text is {page_text}.
+
+    Reply format:
+    {{
+        "answers": ["yes or no", ...] (one answer per title, in the same order; yes if the section appears or starts in its page, no otherwise)
+    }}
+    Directly return the final JSON structure. Do not output anything else."""
+
+    response = await get_llm(model).generate_async(prompt)
+    answers = extract_json(response).get('answers') if response != "Error" else None
+    if isinstance(answers, list):
+        answers = [str(answer).strip().lower() for answer in answers]
+    if not isinstance(answers, list) or len(answers) != len(items) or any(answer not in ('yes', 'no') for answer in answers):
+        logging.info(f'Invalid batch verification response for {len(items)} titles, checking them one by one')
+        return await asyncio.gather(*[check_title_appearance(item, page_list, start_index, model, use_matcher=False) for item in items])
+
+    return [
+        {'list_index': item['list_index'], 'answer': answer, 'title': item['title'], 'page_number': item['physical_index']}
+        for item, answer in zip(items, answers)
+    ]
+
+
 async def check_title_appearance_in_start(title, page_text, model=None, logger=None):    
+    matcher = get_title_matcher()
+    start_begin = matcher.starts(title, page_text) if matcher else None
+    if start_begin is not None:
+        return start_begin
+
     prompt = f"""
     You will be given the current section title and the current page_text.
     Your job is to check if the current section starts in the beginning of the given page_text.
@@ -74,7 +173,7 @@ async def check_title_appearance_in_start(title, page_text, model=None, logger=N
     Directly return the final JSON structure. Do not output anything else."""
 
     # response = await ChatGPT_API_async(model=model, prompt=prompt)
-    response = await llm_model.generate_async(prompt)
+    response = await get_llm(model).generate_async(prompt)
     response = extract_json(response)
     if logger:
         logger.info(f"Response: {response}")
@@ -125,7 +224,7 @@ def toc_detector_single_page(content, model=None):
     Directly return the final JSON structure. Do not output anything else.
     Please note: abstract,summary, notation list, figure list, table list, etc. are not table of contents."""
 
-    response = llm_model.generate(prompt)
+    response = get_llm(model).generate(prompt)
     print('response', response)
     json_content = extract_json(response)    
     return json_content['toc_detected']
@@ -144,7 +243,7 @@ def check_if_toc_extraction_is_complete(content, toc, model=None):
     Directly return the final JSON structure. Do not output anything else."""
 
     prompt = prompt + '\n Document:\n' + content + '\n Table of contents:\n' + toc
-    response = llm_model.generate(prompt)
+    response = get_llm(model).generate(prompt)
     json_content = extract_json(response)
     return json_content['completed']
 
@@ -162,7 +261,7 @@ def check_if_toc_transformation_is_complete(content, toc, model=None):
     Directly return the final JSON structure. Do not output anything else."""
 
     prompt = prompt + '\n Raw Table of contents:\n' + content + '\n Cleaned Table of contents:\n' + toc
-    response = llm_model.generate(prompt)
+    response = get_llm(model).generate(prompt)
     json_content = extract_json(response)
     return json_content['completed']
 
@@ -174,7 +273,7 @@ def extract_toc_content(content, model=None):
 
     Directly return the full table of contents content. Do not output anything else."""
 
-    response, finish_reason = llm_model.generate(prompt, include_finish_reason=True)
+    response, finish_reason = get_llm(model).generate(prompt, include_finish_reason=True)
     
     if_complete = check_if_toc_transformation_is_complete(content, response, model)
     if if_complete == "yes" and finish_reason == "finished":
@@ -185,7 +284,7 @@ def extract_toc_content(content, model=None):
         {"role": "assistant", "content": response},    
     ]
     prompt = f"""please continue the generation of table of contents , directly output the remaining part of the structure"""
-    new_response, finish_reason = llm_model.generate(prompt, chat_history=chat_history, include_finish_reason=True)
+    new_response, finish_reason = get_llm(model).generate(prompt, chat_history=chat_history, include_finish_reason=True)
     response = response + new_response
     if_complete = check_if_toc_transformation_is_complete(content, response, model)
     
@@ -195,7 +294,7 @@ def extract_toc_content(content, model=None):
             {"role": "assistant", "content": response},    
         ]
         prompt = f"""please continue the generation of table of contents , directly output the remaining part of the structure"""
-        new_response, finish_reason = llm_model.generate(prompt, chat_history=chat_history, include_finish_reason=True)
+        new_response, finish_reason = get_llm(model).generate(prompt, chat_history=chat_history, include_finish_reason=True)
         response = response + new_response
         if_complete = check_if_toc_transformation_is_complete(content, response, model)
         
@@ -221,7 +320,7 @@ def detect_page_index(toc_content, model=None):
     }}
     Directly return the final JSON structure. Do not output anything else."""
 
-    response = llm_model.generate(prompt)
+    response = get_llm(model).generate(prompt)
     json_content = extract_json(response)
     return json_content['page_index_given_in_toc']
 
@@ -270,7 +369,7 @@ def toc_index_extractor(toc, content, model=None):
     Directly return the final JSON structure. Do not output anything else."""
 
     prompt = tob_extractor_prompt + '\nTable of contents:\n' + str(toc) + '\nDocument pages:\n' + content
-    response = llm_model.generate(prompt)
+    response = get_llm(model).generate(prompt)
     json_content = extract_json(response)    
     return json_content
 
@@ -298,7 +397,7 @@ def toc_transformer(toc_content, model=None):
     Directly return the final JSON structure, do not output anything else. """
 
     prompt = init_prompt + '\n Given table of contents\n:' + toc_content
-    last_complete, finish_reason = llm_model.generate(prompt, include_finish_reason=True)
+    last_complete, finish_reason = get_llm(model).generate(prompt, include_finish_reason=True)
     if_complete = check_if_toc_transformation_is_complete(toc_content, last_complete, model)
     if if_complete == "yes" and finish_reason == "finished":
         last_complete = extract_json(last_complete)
@@ -322,7 +421,7 @@ def toc_transformer(toc_content, model=None):
 
         Please continue the json structure, directly output the remaining part of the json structure."""
 
-        new_complete, finish_reason = llm_model.generate(prompt, include_finish_reason=True)
+        new_complete, finish_reason = get_llm(model).generate(prompt, include_finish_reason=True)
 
         if new_complete.startswith('```json'):
             new_complete =  get_json_content(new_complete)
@@ -339,8 +438,42 @@ def toc_transformer(toc_content, model=None):
 
 
 
-def find_toc_pages(start_page_index, page_list, opt, logger=None):
+def detect_toc_pages(page_indices, page_list, opt, outline_titles=None, logger=None):
+    """
+    Return {page_index: 'yes' | 'no'} for the given pages. Clear cases are decided by the
+    local heuristics in toc_heuristics; only ambiguous pages go to toc_detector_single_page,
+    concurrently and most TOC-like first.
+    """
+    results = {}
+    ambiguous = []
+    for i in page_indices:
+        if opt.toc_prefilter == 'no':
+            ambiguous.append((0, i))
+            continue
+        decision, signals = classify_toc_page(page_list[i][0], outline_titles)
+        if decision is None:
+            ambiguous.append((toc_page_score(signals), i))
+        else:
+            results[i] = decision
+            if logger:
+                logger.info(f'Page {i} toc prefilter: {decision}')
+
+    ambiguous = [i for _, i in sorted(ambiguous, key=lambda x: -x[0])]
+    if ambiguous:
+        with ThreadPoolExecutor(max_workers=max(1, min(opt.toc_detection_workers, len(ambiguous)))) as executor:
+            llm_results = executor.map(lambda i: toc_detector_single_page(page_list[i][0], model=opt.model), ambiguous)
+            results.update(zip(ambiguous, llm_results))
+    if logger:
+        logger.info(f'toc detection: {len(results) - len(ambiguous)} pages decided locally, {len(ambiguous)} by the LLM')
+    return results
+
+
+def find_toc_pages(start_page_index, page_list, opt, logger=None, outline_titles=None):
     print('start find_toc_pages')
+    # pages are classified a few at a time, ahead of the scan, so the LLM checks of a batch run
+    # concurrently; pages past the end of the TOC cost at most the rest of one batch
+    batch_size = max(1, opt.toc_detection_workers)
+    detected = {}
     last_page_is_yes = False
     toc_page_list = []
     i = start_page_index
@@ -349,7 +482,13 @@ def find_toc_pages(start_page_index, page_list, opt, logger=None):
         # Only check beyond max_pages if we're still finding TOC pages
         if i >= opt.toc_check_page_num and not last_page_is_yes:
             break
-        detected_result = toc_detector_single_page(page_list[i][0],model=opt.model)
+        if i not in detected:
+            batch_end = min(i + batch_size, len(page_list))
+            if not last_page_is_yes:
+                batch_end = min(batch_end, opt.toc_check_page_num)
+            detected.update(detect_toc_pages(range(i, batch_end), page_list, opt,
+                                             outline_titles=outline_titles, logger=logger))
+        detected_result = detected[i]
         if detected_result == 'yes':
             if logger:
                 logger.info(f'Page {i} has toc')
@@ -378,53 +517,33 @@ def remove_page_number(data):
     return data
 
 def extract_matching_page_pairs(toc_page, toc_physical_index, start_page_index):
-    pairs = []
-    for phy_item in toc_physical_index:
-        for page_item in toc_page:
-            if phy_item.get('title') == page_item.get('title'):
-                physical_index = phy_item.get('physical_index')
-                if physical_index is not None and int(physical_index) >= start_page_index:
-                    pairs.append({
-                        'title': phy_item.get('title'),
-                        'page': page_item.get('page'),
-                        'physical_index': physical_index
-                    })
-    return pairs
+    return match_page_pairs(toc_page, toc_physical_index, start_page_index)
 
 
 def calculate_page_offset(pairs):
-    differences = []
-    for pair in pairs:
-        try:
-            physical_index = pair['physical_index']
-            page_number = pair['page']
-            difference = physical_index - page_number
-            differences.append(difference)
-        except (KeyError, TypeError):
-            continue
-    
-    if not differences:
-        return None
-    
-    difference_counts = {}
-    for diff in differences:
-        difference_counts[diff] = difference_counts.get(diff, 0) + 1
-    
-    most_common = max(difference_counts.items(), key=lambda x: x[1])[0]
-    
-    return most_common
+    """Page offset segments per page numbering, see fit_page_offsets; empty if no pair is usable."""
+    return fit_page_offsets(pairs)
 
 def add_page_offset_to_toc_json(data, offset):
+    """offset is a single offset or the segments of calculate_page_offset."""
+    if offset is None:
+        return data
     for i in range(len(data)):
-        if data[i].get('page') is not None and isinstance(data[i]['page'], int):
-            data[i]['physical_index'] = data[i]['page'] + offset
+        if isinstance(offset, dict):
+            physical_index = physical_index_for_page(offset, data[i].get('page'))
+        elif isinstance(data[i].get('page'), int):
+            physical_index = data[i]['page'] + offset
+        else:
+            physical_index = None
+        if physical_index is not None:
+            data[i]['physical_index'] = physical_index
             del data[i]['page']
     
     return data
 
 
 
-def page_list_to_group_text(page_contents, token_lengths, max_tokens=20000, overlap_page=1):    
+def page_list_to_group_text(page_contents, token_lengths, max_tokens=20000, overlap_page=1, model=None):    
     num_tokens = sum(token_lengths)
     
     if num_tokens <= max_tokens:
@@ -432,34 +551,11 @@ def page_list_to_group_text(page_contents, token_lengths, max_tokens=20000, over
         page_text = "".join(page_contents)
         return [page_text]
     
-    subsets = []
-    current_subset = []
-    current_token_count = 0
-
-    expected_parts_num = math.ceil(num_tokens / max_tokens)
-    average_tokens_per_part = math.ceil(((num_tokens / expected_parts_num) + max_tokens) / 2)
-    
-    for i, (page_content, page_tokens) in enumerate(zip(page_contents, token_lengths)):
-        if current_token_count + page_tokens > average_tokens_per_part:
-
-            subsets.append(''.join(current_subset))
-            # Start new subset from overlap if specified
-            overlap_start = max(i - overlap_page, 0)
-            current_subset = page_contents[overlap_start:i]
-            current_token_count = sum(token_lengths[overlap_start:i])
-        
-        # Add current page to the subset
-        current_subset.append(page_content)
-        current_token_count += page_tokens
-
-    # Add the last subset if it contains any pages
-    if current_subset:
-        subsets.append(''.join(current_subset))
-    
+    subsets = [join_group(group) for group in pack_pages(page_contents, token_lengths, max_tokens, overlap_page, model)]
     print('divide page_list to groups', len(subsets))
     return subsets
 
-def add_page_number_to_toc(part, structure, model=None):
+def _add_page_number_prompt(part, structure):
     fill_prompt_seq = """
     You are given an JSON structure of a document and a partial part of the document. Your task is to check if the title that is described in the structure is started in the partial given document.
 
@@ -483,11 +579,28 @@ def add_page_number_to_toc(part, structure, model=None):
     Directly return the final JSON structure. Do not output anything else."""
 
     prompt = fill_prompt_seq + f"\n\nCurrent Partial Document:\n{part}\n\nGiven Structure\n{json.dumps(structure, indent=2)}\n"
-    current_json_raw = llm_model.generate(prompt)
+    return prompt
+
+
+def add_page_number_to_toc(part, structure, model=None):
+    current_json_raw = get_llm(model).generate(_add_page_number_prompt(part, structure))
+    return _parse_page_number_result(current_json_raw)
+
+
+async def add_page_number_to_toc_async(part, structure, model=None):
+    current_json_raw = await get_llm(model).generate_async(_add_page_number_prompt(part, structure))
+    return _parse_page_number_result(current_json_raw)
+
+
+def _parse_page_number_result(current_json_raw):
     json_result = extract_json(current_json_raw)
+    if isinstance(json_result, dict):
+        json_result = [json_result]
+    if not isinstance(json_result, list):
+        return []
     
     for item in json_result:
-        if 'start' in item:
+        if isinstance(item, dict) and 'start' in item:
             del item['start']
     return json_result
 
@@ -504,9 +617,34 @@ def remove_first_physical_index_section(text):
         return text.replace(match.group(0), '', 1)
     return text
 
+def compact_toc_state(toc_content, last_entries=20):
+    """
+    What generate_toc_continue needs of the TOC built so far: its last_entries entries
+    and the sections still open above them, one unindented JSON object per line, so
+    the prompt stays the same size however long the document is.
+    last_entries=0 sends the whole TOC indented, as before.
+    """
+    if not last_entries:
+        return json.dumps(toc_content, indent=2)
+    items = toc_content[-last_entries:]
+    if len(toc_content) > last_entries:
+        # ancestors of the last entry, e.g. 3 and 3.2 for 3.2.4, that scrolled out of the window
+        parts = str(items[-1].get('structure') or '').split('.')
+        open_path = {'.'.join(parts[:depth]): None for depth in range(1, len(parts))}
+        for item in toc_content[:-last_entries]:
+            if str(item.get('structure')) in open_path:
+                open_path[str(item.get('structure'))] = item
+        shown = {str(item.get('structure')) for item in items}
+        items = [item for structure, item in open_path.items() if item is not None and structure not in shown] + items
+    return '\n'.join(
+        json.dumps({key: item[key] for key in ('structure', 'title', 'physical_index') if key in item},
+                   ensure_ascii=False, separators=(',', ':'))
+        for item in items
+    )
+
+
 ### add verify completeness
-def generate_toc_continue(toc_content, part, model=None):
-    print('start generate_toc_continue')
+def _toc_continue_prompt(toc_content, part, state_entries=20):
     prompt = """
     You are an expert in extracting hierarchical tree structure.
     You are given a tree structure of the previous part and the text of the current part.
@@ -532,16 +670,24 @@ def generate_toc_continue(toc_content, part, model=None):
 
     Directly return the additional part of the final JSON structure. Do not output anything else."""
 
-    prompt = prompt + '\nGiven text\n:' + part + '\nPrevious tree structure\n:' + json.dumps(toc_content, indent=2)
-    response, finish_reason = llm_model.generate(prompt, include_finish_reason=True)
+    if state_entries and len(toc_content) > state_entries:
+        previous = f'\nPrevious tree structure (its last {state_entries} entries and their open parent sections)\n:'
+    else:
+        previous = '\nPrevious tree structure\n:'
+    return prompt + '\nGiven text\n:' + part + previous + compact_toc_state(toc_content, state_entries)
+
+
+def generate_toc_continue(toc_content, part, model=None, state_entries=20):
+    print('start generate_toc_continue')
+    prompt = _toc_continue_prompt(toc_content, part, state_entries)
+    response, finish_reason = get_llm(model).generate(prompt, include_finish_reason=True)
     if finish_reason == 'finished':
         return extract_json(response)
     else:
         raise Exception(f'finish reason: {finish_reason}')
     
 ### add verify completeness
-def generate_toc_init(part, model=None):
-    print('start generate_toc_init')
+def _toc_init_prompt(part):
     prompt = """
     You are an expert in extracting hierarchical tree structure, your task is to generate the tree structure of the document.
 
@@ -566,10 +712,15 @@ def generate_toc_init(part, model=None):
 
     Directly return the final JSON structure. Do not output anything else."""
 
-    prompt = prompt + '\nGiven text\n:' + part
+    return prompt + '\nGiven text\n:' + part
+
+
+def generate_toc_init(part, model=None):
+    print('start generate_toc_init')
+    prompt = _toc_init_prompt(part)
     for attempt in range(1, 4):
         try:
-            response, finish_reason = llm_model.generate(prompt, include_finish_reason=True)
+            response, finish_reason = get_llm(model).generate(prompt, include_finish_reason=True)
             # print("response:", response)
             if finish_reason == 'finished':
                 return extract_json(response)
@@ -581,20 +732,135 @@ def generate_toc_init(part, model=None):
             print('waiting in 5 seconds')
             time.sleep(5)
 
-def process_no_toc(page_list, start_index=1, model=None, logger=None):
+def get_physical_index_range(text):
+    pages = [int(page) for page in re.findall(r'<physical_index_(\d+)>', text)]
+    if not pages:
+        return None, None
+    return min(pages), max(pages)
+
+
+def normalize_title(title):
+    return ' '.join(str(title).split()).lower()
+
+
+def renumber_toc_structure(toc_items):
+    """
+    Rewrite the structure codes of a flat TOC list in order, keeping each item's
+    nesting depth, so that codes are consecutive (1, 1.1, 1.2, 2, ...).
+    """
+    counters = []
+    for item in toc_items:
+        parts = [part for part in str(item.get('structure') or '').split('.') if part]
+        depth = min(max(len(parts), 1), len(counters) + 1)
+        counters = counters[:depth]
+        if len(counters) < depth:
+            counters.append(1)
+        else:
+            counters[-1] += 1
+        item['structure'] = '.'.join(str(counter) for counter in counters)
+    return toc_items
+
+
+def structure_parts(item):
+    return [part for part in str(item.get('structure') or '').split('.') if part]
+
+
+def shift_structure(partial_toc, anchor_parts, merged_parts):
+    """
+    Re-root the codes of a group's TOC so that the item coded anchor_parts, which is
+    the merged item coded merged_parts, gets that item's depth and parent path.
+    The group's other items move by the same number of levels: items at or below the
+    anchor's depth take the anchor's parent path, shallower ones that of the ancestor
+    at their new depth.
+    """
+    shift = len(merged_parts) - len(anchor_parts)
+    # levels above the anchor in the group's own numbering
+    keep = len(anchor_parts) - 1
+    for item in partial_toc:
+        parts = structure_parts(item) or ['1']
+        if len(parts) > keep:
+            parts = merged_parts[:-1] + parts[keep:]
+        else:
+            depth = max(len(parts) + shift, 1)
+            parts = merged_parts[:depth - 1] + parts[-1:]
+        item['structure'] = '.'.join(parts)
+    return partial_toc
+
+
+def merge_partial_tocs(partial_tocs, group_texts):
+    """
+    Merge TOCs generated independently per page group into one list.
+
+    Every group numbers its sections from 1, as if the document started there.
+    Groups share overlap pages with their predecessor, so a section found on an
+    overlap page by both groups is kept once, and the first such section aligns
+    the group: its codes are shifted to the depth and parent path the section has
+    in the merged TOC, so a group starting inside section 2 continues under it.
+    A group without such a section keeps its own depths. Structure codes are then renumbered consecutively.
+    """
+    merged = []
+    prev_range = (None, None)
+    for partial_toc, group_text in zip(partial_tocs, group_texts):
+        partial_toc = convert_physical_index_to_int(partial_toc or [])
+        group_range = get_physical_index_range(group_text)
+
+        overlap_start, overlap_end = group_range[0], prev_range[1]
+        if merged and overlap_start is not None and overlap_end is not None:
+            seen = {
+                normalize_title(item.get('title')): item
+                for item in merged
+                if isinstance(item.get('physical_index'), int) and overlap_start <= item['physical_index'] <= overlap_end
+            }
+            duplicates = [
+                item for item in partial_toc
+                if isinstance(item.get('physical_index'), int)
+                and overlap_start <= item['physical_index'] <= overlap_end
+                and normalize_title(item.get('title')) in seen
+            ]
+            anchor = next((item for item in duplicates
+                           if structure_parts(item) and structure_parts(seen[normalize_title(item.get('title'))])), None)
+            if anchor is not None:
+                shift_structure(partial_toc, structure_parts(anchor), structure_parts(seen[normalize_title(anchor.get('title'))]))
+            partial_toc = [item for item in partial_toc if not any(item is duplicate for duplicate in duplicates)]
+        merged.extend(partial_toc)
+        prev_range = group_range
+    return renumber_toc_structure(merged)
+
+
+def generate_toc_parallel(group_texts, model=None, max_workers=4):
+    """Generate a partial TOC for every page group concurrently and reconcile them."""
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(group_texts)))) as executor:
+        partial_tocs = list(executor.map(lambda group_text: generate_toc_init(group_text, model), group_texts))
+    return merge_partial_tocs(partial_tocs, group_texts)
+
+
+def process_no_toc(page_list, start_index=1, model=None, logger=None, mode='sequential', max_workers=4, max_group_tokens=20000,
+                   state_entries=20):
     page_contents=[]
-    token_lengths=[]
     for page_index in range(start_index, start_index+len(page_list)):
         page_text = f"<physical_index_{page_index}>\n{page_list[page_index-start_index][0]}\n<physical_index_{page_index}>\n\n"
         page_contents.append(page_text)
-        token_lengths.append(count_tokens(page_text, model))
-    group_texts = page_list_to_group_text(page_contents, token_lengths)
-    logger.info(f'len(group_texts): {len(group_texts)}')
-
-    toc_with_page_number= generate_toc_init(group_texts[0], model)
-    for group_text in group_texts[1:]:
-        toc_with_page_number_additional = generate_toc_continue(toc_with_page_number, group_text, model)    
-        toc_with_page_number.extend(toc_with_page_number_additional)
+    token_lengths = count_tokens_many(page_contents, model=model)
+    # page text has to fit next to the prompt template in the model's context
+    budget = prompt_token_budget(get_llm(model), count_tokens(_toc_init_prompt(''), model=model), max_group_tokens)
+    groups = pack_pages(page_contents, token_lengths, budget, model=model) or [[]]
+    group_texts = [join_group(group) for group in groups]
+    logger.info(f'len(group_texts): {len(group_texts)}, page tokens per group: {budget}')
+
+    if mode == 'parallel' and len(group_texts) > 1:
+        toc_with_page_number = generate_toc_parallel(group_texts, model, max_workers=max_workers)
+    else:
+        toc_with_page_number= generate_toc_init(group_texts[0], model)
+
+        def continue_budget():
+            # the previous tree structure is sent along and changes with every group
+            carried_tokens = count_tokens(_toc_continue_prompt(toc_with_page_number, '', state_entries), model=model)
+            return prompt_token_budget(get_llm(model), carried_tokens, max_group_tokens)
+
+        for group in iter_fitted_groups(groups[1:], continue_budget, model=model):
+            toc_with_page_number_additional = generate_toc_continue(toc_with_page_number, join_group(group), model,
+                                                                    state_entries=state_entries)
+            toc_with_page_number.extend(toc_with_page_number_additional)
     logger.info(f'generate_toc: {toc_with_page_number}')
 
     toc_with_page_number = convert_physical_index_to_int(toc_with_page_number)
@@ -602,22 +868,28 @@ def process_no_toc(page_list, start_index=1, model=None, logger=None):
 
     return toc_with_page_number
 
-def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_index=1, model=None, logger=None):
+def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_index=1, model=None, logger=None, max_group_tokens=20000):
     page_contents=[]
-    token_lengths=[]
     toc_content = toc_transformer(toc_content, model)
     logger.info(f'toc_transformer: {toc_content}')
     for page_index in range(start_index, start_index+len(page_list)):
         page_text = f"<physical_index_{page_index}>\n{page_list[page_index-start_index][0]}\n<physical_index_{page_index}>\n\n"
         page_contents.append(page_text)
-        token_lengths.append(count_tokens(page_text, model))
+    token_lengths = count_tokens_many(page_contents, model=model)
     
-    group_texts = page_list_to_group_text(page_contents, token_lengths)
-    logger.info(f'len(group_texts): {len(group_texts)}')
+    # every prompt carries the whole TOC next to its pages
+    carried_tokens = count_tokens(_add_page_number_prompt('', toc_content), model=model)
+    groups = pack_pages(page_contents, token_lengths, prompt_token_budget(get_llm(model), carried_tokens, max_group_tokens), model=model)
+    logger.info(f'len(group_texts): {len(groups)}')
 
     toc_with_page_number=copy.deepcopy(toc_content)
-    for group_text in group_texts:
-        toc_with_page_number = add_page_number_to_toc(group_text, toc_with_page_number, model)
+
+    def page_number_budget():
+        carried_tokens = count_tokens(_add_page_number_prompt('', toc_with_page_number), model=model)
+        return prompt_token_budget(get_llm(model), carried_tokens, max_group_tokens)
+
+    for group in iter_fitted_groups(groups, page_number_budget, model=model):
+        toc_with_page_number = add_page_number_to_toc(join_group(group), toc_with_page_number, model)
     logger.info(f'add_page_number_to_toc: {toc_with_page_number}')
 
     toc_with_page_number = convert_physical_index_to_int(toc_with_page_number)
@@ -627,7 +899,7 @@ def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_in
 
 
 
-def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=None, model=None, logger=None):
+async def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=None, model=None, logger=None, max_concurrency=8):
     toc_with_page_number = toc_transformer(toc_content, model)
     logger.info(f'toc_with_page_number: {toc_with_page_number}')
 
@@ -653,7 +925,7 @@ def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_che
     toc_with_page_number = add_page_offset_to_toc_json(toc_with_page_number, offset)
     logger.info(f'toc_with_page_number: {toc_with_page_number}')
 
-    toc_with_page_number = process_none_page_numbers(toc_with_page_number, page_list, model=model)
+    toc_with_page_number = await process_none_page_numbers_async(toc_with_page_number, page_list, model=model, max_concurrency=max_concurrency)
     logger.info(f'toc_with_page_number: {toc_with_page_number}')
 
     return toc_with_page_number
@@ -661,48 +933,96 @@ def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_che
 
 
 ##check if needed to process none page numbers
-def process_none_page_numbers(toc_items, page_list, start_index=1, model=None):
-    for i, item in enumerate(toc_items):
-        if "physical_index" not in item:
-            # logger.info(f"fix item: {item}")
-            # Find previous physical_index
-            prev_physical_index = 0  # Default if no previous item exists
-            for j in range(i - 1, -1, -1):
-                if toc_items[j].get('physical_index') is not None:
-                    prev_physical_index = toc_items[j]['physical_index']
-                    break
-            
-            # Find next physical_index
-            next_physical_index = -1  # Default if no next item exists
-            for j in range(i + 1, len(toc_items)):
-                if toc_items[j].get('physical_index') is not None:
-                    next_physical_index = toc_items[j]['physical_index']
-                    break
+def missing_page_number_windows(toc_items, page_list, start_index=1):
+    """
+    Group the items without physical_index by the pages between the located items
+    around them. Returns [(first_page, last_page, [item indices])] where windows that
+    overlap by more than their boundary page are merged into one group.
+    """
+    last_page = start_index + len(page_list) - 1
+    # previous and next located page of every item, in two linear passes
+    prev_pages = [start_index] * len(toc_items)
+    next_pages = [last_page] * len(toc_items)
+    for i in range(1, len(toc_items)):
+        located = toc_items[i - 1].get('physical_index')
+        prev_pages[i] = located if isinstance(located, int) else prev_pages[i - 1]
+    for i in range(len(toc_items) - 2, -1, -1):
+        located = toc_items[i + 1].get('physical_index')
+        next_pages[i] = located if isinstance(located, int) else next_pages[i + 1]
+
+    windows = sorted(
+        (max(prev_pages[i], start_index), min(max(next_pages[i], prev_pages[i]), last_page), i)
+        for i, item in enumerate(toc_items) if "physical_index" not in item
+    )
+    groups = []
+    for first_page, last, i in windows:
+        # adjacent gaps share their boundary page, merging those would chain the whole document;
+        # items in the same single-page window are still asked about in one prompt
+        if groups and (first_page < groups[-1][1] or (first_page, last) == (groups[-1][0], groups[-1][1])):
+            groups[-1][1] = max(groups[-1][1], last)
+            groups[-1][2].append(i)
+        else:
+            groups.append([first_page, last, [i]])
+    return [(first_page, last, sorted(indices)) for first_page, last, indices in groups]
 
-            page_contents = []
-            for page_index in range(prev_physical_index, next_physical_index+1):
-                # Add bounds checking to prevent IndexError
-                list_index = page_index - start_index
-                if list_index >= 0 and list_index < len(page_list):
-                    page_text = f"<physical_index_{page_index}>\n{page_list[list_index][0]}\n<physical_index_{page_index}>\n\n"
-                    page_contents.append(page_text)
-                else:
-                    continue
-
-            item_copy = copy.deepcopy(item)
-            del item_copy['page']
-            result = add_page_number_to_toc(page_contents, item_copy, model)
-            if isinstance(result[0]['physical_index'], str) and result[0]['physical_index'].startswith('<physical_index'):
-                item['physical_index'] = int(result[0]['physical_index'].split('_')[-1].rstrip('>').strip())
-                del item['page']
+
+async def process_none_page_numbers_async(toc_items, page_list, start_index=1, model=None, max_concurrency=8):
+    """
+    Locate the TOC items that have no physical_index yet. Each group of items from
+    missing_page_number_windows is one prompt over its pages, the groups run
+    concurrently under max_concurrency and their results are applied in item order.
+    """
+    groups = missing_page_number_windows(toc_items, page_list, start_index)
+    if not groups:
+        return toc_items
+    semaphore = asyncio.Semaphore(max(1, max_concurrency or 1))
+
+    async def locate_group(first_page, last_page, indices):
+        part = "".join(
+            f"<physical_index_{page_index}>\n{page_list[page_index - start_index][0]}\n<physical_index_{page_index}>\n\n"
+            for page_index in range(first_page, last_page + 1)
+        )
+        structure = [
+            {key: value for key, value in toc_items[i].items() if key != 'page'}
+            for i in indices
+        ]
+        async with semaphore:
+            try:
+                result = await add_page_number_to_toc_async(part, structure, model)
+            except Exception as e:
+                logging.warning(f'Locating {len(indices)} items without page number failed: {e}')
+                return [None] * len(indices)
+
+        result = [entry for entry in result if isinstance(entry, dict)]
+        # match entries back by title, by position if the reply renamed them
+        by_title = {normalize_title(entry.get('title', '')): entry for entry in result}
+        return [
+            by_title.get(normalize_title(toc_items[i].get('title', '')),
+                         result[position] if len(result) == len(indices) else None)
+            for position, i in enumerate(indices)
+        ]
+
+    results = await asyncio.gather(*[locate_group(*group) for group in groups])
+
+    located = {}
+    for (_, _, indices), result in zip(groups, results):
+        for i, entry in zip(indices, result):
+            physical_index = entry.get('physical_index') if entry else None
+            if isinstance(physical_index, str) and physical_index.startswith('<physical_index'):
+                located[i] = int(physical_index.split('_')[-1].rstrip('>').strip())
+    for i in sorted(located):
+        toc_items[i]['physical_index'] = located[i]
+        toc_items[i].pop('page', None)
     
     return toc_items
 
 
 
 
-def check_toc(page_list, opt=None):
-    toc_page_list = find_toc_pages(start_page_index=0, page_list=page_list, opt=opt)
+def check_toc(page_list, opt=None, doc=None):
+    # bookmark titles from the PDF outline help recognise the pages that list them
+    outline_titles = [title for _, title, _ in get_pdf_outline(doc)] if doc is not None else None
+    toc_page_list = find_toc_pages(start_page_index=0, page_list=page_list, opt=opt, outline_titles=outline_titles)
     if len(toc_page_list) == 0:
         print('no toc found')
         return {'toc_content': None, 'toc_page_list': [], 'page_index_given_in_toc': 'no'}
@@ -723,7 +1043,8 @@ def check_toc(page_list, opt=None):
                 additional_toc_pages = find_toc_pages(
                     start_page_index=current_start_index,
                     page_list=page_list,
-                    opt=opt
+                    opt=opt,
+                    outline_titles=outline_titles
                 )
                 
                 if len(additional_toc_pages) == 0:
@@ -745,7 +1066,7 @@ def check_toc(page_list, opt=None):
 
 
 ################### fix incorrect toc #########################################################
-def single_toc_item_index_fixer(section_title, content, model="gpt-4o-2024-11-20"):
+def single_toc_item_index_fixer(section_title, content, model=None):
     tob_extractor_prompt = """
     You are given a section title and several pages of a document, your job is to find the physical index of the start page of the section in the partial document.
 
@@ -759,7 +1080,7 @@ def single_toc_item_index_fixer(section_title, content, model="gpt-4o-2024-11-20
     Directly return the final JSON structure. Do not output anything else."""
 
     prompt = tob_extractor_prompt + '\nSection Title:\n' + str(section_title) + '\nDocument pages:\n' + content
-    response = llm_model.generate(prompt)
+    response = get_llm(model).generate(prompt)
     json_content = extract_json(response)    
     return convert_physical_index_to_int(json_content['physical_index'])
 
@@ -827,6 +1148,22 @@ async def fix_incorrect_toc(toc_with_page_number, page_list, incorrect_results,
             else:
                 continue
         content_range = ''.join(page_contents)
+
+        matcher = get_title_matcher()
+        if matcher:
+            candidate_pages = {
+                page_index: page_list[page_index - start_index][0]
+                for page_index in range(prev_correct, next_correct+1)
+                if 0 <= page_index - start_index < len(page_list)
+            }
+            physical_index_int = matcher.find_page(incorrect_item['title'], candidate_pages)
+            if physical_index_int is not None:
+                return {
+                    'list_index': incorrect_item['list_index'],
+                    'title': incorrect_item['title'],
+                    'physical_index': physical_index_int,
+                    'is_valid': True
+                }
         
         physical_index_int = single_toc_item_index_fixer(incorrect_item['title'], content_range, model)
         
@@ -905,7 +1242,7 @@ async def fix_incorrect_toc_with_retries(toc_with_page_number, page_list, incorr
 
 
 ################### verify toc #########################################################
-async def verify_toc(page_list, list_result, start_index=1, N=None, model=None):
+async def verify_toc(page_list, list_result, start_index=1, N=None, model=None, batch_max_tokens=None):
     print('start verify_toc')
     # Find the last non-None physical_index
     last_physical_index = None
@@ -937,12 +1274,21 @@ async def verify_toc(page_list, list_result, start_index=1, N=None, model=None):
             item_with_index['list_index'] = idx  # Add the original index in list_result
             indexed_sample_list.append(item_with_index)
 
-    # Run checks concurrently
-    tasks = [
-        check_title_appearance(item, page_list, start_index, model)
-        for item in indexed_sample_list
-    ]
-    results = await asyncio.gather(*tasks)
+    # Run checks concurrently, one prompt per page group when batching is enabled
+    if batch_max_tokens:
+        groups = group_items_for_verification(indexed_sample_list, page_list, start_index, max_tokens=batch_max_tokens)
+        print(f'verify {len(indexed_sample_list)} items with {len(groups)} prompts')
+        group_results = await asyncio.gather(*[
+            check_titles_appearance_batch(items, page_list, start_index, model)
+            for _, items in groups
+        ])
+        results = [result for group_result in group_results for result in group_result]
+    else:
+        tasks = [
+            check_title_appearance(item, page_list, start_index, model)
+            for item in indexed_sample_list
+        ]
+        results = await asyncio.gather(*tasks)
     
     # Process results
     correct_count = 0
@@ -969,11 +1315,16 @@ async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=N
     print(f'start_index: {start_index}')
 
     if mode == 'process_toc_with_page_numbers':
-        toc_with_page_number = process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=opt.toc_check_page_num, model=opt.model, logger=logger)
+        toc_with_page_number = await process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=opt.toc_check_page_num, model=opt.model, logger=logger,
+                                                                   max_concurrency=opt.page_number_workers)
     elif mode == 'process_toc_no_page_numbers':
-        toc_with_page_number = process_toc_no_page_numbers(toc_content, toc_page_list, page_list, model=opt.model, logger=logger)
+        toc_with_page_number = process_toc_no_page_numbers(toc_content, toc_page_list, page_list, model=opt.model, logger=logger,
+                                                           max_group_tokens=opt.toc_group_max_tokens)
     else:
-        toc_with_page_number = process_no_toc(page_list, start_index=start_index, model=opt.model, logger=logger)
+        toc_with_page_number = process_no_toc(page_list, start_index=start_index, model=opt.model, logger=logger,
+                                              mode=opt.toc_generation_mode, max_workers=opt.toc_generation_workers,
+                                              max_group_tokens=opt.toc_group_max_tokens,
+                                              state_entries=opt.toc_continue_state_entries)
     # print("toc_with_number:", toc_with_page_number)  
     return toc_with_page_number       
     # toc_with_page_number = [item for item in toc_with_page_number if item.get('physical_index') is not None] 
@@ -985,7 +1336,7 @@ async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=N
     #     logger=logger
     # )
     
-    # accuracy, incorrect_results = await verify_toc(page_list, toc_with_page_number, start_index=start_index, model=opt.model)
+    # accuracy, incorrect_results = await verify_toc(page_list, toc_with_page_number, start_index=start_index, model=opt.model, batch_max_tokens=opt.verify_batch_max_tokens)
         
     # logger.info({
     #     'mode': 'process_toc_with_page_numbers',
@@ -1038,8 +1389,107 @@ async def process_large_node_recursively(node, page_list, opt=None, logger=None)
     
     return node
 
+def outline_to_toc_items(outline, page_count):
+    """Flat TOC items from PDF bookmarks [[level, title, page]]; bookmarks without a valid target page are dropped."""
+    toc_items = []
+    for level, title, page in outline:
+        title = ' '.join(str(title).split())
+        if not title or not isinstance(page, int) or not 1 <= page <= page_count:
+            continue
+        toc_items.append({'structure': '.'.join(['1'] * max(level, 1)), 'title': title, 'physical_index': page})
+    return renumber_toc_structure(toc_items)
+
+
+def find_outline_gaps(toc_items, page_count, max_gap_pages):
+    """Page ranges (start, end) longer than max_gap_pages on which no bookmark starts."""
+    starts = sorted({item['physical_index'] for item in toc_items})
+    gaps = []
+    for gap_start, gap_end in zip([1] + [page + 1 for page in starts], starts + [page_count + 1]):
+        # the page of a bookmark is covered by it, so a gap ends right before the next one
+        if gap_end - gap_start > max_gap_pages:
+            gaps.append((gap_start, gap_end - 1))
+    return gaps
+
+
+def add_section_page_ranges(toc_items, page_count):
+    """Set start_index/end_index on a flat TOC list; a section ends where the next item at the same or a higher level starts."""
+    depths = [len(str(item['structure']).split('.')) for item in toc_items]
+    for i, item in enumerate(toc_items):
+        item['start_index'] = item['physical_index']
+        end_index = page_count
+        for j in range(i + 1, len(toc_items)):
+            if depths[j] <= depths[i]:
+                end_index = toc_items[j]['physical_index']
+                break
+        item['end_index'] = max(end_index, item['start_index'])
+    return toc_items
+
+
+async def outline_tree_parser(page_list, outline, opt, logger=None):
+    """
+    Build the flat TOC from the PDF bookmarks without any LLM call. Page ranges that
+    no bookmark covers are indexed by the LLM pipeline and nested under the preceding
+    bookmark. Returns None when the outline covers too little of the document.
+    """
+    page_count = len(page_list)
+    toc_items = outline_to_toc_items(outline, page_count)
+    if not toc_items:
+        return None
+    gaps = find_outline_gaps(toc_items, page_count, opt.max_page_num_each_node)
+    coverage = 1 - sum(end - start + 1 for start, end in gaps) / page_count
+    logger.info({'outline_items': len(toc_items), 'outline_coverage': round(coverage, 3), 'outline_gaps': gaps})
+    if coverage < opt.outline_min_coverage:
+        return None
+
+    gap_tocs = await asyncio.gather(*[
+        meta_processor(page_list[start - 1:end], mode='process_no_toc', start_index=start, opt=opt, logger=logger)
+        for start, end in gaps
+    ])
+    for (start, end), gap_toc in zip(gaps, gap_tocs):
+        gap_toc = [item for item in gap_toc if isinstance(item.get('physical_index'), int)]
+        parent_pos = max((i for i, item in enumerate(toc_items) if item['physical_index'] <= start), default=None)
+        if parent_pos is None:
+            # front matter before the first bookmark stays at the top level
+            toc_items[0:0] = gap_toc
+            continue
+        prefix = toc_items[parent_pos]['structure']
+        for item in gap_toc:
+            item['structure'] = f"{prefix}.{item.get('structure') or 1}"
+        toc_items[parent_pos + 1:parent_pos + 1] = gap_toc
+
+    logger.info({'structure_source': 'pdf_outline+llm' if gaps else 'pdf_outline', 'llm_page_ranges': gaps})
+    toc_items = renumber_toc_structure(toc_items)
+    return add_section_page_ranges(toc_items, page_count)
+
+
+async def incremental_tree_parser(page_list, previous_state, opt, logger=None):
+    """
+    Re-index a new version of a document from the state of a previous run: the TOC of
+    unchanged pages is reused and process_no_toc runs only on the edited page ranges.
+    Returns None when a full build is needed (no usable state, other model, too many changes).
+    """
+    if previous_state is None or previous_state.get('model') != opt.model:
+        return None
+    page_map, changes = diff_pages(previous_state['page_hashes'], page_fingerprints(page_list))
+    changed_pages = sum(max(end - start + 1, 0) for start, end in (change['new'] for change in changes))
+    changed_ratio = changed_pages / max(len(page_list), 1)
+    logger.info({'incremental_changes': changes, 'changed_pages': changed_pages})
+    if changed_ratio > opt.incremental_max_changed_ratio:
+        return None
+
+    regenerated = await asyncio.gather(*[
+        meta_processor(page_list[start - 1:end], mode='process_no_toc', start_index=start, opt=opt, logger=logger)
+        if end >= start else asyncio.sleep(0, result=[])
+        for start, end in (change['new'] for change in changes)
+    ])
+    toc_items = splice_toc_items(previous_state['structure'], page_map, changes, regenerated)
+    logger.info({'structure_source': 'incremental', 'reused_items': sum(1 for item in previous_state['structure'] if item.get('physical_index') in page_map)})
+    toc_items = renumber_toc_structure(toc_items)
+    return add_section_page_ranges(toc_items, len(page_list))
+
+
 async def tree_parser(page_list, opt, doc=None, logger=None):
-    # check_toc_result = check_toc(page_list, opt)
+    # check_toc_result = check_toc(page_list, opt, doc=doc)
     # logger.info(check_toc_result)
 
     # if check_toc_result.get("toc_content") and check_toc_result["toc_content"].strip() and check_toc_result["page_index_given_in_toc"] == "yes":
@@ -1076,18 +1526,34 @@ async def tree_parser(page_list, opt, doc=None, logger=None):
     return toc_with_page_number
 
 
-def page_index_main(doc, opt=None):
-    logger = JsonLogger(doc)
-    
+def page_index_main(doc, opt=None, lazy_text=False):
+    """
+    Build the tree of a PDF. With page_store: mmap and lazy_text=True, node text is
+    returned as PageRangeText still backed by the page store, for write_tree to read
+    one node at a time; otherwise it is plain str.
+    """
+    # fill in defaults from config.yaml for options the caller did not set
+    opt = ConfigLoader().load(opt)
     is_valid_pdf = (
         (isinstance(doc, str) and os.path.isfile(doc) and doc.lower().endswith(".pdf")) or 
-        isinstance(doc, BytesIO)
+        isinstance(doc, (BytesIO, Document))
     )
     if not is_valid_pdf:
-        raise ValueError("Unsupported input type. Expected a PDF file path or BytesIO object.")
+        raise ValueError("Unsupported input type. Expected a PDF file path, BytesIO or Document object.")
+    # parse the PDF once, every helper below reuses this handle and its page text
+    doc = Document.open(doc)
+
+    logger = JsonLogger(doc)
+    llm_cache = configure_llm_cache(opt)
+    title_matcher = configure_title_matcher(opt)
+    configure_rate_limiter(opt)
 
     print('Parsing PDF...')
-    page_list = get_page_tokens(doc)
+    if opt.page_store == 'mmap':
+        page_list = get_page_store(doc, model=opt.model, num_workers=opt.page_parse_workers,
+                                   chunk_size=opt.page_parse_chunk_size, store_dir=opt.page_store_dir)
+    else:
+        page_list = get_page_tokens(doc, model=opt.model, num_workers=opt.page_parse_workers, chunk_size=opt.page_parse_chunk_size)
     # print('page_list:', page_list)
     # print('total_page_number', len(page_list))
     # print('total_token', sum([page[1] for page in page_list]))
@@ -1095,10 +1561,27 @@ def page_index_main(doc, opt=None):
     logger.info({'total_page_number': len(page_list)})
     logger.info({'total_token': sum([page[1] for page in page_list])})
 
+    if opt.incremental == 'yes':
+        state_path = index_state_path(opt.incremental_state_dir, get_pdf_name(doc))
+        previous_state = load_index_state(opt.incremental_base or state_path)
+
     async def page_index_builder():
-        structure = await tree_parser(page_list, opt, doc=doc, logger=logger)
-        if opt.if_add_node_id == 'yes':
+        structure = None
+        if opt.incremental == 'yes':
+            structure = await incremental_tree_parser(page_list, previous_state, opt, logger=logger)
+        # spliced items keep the node_id of the previous run
+        keep_node_ids = structure is not None and all('node_id' in item for item in structure)
+        if structure is None and opt.use_pdf_outline == 'yes':
+            outline = get_pdf_outline(doc)
+            if outline:
+                structure = await outline_tree_parser(page_list, outline, opt, logger=logger)
+        if structure is None:
+            logger.info({'structure_source': 'llm'})
+            structure = await tree_parser(page_list, opt, doc=doc, logger=logger)
+        if opt.if_add_node_id == 'yes' and not keep_node_ids:
             write_node_id(structure)    
+        if opt.incremental == 'yes':
+            save_index_state(state_path, page_fingerprints(page_list), structure, opt.model)
         if opt.if_add_node_text == 'yes':
             add_node_text(structure, page_list)
             # add_node_text_with_labels(structure, page_list)
@@ -1123,7 +1606,16 @@ def page_index_main(doc, opt=None):
         # }
         return structure
 
-    return asyncio.run(page_index_builder())
+    result = asyncio.run(page_index_builder())
+    if opt.page_store == 'mmap' and not lazy_text:
+        # node text is lazy while the tree is built; callers get plain strings
+        materialize_structure_text(result)
+    if llm_cache is not None:
+        logger.info({'llm_cache': llm_cache.stats()})
+    if title_matcher is not None:
+        logger.info({'title_matcher': title_matcher.stats()})
+    logger.close()
+    return result
 
 
 def page_index(doc, model=None, toc_check_page_num=None, max_page_num_each_node=None, max_token_num_each_node=None,
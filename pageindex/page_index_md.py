@@ -4,8 +4,10 @@ import re
 import os
 try:
     from .utils import *
+    from .markdown_scanner import ATX_HEADING, iter_markdown_headings
 except:
     from utils import *
+    from markdown_scanner import ATX_HEADING, iter_markdown_headings
 
 async def get_node_summary(node, summary_token_threshold=200, model=None):
     node_text = node.get('text')
@@ -29,161 +31,117 @@ async def generate_summaries_for_structure_md(structure, summary_token_threshold
     return structure
 
 
-def extract_nodes_from_markdown(markdown_content):
-    header_pattern = r'^(#{1,6})\s+(.+)$'
-    code_block_pattern = r'^```'
-    node_list = []
-    
-    lines = markdown_content.split('\n')
-    in_code_block = False
-    
-    for line_num, line in enumerate(lines, 1):
-        stripped_line = line.strip()
-        
-        # Check for code block delimiters (triple backticks)
-        if re.match(code_block_pattern, stripped_line):
-            in_code_block = not in_code_block
-            continue
-        
-        # Skip empty lines
-        if not stripped_line:
-            continue
-        
-        # Only look for headers when not inside a code block
-        if not in_code_block:
-            match = re.match(header_pattern, stripped_line)
-            if match:
-                title = match.group(2).strip()
-                node_list.append({'node_title': title, 'line_num': line_num})
+class MarkdownLines(list):
+    """The lines of a markdown document plus the character offset at which each one starts."""
 
+    def __init__(self, content):
+        super().__init__(content.split('\n'))
+        self.content = content
+        self.offsets = []
+        offset = 0
+        for line in self:
+            self.offsets.append(offset)
+            offset += len(line) + 1
+        self.offsets.append(offset)
+
+
+def extract_nodes_from_markdown(markdown_content):
+    """
+    Scan the markdown once and return (node_list, lines). Each node records its title,
+    level, 1-based line_num and the character offset of its first line; lines carries
+    the offset of every line in lines.offsets so node text can be sliced from the content.
+    Headings are found by MarkdownScanner, which skips code, HTML blocks and front matter.
+    """
+    lines = MarkdownLines(markdown_content)
+    node_list = list(iter_markdown_headings(lines))
     return node_list, lines
 
 
-def extract_node_text_content(node_list, markdown_lines):    
+def extract_node_text_content(node_list, markdown_lines):
+    offsets = getattr(markdown_lines, 'offsets', None)
     all_nodes = []
     for node in node_list:
-        line_content = markdown_lines[node['line_num'] - 1]
-        header_match = re.match(r'^(#{1,6})', line_content)
-        
-        if header_match is None:
-            print(f"Warning: Line {node['line_num']} does not contain a valid header: '{line_content}'")
-            continue
-            
-        processed_node = {
+        level = node.get('level')
+        if level is None:
+            line_content = markdown_lines[node['line_num'] - 1]
+            header_match = ATX_HEADING.match(line_content)
+            if header_match is None:
+                print(f"Warning: Line {node['line_num']} does not contain a valid header: '{line_content}'")
+                continue
+            level = len(header_match.group(1))
+        all_nodes.append({
             'title': node['node_title'],
             'line_num': node['line_num'],
-            'level': len(header_match.group(1))
-        }
-        all_nodes.append(processed_node)
-    
+            'level': level,
+        })
+
     for i, node in enumerate(all_nodes):
-        start_line = node['line_num'] - 1 
+        start_line = node['line_num'] - 1
         if i + 1 < len(all_nodes):
-            end_line = all_nodes[i + 1]['line_num'] - 1 
+            end_line = all_nodes[i + 1]['line_num'] - 1
         else:
             end_line = len(markdown_lines)
-        
-        node['text'] = '\n'.join(markdown_lines[start_line:end_line]).strip()    
+
+        if offsets is not None:
+            node['text'] = markdown_lines.content[offsets[start_line]:offsets[end_line]].strip()
+        else:
+            node['text'] = '\n'.join(markdown_lines[start_line:end_line]).strip()
     return all_nodes
 
+
+def get_subtree_ends(node_list):
+    """For every node, the index one past its last descendant; descendants are the run of deeper levels after it."""
+    ends = [len(node_list)] * len(node_list)
+    stack = []
+    for i, node in enumerate(node_list):
+        while stack and node_list[stack[-1]]['level'] >= node['level']:
+            ends[stack.pop()] = i
+        stack.append(i)
+    return ends
+
+
 def update_node_list_with_text_token_count(node_list, model=None):
+    """
+    Set text_token_count to the tokens of a node's text plus those of all its
+    descendants. Every text is tokenized once, subtree totals are summed bottom-up.
+    """
+    result_list = [dict(node) for node in node_list]
+    own_counts = count_tokens_many([node.get('text', '') for node in result_list], model=model)
 
-    def find_all_children(parent_index, parent_level, node_list):
-        """Find all direct and indirect children of a parent node"""
-        children_indices = []
-        
-        # Look for children after the parent
-        for i in range(parent_index + 1, len(node_list)):
-            current_level = node_list[i]['level']
-            
-            # If we hit a node at same or higher level than parent, stop
-            if current_level <= parent_level:
-                break
-                
-            # This is a descendant
-            children_indices.append(i)
-        
-        return children_indices
-    
-    # Make a copy to avoid modifying the original
-    result_list = node_list.copy()
-    
-    # Process nodes from end to beginning to ensure children are processed before parents
+    totals = list(own_counts)
+    stack = []
+    # children come after their parent, walking backwards finishes them first
     for i in range(len(result_list) - 1, -1, -1):
-        current_node = result_list[i]
-        current_level = current_node['level']
-        
-        # Get all children of this node
-        children_indices = find_all_children(i, current_level, result_list)
-        
-        # Start with the node's own text
-        node_text = current_node.get('text', '')
-        total_text = node_text
-        
-        # Add all children's text
-        for child_index in children_indices:
-            child_text = result_list[child_index].get('text', '')
-            if child_text:
-                total_text += '\n' + child_text
-        
-        # Calculate token count for combined text
-        result_list[i]['text_token_count'] = count_tokens(total_text, model=model)
-    
+        level = result_list[i]['level']
+        while stack and result_list[stack[-1]]['level'] > level:
+            totals[i] += totals[stack.pop()]
+        stack.append(i)
+        result_list[i]['text_token_count'] = totals[i]
+
     return result_list
 
 
 def tree_thinning_for_index(node_list, min_node_token=None, model=None):
-    def find_all_children(parent_index, parent_level, node_list):
-        children_indices = []
-        
-        for i in range(parent_index + 1, len(node_list)):
-            current_level = node_list[i]['level']
-            
-            if current_level <= parent_level:
-                break
-                
-            children_indices.append(i)
-        
-        return children_indices
-    
-    result_list = node_list.copy()
-    nodes_to_remove = set()
-    
-    for i in range(len(result_list) - 1, -1, -1):
-        if i in nodes_to_remove:
-            continue
-            
-        current_node = result_list[i]
-        current_level = current_node['level']
-        
-        total_tokens = current_node.get('text_token_count', 0)
-        
-        if total_tokens < min_node_token:
-            children_indices = find_all_children(i, current_level, result_list)
-            
-            children_texts = []
-            for child_index in sorted(children_indices):
-                if child_index not in nodes_to_remove:
-                    child_text = result_list[child_index].get('text', '')
-                    if child_text.strip():
-                        children_texts.append(child_text)
-                    nodes_to_remove.add(child_index)
-            
-            if children_texts:
-                parent_text = current_node.get('text', '')
-                merged_text = parent_text
-                for child_text in children_texts:
-                    if merged_text and not merged_text.endswith('\n'):
-                        merged_text += '\n\n'
-                    merged_text += child_text
-                
-                result_list[i]['text'] = merged_text
-                
-                result_list[i]['text_token_count'] = count_tokens(merged_text, model=model)
-    
-    for index in sorted(nodes_to_remove, reverse=True):
-        result_list.pop(index)
-    
+    """
+    Merge every subtree whose text_token_count is below min_node_token into its root.
+    Only the topmost such roots are kept, so each node is visited once and the merged
+    count is the subtree total already computed by update_node_list_with_text_token_count.
+    """
+    subtree_ends = get_subtree_ends(node_list)
+    result_list = []
+    i = 0
+    while i < len(node_list):
+        node = dict(node_list[i])
+        end = subtree_ends[i]
+        if node.get('text_token_count', 0) < min_node_token and end > i + 1:
+            texts = [node.get('text', '')] + [child.get('text', '') for child in node_list[i + 1:end]]
+            node['text'] = '\n\n'.join(text for text in texts if text.strip())
+            result_list.append(node)
+            i = end
+        else:
+            result_list.append(node)
+            i += 1
+
     return result_list
 
 
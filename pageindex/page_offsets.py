@@ -0,0 +1,118 @@
+import re
+from bisect import bisect_right
+from collections import Counter, defaultdict
+
+from .title_matcher import normalize_text, strip_numbering
+
+ROMAN_NUMERAL = re.compile(r'^(?=[mdclxvi])m{0,3}(cm|cd|d?c{0,3})(xc|xl|l?x{0,3})(ix|iv|v?i{0,3})$', re.IGNORECASE)
+ROMAN_VALUES = {'i': 1, 'v': 5, 'x': 10, 'l': 50, 'c': 100, 'd': 500, 'm': 1000}
+# shortest run of equal offsets accepted as a segment, shorter runs are mismatched pairs
+MIN_SEGMENT_SUPPORT = 2
+
+
+def title_key(title):
+    return normalize_text(strip_numbering(title or ''))
+
+
+def parse_page_label(page):
+    """
+    ('arabic', n) or ('roman', n) for a printed page number, None if it is not one.
+    Front matter numbered i, ii, ... has its own numbering and so its own offset.
+    """
+    if isinstance(page, bool):
+        return None
+    if isinstance(page, int):
+        return ('arabic', page)
+    if not isinstance(page, str):
+        return None
+    label = page.strip()
+    if label.isdigit():
+        return ('arabic', int(label))
+    if ROMAN_NUMERAL.match(label):
+        values = [ROMAN_VALUES[char] for char in label.lower()]
+        return ('roman', sum(-value if value < following else value
+                             for value, following in zip(values, values[1:] + [0])))
+    return None
+
+
+def match_page_pairs(toc_page, toc_physical_index, start_page_index):
+    """
+    Pair items of the TOC with printed page numbers and the items located in the
+    document by title, through a hash index of normalized titles instead of comparing
+    every item with every other.
+    """
+    by_title = defaultdict(list)
+    for page_item in toc_page:
+        by_title[title_key(page_item.get('title'))].append(page_item)
+
+    pairs = []
+    for phy_item in toc_physical_index:
+        physical_index = phy_item.get('physical_index')
+        if physical_index is None or int(physical_index) < start_page_index:
+            continue
+        for page_item in by_title.get(title_key(phy_item.get('title')), ()):
+            pairs.append({
+                'title': phy_item.get('title'),
+                'page': page_item.get('page'),
+                'physical_index': physical_index
+            })
+    return pairs
+
+
+def _offset_runs(points):
+    """Split (page, offset) points sorted by page where the offset changes: [[offset, first_page, support], ...]."""
+    runs = []
+    for page, offset in points:
+        if runs and runs[-1][0] == offset:
+            runs[-1][2] += 1
+        else:
+            runs.append([offset, page, 1])
+    return runs
+
+
+def fit_page_offsets(pairs, min_support=MIN_SEGMENT_SUPPORT):
+    """
+    Piecewise-constant physical_index - page offset per page numbering.
+
+    The pairs of each numbering are sorted by printed page and scanned once for the
+    points where the offset changes. Runs backed by fewer than min_support pairs are
+    treated as mismatches; if no run is long enough the most common offset is used
+    for the whole numbering. Returns {scheme: [(first_page, offset), ...]} with the
+    segments in page order.
+    """
+    points = defaultdict(list)
+    for pair in pairs:
+        label = parse_page_label(pair.get('page'))
+        try:
+            physical_index = int(pair['physical_index'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if label is not None:
+            points[label[0]].append((label[1], physical_index - label[1]))
+
+    segments = {}
+    for scheme, scheme_points in points.items():
+        scheme_points.sort()
+        runs = [run for run in _offset_runs(scheme_points) if run[2] >= min_support]
+        if not runs:
+            offset = Counter(offset for _, offset in scheme_points).most_common(1)[0][0]
+            segments[scheme] = [(scheme_points[0][0], offset)]
+            continue
+        merged = []
+        for offset, first_page, _ in runs:
+            # runs split only by dropped mismatches are one segment
+            if not merged or merged[-1][1] != offset:
+                merged.append((first_page, offset))
+        segments[scheme] = merged
+    return segments
+
+
+def physical_index_for_page(segments, page):
+    """Physical index of a printed page by the offset of its segment, None if its numbering has no segments."""
+    label = parse_page_label(page)
+    if label is None or label[0] not in segments:
+        return None
+    scheme_segments = segments[label[0]]
+    # pages before the first segment use its offset, pages between two use the earlier one
+    i = bisect_right([first_page for first_page, _ in scheme_segments], label[1]) - 1
+    return label[1] + scheme_segments[max(i, 0)][1]
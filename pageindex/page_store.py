@@ -0,0 +1,152 @@
+import mmap
+import os
+import tempfile
+import weakref
+from array import array
+
+
+class PageStore:
+    """
+    Read-only sequence of (page_text, token_len) backed by a memory-mapped file.
+
+    The text of every page is written once, UTF-8 encoded and back to back, with a
+    byte offsets index, so a page range is one contiguous slice of the map. It can
+    stand in for page_list: len(), indexing, iteration and slicing (which returns a
+    view over the same map) behave like on the list of tuples.
+    """
+
+    def __init__(self, path, offsets, tokens, start=0, stop=None, _mm=None, _owner=None):
+        self.path = path
+        self._offsets = offsets
+        self._tokens = tokens
+        self._start = start
+        self._stop = len(tokens) if stop is None else stop
+        if _mm is None and offsets[-1] > 0:
+            with open(path, 'rb') as f:
+                _mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mm = _mm
+        # views keep the store that owns the file alive
+        self._owner = _owner
+
+    @classmethod
+    def create(cls, pages, path=None, dir=None):
+        """
+        Write pages, an iterable of (page_text, token_len), to path (a temporary file
+        removed with the store by default) and map it. pages can be a generator, so a
+        document never has to be held in memory as a whole.
+        """
+        owns_file = path is None
+        if owns_file:
+            fd, path = tempfile.mkstemp(suffix='.pages', dir=dir)
+            f = os.fdopen(fd, 'wb')
+        else:
+            f = open(path, 'wb')
+        offsets = array('q', [0])
+        tokens = array('q')
+        with f:
+            for page_text, token_len in pages:
+                data = (page_text or '').encode('utf-8')
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+                tokens.append(token_len)
+        store = cls(path, offsets, tokens)
+        if owns_file:
+            weakref.finalize(store, _remove_file, store._mm, path)
+        return store
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def _index(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('page index out of range')
+        return self._start + i
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return [self[j] for j in range(start, stop, step)]
+            return PageStore(self.path, self._offsets, self._tokens, self._start + start,
+                             self._start + max(start, stop), _mm=self._mm, _owner=self._owner or self)
+        i = self._index(i)
+        return self._page_text(i), self._tokens[i]
+
+    def __iter__(self):
+        for i in range(self._start, self._stop):
+            yield self._page_text(i), self._tokens[i]
+
+    def _raw(self, first, last):
+        """Bytes of stored pages [first, last) as a zero-copy memoryview."""
+        if self._mm is None:
+            return memoryview(b'')
+        return memoryview(self._mm)[self._offsets[first]:self._offsets[last]]
+
+    def _page_text(self, i):
+        return str(self._raw(i, i + 1), 'utf-8')
+
+    def raw_range(self, start_page, end_page):
+        """Encoded text of pages start_page..end_page (1-based, inclusive) without copying."""
+        first = self._index(start_page - 1)
+        last = self._index(end_page - 1) + 1
+        return self._raw(first, last)
+
+    def get_text_range(self, start_page, end_page):
+        """Text of pages start_page..end_page (1-based, inclusive), like get_text_of_pdf_pages."""
+        return str(self.raw_range(start_page, end_page), 'utf-8')
+
+    def token_count(self, start_page, end_page):
+        return sum(self._tokens[self._index(start_page - 1):self._index(end_page - 1) + 1])
+
+
+class PageRangeText:
+    """
+    Node text that stays in the page store until it is needed: str() reads it, and
+    json_default() lets json.dump write it. Used by add_node_text for a PageStore;
+    page_index_main turns it into str before returning the tree unless lazy_text=True.
+    """
+
+    __slots__ = ('store', 'start_page', 'end_page', 'with_labels')
+
+    def __init__(self, store, start_page, end_page, with_labels=False):
+        self.store = store
+        self.start_page = start_page
+        self.end_page = end_page
+        self.with_labels = with_labels
+
+    def __str__(self):
+        if not self.with_labels:
+            return self.store.get_text_range(self.start_page, self.end_page)
+        return ''.join(
+            f"<physical_index_{page}>\n{self.store[page - 1][0]}\n<physical_index_{page}>\n"
+            for page in range(self.start_page, self.end_page + 1)
+        )
+
+    def __bool__(self):
+        return self.end_page >= self.start_page
+
+    def __repr__(self):
+        return f"PageRangeText({self.start_page}, {self.end_page})"
+
+
+def json_default(obj):
+    """json.dump(..., default=json_default) hook that materializes lazy node text."""
+    if isinstance(obj, PageRangeText):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _remove_file(mm, path):
+    if mm is not None:
+        try:
+            mm.close()
+        except BufferError:
+            # a memoryview into the map is still alive; the mapping stays valid after
+            # the unlink below and its pages are freed with the last reference
+            pass
+    try:
+        os.remove(path)
+    except OSError:
+        pass
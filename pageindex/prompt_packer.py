@@ -0,0 +1,169 @@
+import re
+from collections import deque
+
+from .models.tokenizer_registry import count_tokens_many
+
+# kept free besides the reply: chat template tokens and tokenizer differences to the server
+SAFETY_MARGIN = 256
+# smallest page text budget worth a prompt; below it prompt_token_budget raises
+MIN_GROUP_TOKENS = 512
+PAGE_TAGS = re.compile(r'^(<physical_index_\d+>\n)(.*)(\n<physical_index_\d+>\n*)$', re.DOTALL)
+# coarsest first: paragraphs, lines, sentences, words
+SPLIT_SEPARATORS = ('\n\n', '\n', '. ', ' ')
+
+
+def prompt_token_budget(llm, fixed_tokens=0, max_tokens=None):
+    """
+    Tokens of page text that fit in one prompt to llm next to fixed_tokens of prompt
+    template and carried state, with the model's reply tokens reserved.
+    max_tokens caps the budget of models with very long contexts. Raises ValueError
+    when less than MIN_GROUP_TOKENS are left, rather than plan prompts that overflow
+    the context.
+    """
+    context_window, output_tokens = llm.context_limits()
+    available = context_window - output_tokens - fixed_tokens - SAFETY_MARGIN
+    if available < MIN_GROUP_TOKENS:
+        raise ValueError(f"A prompt with {fixed_tokens} fixed tokens leaves {available} of the model's "
+                         f"{context_window} context tokens for page text, fewer than {MIN_GROUP_TOKENS}")
+    if max_tokens:
+        return max(min(available, max_tokens), MIN_GROUP_TOKENS)
+    return available
+
+
+def split_text(text, max_tokens, model=None, separators=SPLIT_SEPARATORS):
+    """Split text into pieces of at most max_tokens at the coarsest boundary that allows it."""
+    if not separators:
+        # one word longer than the budget, cut it by characters
+        tokens = count_tokens_many([text], model=model)[0]
+        size = max(1, len(text) * max_tokens // max(tokens, 1))
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    separator = separators[0]
+    units = text.split(separator)
+    pieces = []
+    current = []
+    current_tokens = 0
+    for unit, tokens in zip(units, count_tokens_many(units, model=model)):
+        if tokens > max_tokens:
+            if current:
+                pieces.append(separator.join(current))
+                current, current_tokens = [], 0
+            pieces.extend(split_text(unit, max_tokens, model, separators[1:]))
+            continue
+        # one token for the separator
+        if current and current_tokens + tokens + 1 > max_tokens:
+            pieces.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += tokens + 1
+    if current:
+        pieces.append(separator.join(current))
+    return pieces
+
+
+def split_page_content(page_content, max_tokens, model=None):
+    """
+    Split one <physical_index_X> tagged page that does not fit in a group on its own;
+    every piece keeps the page's tags so its sections are still located on the page.
+    """
+    match = PAGE_TAGS.match(page_content)
+    if not match:
+        return split_text(page_content, max_tokens, model)
+    opening, body, closing = match.groups()
+    tag_tokens = sum(count_tokens_many([opening, closing], model=model))
+    pieces = split_text(body, max(max_tokens - tag_tokens, 1), model)
+    return [opening + piece + closing for piece in pieces]
+
+
+def _greedy_groups(token_lengths, capacity, overlap_page):
+    """Fill each group with as many pages as fit, after overlap_page pages repeated from the previous group."""
+    groups = []
+    start = 0
+    while start < len(token_lengths):
+        first = max(start - overlap_page, 0) if groups else start
+        # overlap pages only go where they fit next to the first new page
+        while first < start and sum(token_lengths[first:start]) + token_lengths[start] > capacity:
+            first += 1
+        load = sum(token_lengths[first:start])
+        end = start
+        while end < len(token_lengths) and (end == start or load + token_lengths[end] <= capacity):
+            load += token_lengths[end]
+            end += 1
+        groups.append((first, end))
+        start = end
+    return groups
+
+
+def pack_page_groups(token_lengths, max_tokens, overlap_page=1):
+    """
+    Split pages into consecutive groups of at most max_tokens, as (first, end) index
+    ranges. Greedy filling gives the fewest groups; the smallest capacity that still
+    needs no more groups then spreads the pages evenly over them.
+    """
+    if not token_lengths:
+        return []
+    num_groups = len(_greedy_groups(token_lengths, max_tokens, overlap_page))
+    low, high = min(max(token_lengths), max_tokens), max_tokens
+    while low < high:
+        capacity = (low + high) // 2
+        if len(_greedy_groups(token_lengths, capacity, overlap_page)) <= num_groups:
+            high = capacity
+        else:
+            low = capacity + 1
+    return _greedy_groups(token_lengths, high, overlap_page)
+
+
+def pack_pages(page_contents, token_lengths, max_tokens, overlap_page=1, model=None):
+    """
+    Pack tagged pages into the fewest prompt groups of at most max_tokens. Pages larger
+    than max_tokens are split at paragraph boundaries first. Returns one list of
+    (page_content, tokens) per group.
+    """
+    pages = []
+    for page_content, tokens in zip(page_contents, token_lengths):
+        if tokens > max_tokens:
+            pieces = split_page_content(page_content, max_tokens, model)
+            pages.extend(zip(pieces, count_tokens_many(pieces, model=model)))
+        else:
+            pages.append((page_content, tokens))
+    groups = pack_page_groups([tokens for _, tokens in pages], max_tokens, overlap_page)
+    return [pages[first:end] for first, end in groups]
+
+
+def group_tokens(group):
+    return sum(tokens for _, tokens in group)
+
+
+def join_group(group):
+    return ''.join(page_content for page_content, _ in group)
+
+
+def fit_group(group, max_tokens, overlap_page=1, model=None):
+    """group itself if it fits in max_tokens, else the groups it has to be re-packed into."""
+    if group_tokens(group) <= max_tokens:
+        return [group]
+    return pack_pages([page for page, _ in group], [tokens for _, tokens in group], max_tokens,
+                      overlap_page=overlap_page, model=model)
+
+
+def iter_fitted_groups(groups, budget, overlap_page=1, model=None):
+    """
+    Yield the groups one at a time, each re-packed to fit budget(). budget is called
+    again before every group, sub-groups included, so prompt state carried along
+    that grew while the previous group was processed is accounted for. A group left
+    with only pages of the previous one, e.g. the overlap page split off on its own,
+    is skipped.
+    """
+    pending = deque(groups)
+    previous = set()
+    while pending:
+        fitted = fit_group(pending.popleft(), budget(), overlap_page=overlap_page, model=model)
+        if len(fitted) == 1:
+            pages = {page for page, _ in fitted[0]}
+            if pages <= previous:
+                continue
+            previous = pages
+            yield fitted[0]
+        else:
+            # split groups are checked again against the budget when their turn comes
+            pending.extendleft(reversed(fitted))
@@ -0,0 +1,151 @@
+import re
+import threading
+import unicodedata
+
+NUMBERING_PREFIX = re.compile(
+    r'^\s*((chapter|kapitel|chapitre|section|abschnitt|teil|partie|part|anhang|annexe|appendix)\s+)?'
+    r'(\d{1,3}(\.\d{1,3})*[.):]?|[A-Z](\.\d{1,3})+\.?|[A-Z][.)]|[IVXLC]{1,6}[.)])\s+',
+    re.IGNORECASE,
+)
+HYPHEN_BREAK = re.compile(r'(\w)[-­‐]\s*\n\s*(\w)')
+NON_WORD = re.compile(r'[^\w]+')
+
+# characters of the page start searched for a section that starts the page
+START_WINDOW = 200
+# titles this long are unlikely to occur verbatim in body text
+MIN_INLINE_TITLE_WORDS = 4
+
+
+def normalize_text(text):
+    """NFKC, lower case, hyphenation and whitespace folded, punctuation dropped."""
+    text = unicodedata.normalize('NFKC', str(text)).replace('­', '')
+    text = HYPHEN_BREAK.sub(r'\1\2', text)
+    return ' '.join(NON_WORD.sub(' ', text.lower()).split())
+
+
+def strip_numbering(title):
+    return NUMBERING_PREFIX.sub('', str(title), count=1)
+
+
+def title_similarity(title, page_text):
+    """
+    Similarity of a section title to a page in [0, 1]: 1.0 if the title occurs in the
+    page ignoring case, punctuation and spacing, otherwise the share of title tokens
+    found among the page tokens.
+    """
+    title_norm = normalize_text(strip_numbering(title)) or normalize_text(title)
+    page_norm = normalize_text(page_text)
+    if not title_norm:
+        return 0.0
+    if title_norm in page_norm or title_norm.replace(' ', '') in page_norm.replace(' ', ''):
+        return 1.0
+    title_tokens = set(title_norm.split())
+    page_tokens = set(page_norm.split())
+    return len(title_tokens & page_tokens) / len(title_tokens)
+
+
+def heading_match(title, page_text):
+    """
+    True if the title starts a line of the page, or is long enough and occurs there
+    verbatim, so that its match is a heading rather than words of the body text.
+    """
+    title_norm = normalize_text(strip_numbering(title)) or normalize_text(title)
+    if not title_norm:
+        return False
+    for line in str(page_text).splitlines():
+        if normalize_text(strip_numbering(line)).startswith(title_norm):
+            return True
+    return len(title_norm.split()) >= MIN_INLINE_TITLE_WORDS and title_similarity(title, page_text) == 1.0
+
+
+class TitleMatcher:
+    """
+    Local first pass for the title checks that were sent to the LLM. Clear matches
+    and clear misses are decided here; None means the case is borderline and the
+    caller should ask the model.
+    """
+
+    def __init__(self, yes_threshold=0.9, no_threshold=0.5):
+        self.yes_threshold = yes_threshold
+        self.no_threshold = no_threshold
+        self.local_yes = 0
+        self.local_no = 0
+        self.borderline = 0
+        self.llm_calls_avoided = 0
+        self._lock = threading.Lock()
+
+    def _record(self, decision, llm_calls=1):
+        with self._lock:
+            if decision == 'yes':
+                self.local_yes += 1
+            elif decision == 'no':
+                self.local_no += 1
+            else:
+                self.borderline += 1
+                return
+            self.llm_calls_avoided += llm_calls
+
+    def _decide(self, similarity):
+        if similarity >= self.yes_threshold:
+            return 'yes'
+        if similarity < self.no_threshold:
+            return 'no'
+        return None
+
+    def appears(self, title, page_text, record=True):
+        """'yes' / 'no' if the title clearly does / does not appear in the page, else None."""
+        decision = self._decide(title_similarity(title, page_text))
+        if decision == 'yes' and not heading_match(title, page_text):
+            # e.g. a one-word title that only occurs in a sentence
+            decision = None
+        if record:
+            self._record(decision)
+        return decision
+
+    def starts(self, title, page_text):
+        """'yes' / 'no' if the section clearly does / does not start the page, else None."""
+        decision = self.appears(title, page_text, record=False)
+        if decision == 'yes':
+            page_start = normalize_text(strip_numbering(page_text.lstrip()[:START_WINDOW]))
+            title_norm = normalize_text(strip_numbering(title))
+            if not page_start.startswith(title_norm):
+                # the title is on the page, but whether only headers precede it is for the model to judge
+                decision = None
+        self._record(decision)
+        return decision
+
+    def find_page(self, title, pages):
+        """
+        Return the only page number among pages {page_number: text} on which the title
+        clearly appears, or None when there is no such page or more than one.
+        """
+        matches = [page_number for page_number, text in pages.items()
+                   if self.appears(title, text, record=False) == 'yes']
+        if len(matches) == 1:
+            # saves the index fixer call and the check of its answer
+            self._record('yes', llm_calls=2)
+            return matches[0]
+        self._record(None)
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'local_yes': self.local_yes,
+                'local_no': self.local_no,
+                'borderline': self.borderline,
+                'llm_calls_avoided': self.llm_calls_avoided,
+            }
+
+
+_title_matcher = None
+
+
+def set_title_matcher(matcher):
+    """Use matcher for every title check in the process (None sends all checks to the LLM)."""
+    global _title_matcher
+    _title_matcher = matcher
+
+
+def get_title_matcher():
+    return _title_matcher
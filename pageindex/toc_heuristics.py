@@ -0,0 +1,90 @@
+import re
+import unicodedata
+
+# headings that open a table of contents, in the languages of our corpus
+TOC_KEYWORDS = re.compile(
+    r'^\s*(table\s+of\s+contents|contents|inhalt|inhaltsverzeichnis|sommaire|'
+    r'table\s+des\s+mati[eè]res|[ií]ndice|contenido)\b',
+    re.IGNORECASE,
+)
+# lists that look like a TOC but are not one, see toc_detector_single_page
+NON_TOC_KEYWORDS = re.compile(
+    r'^\s*(list\s+of\s+(figures|tables|abbreviations)|abbildungsverzeichnis|tabellenverzeichnis|'
+    r'abk[uü]rzungsverzeichnis|glossar(y)?|liste\s+des\s+(figures|tableaux)|table\s+des\s+(figures|illustrations)|'
+    r'index|abstract|summary|zusammenfassung|r[ée]sum[ée])\b',
+    re.IGNORECASE,
+)
+DOTTED_LEADER = re.compile(r'(\.\s?){4,}|[·…_]{3,}')
+TRAILING_PAGE_NUMBER = re.compile(r'\S.*?\s+(\d{1,4}|[ivxlc]{1,7})$', re.IGNORECASE)
+NUMBERED_HEADING = re.compile(r'^(\d{1,2}(\.\d{1,2})*\.?|[A-Z]\.|[IVX]{1,5}\.|(chapter|kapitel|chapitre|teil|partie|anhang|annexe|appendix)\s+\S+)\s+\S', re.IGNORECASE)
+
+HEADER_LINES = 8
+MIN_LINES = 3
+# running text: long lines that do not end in a page number
+PROSE_MIN_WORDS = 10
+
+
+def _normalize(text):
+    return ' '.join(unicodedata.normalize('NFKC', text).lower().split())
+
+
+def toc_page_signals(page_text, outline_titles=None):
+    """Cheap per-page features of a table of contents page."""
+    lines = [line.strip() for line in page_text.splitlines() if line.strip()]
+    total = max(len(lines), 1)
+    header = lines[:HEADER_LINES]
+
+    signals = {
+        'lines': len(lines),
+        'keyword': any(TOC_KEYWORDS.match(line) for line in header),
+        'non_toc_keyword': any(NON_TOC_KEYWORDS.match(line) for line in header),
+        'dotted_leaders': sum(1 for line in lines if DOTTED_LEADER.search(line)) / total,
+        'trailing_numbers': sum(1 for line in lines if TRAILING_PAGE_NUMBER.match(line)) / total,
+        'numbered_headings': sum(1 for line in lines if NUMBERED_HEADING.match(line)) / total,
+        'prose_lines': sum(1 for line in lines
+                           if len(line.split()) >= PROSE_MIN_WORDS and not TRAILING_PAGE_NUMBER.match(line)) / total,
+        'outline_hits': 0,
+    }
+    if outline_titles:
+        normalized_page = _normalize(page_text)
+        signals['outline_hits'] = sum(1 for title in outline_titles if title and _normalize(title) in normalized_page)
+    return signals
+
+
+def toc_page_score(signals):
+    """Weighted TOC likelihood of a page in [0, 1], used to rank pages for the LLM."""
+    score = (0.3 * signals['keyword']
+             + 0.3 * min(signals['dotted_leaders'] * 2, 1)
+             + 0.2 * min(signals['trailing_numbers'] * 2, 1)
+             + 0.1 * min(signals['numbered_headings'] * 2, 1)
+             + 0.1 * min(signals['outline_hits'] / 5, 1))
+    return score * (0.5 if signals['non_toc_keyword'] else 1)
+
+
+def classify_toc_page(page_text, outline_titles=None):
+    """
+    Decide locally whether a page is a table of contents.
+    Returns 'yes' or 'no' for clear cases and None when the page has to go to the LLM.
+    """
+    signals = toc_page_signals(page_text, outline_titles)
+    if signals['lines'] < MIN_LINES:
+        return 'no', signals
+    if signals['non_toc_keyword']:
+        # figure lists and glossaries share the layout of a TOC
+        return None, signals
+
+    listing = signals['dotted_leaders'] >= 0.3 or signals['trailing_numbers'] >= 0.4
+    if signals['keyword'] and listing:
+        return 'yes', signals
+    if listing and signals['numbered_headings'] >= 0.3:
+        return 'yes', signals
+    if signals['outline_hits'] >= 5 and listing:
+        return 'yes', signals
+
+    # a page without TOC features is only rejected locally when it reads as running
+    # text; short-line pages (TOCs without page numbers) still go to the LLM
+    if (not signals['keyword'] and signals['dotted_leaders'] < 0.05
+            and signals['trailing_numbers'] < 0.15 and signals['outline_hits'] < 3
+            and signals['prose_lines'] >= 0.5):
+        return 'no', signals
+    return None, signals
@@ -0,0 +1,169 @@
+import gzip
+import itertools
+import json
+
+from .page_store import json_default
+
+OUTPUT_FORMATS = ('json', 'compact', 'jsonl')
+COMPRESSIONS = (None, 'gzip', 'zstd')
+# chunks from the encoder are tiny, write them in blocks of this size
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def output_suffix(fmt='json', compression=None):
+    suffix = '.jsonl' if fmt == 'jsonl' else '.json'
+    return suffix + {None: '', 'gzip': '.gz', 'zstd': '.zst'}[compression]
+
+
+def _compression_from_path(path):
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return None
+
+
+def open_text(path, mode='r', compression=None):
+    """Open a possibly compressed text file; compression defaults to the .gz / .zst suffix."""
+    compression = compression or _compression_from_path(path)
+    if compression is None:
+        return open(path, mode + 't', encoding='utf-8')
+    if compression == 'gzip':
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression needs the 'zstandard' package: pip install zstandard")
+        return zstandard.open(path, mode + 't', encoding='utf-8')
+    raise ValueError(f"Unsupported compression: {compression}")
+
+
+def _node_ids(structure):
+    if isinstance(structure, dict):
+        structure = [structure]
+    for node in structure:
+        if node.get('node_id'):
+            yield node['node_id']
+        if node.get('nodes'):
+            yield from _node_ids(node['nodes'])
+
+
+def iter_nodes(structure, parent_id=None):
+    """
+    Yield (node, node_id, parent_id) depth-first. Nesting comes from 'nodes' lists and,
+    in flat TOC lists, from the depth of the 'structure' codes. Nodes without a
+    node_id get a sequential one, skipping the ids already in the tree, so that their
+    children can point at them.
+    """
+    used = set(_node_ids(structure))
+    ids = (node_id for node_id in (str(i).zfill(4) for i in itertools.count()) if node_id not in used)
+    return _iter_nodes(structure, parent_id, ids)
+
+
+def _iter_nodes(structure, parent_id, ids):
+    if isinstance(structure, dict):
+        structure = [structure]
+    stack = []
+    for node in structure:
+        node_id = node.get('node_id') or next(ids)
+        depth = len(str(node.get('structure') or '1').split('.'))
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        yield node, node_id, stack[-1][1] if stack else parent_id
+        stack.append((depth, node_id))
+        if node.get('nodes'):
+            yield from _iter_nodes(node['nodes'], node_id, ids)
+
+
+class _ChunkBuffer:
+    def __init__(self, f):
+        self.f = f
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= WRITE_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.f.write(''.join(self.parts))
+            self.parts = []
+            self.size = 0
+
+
+def _document_fields(result):
+    if isinstance(result, dict) and 'structure' in result:
+        return {key: value for key, value in result.items() if key != 'structure'}, result['structure']
+    return None, result
+
+
+def write_tree(result, path, fmt='json', compression=None):
+    """
+    Write the finished result of page_index_main / md_to_tree to path.
+
+    The tree skeleton is built in memory first; what is streamed is its serialization.
+    Node text given as PageRangeText (page_index_main(..., lazy_text=True) with the
+    mmap page store) is read from the store one node at a time, so the text of the
+    whole document is never held at once.
+    json / compact: the usual JSON document, indented or without whitespace, encoded
+    and written chunk by chunk instead of as one document-sized string.
+    jsonl: one node per line with a parent_id instead of nested 'nodes', preceded by
+    a {"document": {...}} line when the result carries doc_name / doc_description.
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {fmt}")
+    with open_text(path, 'w', compression) as f:
+        buffer = _ChunkBuffer(f)
+        if fmt == 'jsonl':
+            _write_jsonl(result, buffer)
+        else:
+            encoder = json.JSONEncoder(
+                indent=2 if fmt == 'json' else None,
+                separators=None if fmt == 'json' else (',', ':'),
+                ensure_ascii=False,
+                default=json_default,
+            )
+            for chunk in encoder.iterencode(result):
+                buffer.write(chunk)
+        buffer.flush()
+
+
+def _write_jsonl(result, f):
+    document, structure = _document_fields(result)
+    if document is not None:
+        f.write(json.dumps({'document': document}, ensure_ascii=False, default=json_default) + '\n')
+    for node, node_id, parent_id in iter_nodes(structure):
+        record = {key: value for key, value in node.items() if key != 'nodes'}
+        record['node_id'] = node_id
+        record['parent_id'] = parent_id
+        f.write(json.dumps(record, ensure_ascii=False, default=json_default) + '\n')
+
+
+def iter_jsonl_nodes(path, compression=None):
+    """Read a JSONL tree one node at a time; the document header line is skipped."""
+    with open_text(path, 'r', compression) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'document' in record and len(record) == 1:
+                continue
+            yield record
+
+
+def read_jsonl_tree(path, compression=None):
+    """Rebuild the nested tree from a JSONL file (this one does load every node)."""
+    roots = []
+    by_id = {}
+    for node in iter_jsonl_nodes(path, compression):
+        parent_id = node.pop('parent_id', None)
+        by_id[node['node_id']] = node
+        if parent_id is None or parent_id not in by_id:
+            roots.append(node)
+        else:
+            by_id[parent_id].setdefault('nodes', []).append(node)
+    return roots
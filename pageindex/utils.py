@@ -5,10 +5,15 @@ import os
 from datetime import datetime
 import time
 import json
-import PyPDF2
 import copy
 import asyncio
-import pymupdf
+import atexit
+import threading
+import weakref
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from io import BytesIO
 from dotenv import load_dotenv
 load_dotenv()
@@ -18,25 +23,14 @@ from pathlib import Path
 from types import SimpleNamespace as config
 import re
 
-from transformers import AutoTokenizer
-
-from pageindex.models import GPTModel, QwenModel, LlamaModel
-
-# llm_model = GPTModel(model_name="gpt-4o-2024-11-20", api_key=os.getenv("CHATGPT_API_KEY"))
-llm_model = QwenModel()
-# llm_model = LlamaModel()
+from pageindex.models import GPTModel, QwenModel, LlamaModel, get_model, ResponseCache, set_response_cache, get_response_cache, RateLimiter, set_rate_limiter
+from pageindex.models.tokenizer_registry import get_encoder, count_tokens, count_tokens_many
+from pageindex.document import Document
+from pageindex.page_store import PageStore, PageRangeText, json_default
+from pageindex.title_matcher import TitleMatcher, set_title_matcher, get_title_matcher
 
 CHATGPT_API_KEY = os.getenv("CHATGPT_API_KEY")
 
-def count_tokens(text, model="Qwen/Qwen3-8B"):
-    if not text:
-        return 0
-    # enc = tiktoken.encoding_for_model(model)
-    # tokens = enc.encode(text)
-    tokenizer = AutoTokenizer.from_pretrained(model, trust_remote_code=True)
-    tokens = tokenizer.encode(text)
-    return len(tokens)
-
 def ChatGPT_API_with_finish_reason(model, prompt, api_key=CHATGPT_API_KEY, chat_history=None):
     max_retries = 10
     client = openai.OpenAI(api_key=api_key)
@@ -293,26 +287,17 @@ def get_last_node(structure):
 
 
 def extract_text_from_pdf(pdf_path):
-    pdf_reader = PyPDF2.PdfReader(pdf_path)
     ###return text not list 
-    text=""
-    for page_num in range(len(pdf_reader.pages)):
-        page = pdf_reader.pages[page_num]
-        text+=page.extract_text()
-    return text
+    return ''.join(Document.open(pdf_path).page_texts())
 
 def get_pdf_title(pdf_path):
-    pdf_reader = PyPDF2.PdfReader(pdf_path)
-    meta = pdf_reader.metadata
-    title = meta.title if meta and meta.title else 'Untitled'
-    return title
+    return Document.open(pdf_path).title
 
 def get_text_of_pages(pdf_path, start_page, end_page, tag=True):
-    pdf_reader = PyPDF2.PdfReader(pdf_path)
+    doc = Document.open(pdf_path)
     text = ""
     for page_num in range(start_page-1, end_page):
-        page = pdf_reader.pages[page_num]
-        page_text = page.extract_text()
+        page_text = doc.page_text(page_num)
         if tag:
             text += f"<start_index_{page_num+1}>\n{page_text}\n<end_index_{page_num+1}>\n"
         else:
@@ -346,35 +331,111 @@ def get_pdf_name(pdf_path):
     # Extract PDF name
     if isinstance(pdf_path, str):
         pdf_name = os.path.basename(pdf_path)
-    elif isinstance(pdf_path, BytesIO):
-        pdf_reader = PyPDF2.PdfReader(pdf_path)
-        meta = pdf_reader.metadata
-        pdf_name = meta.title if meta and meta.title else 'Untitled'
-        pdf_name = sanitize_filename(pdf_name)
+    else:
+        doc = Document.open(pdf_path)
+        pdf_name = os.path.basename(doc.path) if doc.path is not None else sanitize_filename(doc.title)
     return pdf_name
 
 
+# loggers not closed yet, closed at exit; weak so finished documents can be freed
+_open_json_loggers = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_json_loggers():
+    for logger in list(_open_json_loggers):
+        logger.close()
+
+
+def _flush_json_logger_periodically(logger_ref, stopped, interval):
+    # holds only a weak reference, so an abandoned logger is still collected
+    while not stopped.wait(interval):
+        logger = logger_ref()
+        if logger is None:
+            return
+        logger.flush()
+        del logger
+
+
 class JsonLogger:
-    def __init__(self, file_path):
+    """
+    Append-only JSON Lines logger: one JSON object per line in logs/<pdf>_<time>.jsonl.
+    Events are buffered and written when flush_every events are pending, an error
+    is logged, or the logger is closed; a background thread writes whatever is
+    pending every flush_interval seconds, so a quiet logger is flushed too.
+    With max_bytes set, the file is rotated to .1 ... .backup_count like
+    logging.handlers.RotatingFileHandler. Use read_json_log() to rebuild the list.
+    """
+    def __init__(self, file_path, flush_every=50, flush_interval=1.0, max_bytes=None, backup_count=5):
         # Extract PDF name for logger name
         pdf_name = get_pdf_name(file_path)
             
         current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.filename = f"{pdf_name}_{current_time}.json"
+        self.filename = f"{pdf_name}_{current_time}.jsonl"
         os.makedirs("./logs", exist_ok=True)
-        # Initialize empty list to store all messages
-        self.log_data = []
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._file = open(self._filepath(), "a", encoding="utf-8")
+        self._bytes_written = self._file.tell()
+        _open_json_loggers.add(self)
+        self._stopped = threading.Event()
+        if flush_interval:
+            threading.Thread(
+                target=_flush_json_logger_periodically,
+                args=(weakref.ref(self), self._stopped, flush_interval),
+                name=f"{self.filename}-flush",
+                daemon=True,
+            ).start()
 
     def log(self, level, message, **kwargs):
-        if isinstance(message, dict):
-            self.log_data.append(message)
+        entry = message if isinstance(message, dict) else {'message': message}
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._buffer.append(line)
+            if level == "ERROR" or len(self._buffer) >= self.flush_every:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._buffer or self._file is None:
+            return
+        data = "".join(self._buffer)
+        self._buffer = []
+        self._file.write(data)
+        self._file.flush()
+        self._bytes_written += len(data.encode("utf-8"))
+        if self.max_bytes and self._bytes_written >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        path = self._filepath()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(path, f"{path}.1")
         else:
-            self.log_data.append({'message': message})
-        # Add new message to the log data
-        
-        # Write entire log data to file
-        with open(self._filepath(), "w") as f:
-            json.dump(self.log_data, f, indent=2)
+            os.remove(path)
+        self._file = open(path, "a", encoding="utf-8")
+        self._bytes_written = 0
+
+    def close(self):
+        self._stopped.set()
+        _open_json_loggers.discard(self)
+        with self._lock:
+            self._flush_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
 
     def info(self, message, **kwargs):
         self.log("INFO", message, **kwargs)
@@ -391,6 +452,27 @@ class JsonLogger:
 
     def _filepath(self):
         return os.path.join("logs", self.filename)
+
+
+def read_json_log(path):
+    """
+    Read a JsonLogger file (and its rotated backups, oldest first) back into
+    the list-of-dicts format the old single-JSON logs used.
+    """
+    backups = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        backups.append(f"{path}.{i}")
+        i += 1
+    log_data = []
+    for part in list(reversed(backups)) + [path]:
+        if not os.path.exists(part):
+            continue
+        with open(part, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    log_data.append(json.loads(line))
+    return log_data
     
 
 
@@ -458,43 +540,113 @@ def add_preface_if_needed(data):
 
 
 
-def get_page_tokens(pdf_path, model="Qwen/Qwen3-8B", pdf_parser="PyPDF2"):
-    # enc = tiktoken.encoding_for_model(model)
+def _extract_page_texts(pdf_source, pdf_parser, start_page=0, end_page=None):
+    """Extract the text of pages [start_page, end_page); a path or bytes get a freshly opened handle."""
+    if isinstance(pdf_source, Document):
+        return pdf_source.page_texts(start_page, end_page, pdf_parser=pdf_parser)
+    with Document(pdf_source, pdf_parser=pdf_parser) as doc:
+        return doc.page_texts(start_page, end_page)
 
-    if "gpt" in model.lower() or "openai" in model.lower():
-        enc = tiktoken.encoding_for_model(model)
-        encode_fn = lambda text: enc.encode(text)
-    else:
-        tokenizer = AutoTokenizer.from_pretrained(model)
-        encode_fn = lambda text: tokenizer.encode(text)
-
-    if pdf_parser == "PyPDF2":
-        pdf_reader = PyPDF2.PdfReader(pdf_path)
-        page_list = []
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            page_text = page.extract_text()
-            token_length = len(encode_fn(page_text))
-            page_list.append((page_text, token_length))
-        return page_list
-    elif pdf_parser == "PyMuPDF":
-        if isinstance(pdf_path, BytesIO):
-            pdf_stream = pdf_path
-            doc = pymupdf.open(stream=pdf_stream, filetype="pdf")
-        elif isinstance(pdf_path, str) and os.path.isfile(pdf_path) and pdf_path.lower().endswith(".pdf"):
-            doc = pymupdf.open(pdf_path)
-        page_list = []
-        for page in doc:
-            page_text = page.get_text()
-            token_length = len(encode_fn(page_text))
-            page_list.append((page_text, token_length))
-        return page_list
+
+def _extract_page_tokens_range(pdf_source, pdf_parser, model, start_page, end_page):
+    # runs inside a worker process: each worker opens its own handle and loads the tokenizer once
+    page_texts = _extract_page_texts(pdf_source, pdf_parser, start_page, end_page)
+    return list(zip(page_texts, count_tokens_many(page_texts, model=model)))
+
+
+def _page_parse_pool(num_workers):
+    # spawned, not forked: a fork copies the parent's threads (log flushing, inference
+    # workers) in whatever state they are, locks included
+    return ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+@contextmanager
+def _worker_pdf_path(doc):
+    """Path the worker processes open the PDF from; a PDF held in memory is written to a temporary file once."""
+    if doc.path is not None:
+        yield doc.path
+        return
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(doc.data)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def get_page_tokens(pdf_path, model="Qwen/Qwen3-8B", pdf_parser="PyPDF2", num_workers=1, chunk_size=32):
+    """
+    Return [(page_text, token_len)] for every page, in page order.
+    With num_workers > 1 (0 or None for one per CPU) page ranges of chunk_size pages are
+    extracted and tokenized in a pool of spawned processes, which is only worth its
+    start-up (imports and tokenizer loading per worker) for long documents.
+    """
+    # the serial path reads the Document in place, worker processes open it from a path
+    doc = Document.open(pdf_path, pdf_parser=pdf_parser)
+
+    num_workers = num_workers or os.cpu_count() or 1
+    if num_workers > 1:
+        num_pages = doc.page_count
+        page_ranges = [(start, min(start + chunk_size, num_pages)) for start in range(0, num_pages, chunk_size)]
     else:
-        raise ValueError(f"Unsupported PDF parser: {pdf_parser}")
+        page_ranges = []
+
+    if len(page_ranges) <= 1:
+        return _extract_page_tokens_range(doc, pdf_parser, model, 0, None)
+
+    page_list = []
+    with _worker_pdf_path(doc) as path, _page_parse_pool(min(num_workers, len(page_ranges))) as executor:
+        futures = [
+            executor.submit(_extract_page_tokens_range, path, pdf_parser, model, start, end)
+            for start, end in page_ranges
+        ]
+        for future in futures:
+            page_list.extend(future.result())
+    return page_list
+
+
+def get_page_store(pdf_path, model="Qwen/Qwen3-8B", pdf_parser="PyPDF2", num_workers=1, chunk_size=32, store_dir=None):
+    """
+    Like get_page_tokens, but pages are extracted chunk_size at a time and written to a
+    memory-mapped PageStore, so the text of the document is never held in memory at once.
+    """
+    doc = Document.open(pdf_path, pdf_parser=pdf_parser)
+    num_workers = num_workers or os.cpu_count() or 1
+    page_ranges = [(start, min(start + chunk_size, doc.page_count)) for start in range(0, doc.page_count, chunk_size)]
+
+    def pages():
+        if num_workers > 1 and len(page_ranges) > 1:
+            with _worker_pdf_path(doc) as path, _page_parse_pool(min(num_workers, len(page_ranges))) as executor:
+                futures = [
+                    executor.submit(_extract_page_tokens_range, path, pdf_parser, model, start, end)
+                    for start, end in page_ranges
+                ]
+                for future in futures:
+                    yield from future.result()
+            return
+        for start, end in page_ranges:
+            yield from _extract_page_tokens_range(doc, pdf_parser, model, start, end)
+            # the store has the text now, the handle does not need to keep it
+            doc.forget_page_texts()
+
+    return PageStore.create(pages(), dir=store_dir or None)
+
+
+def get_pdf_outline(pdf_path):
+    """Return the embedded bookmarks as [[level, title, page]] (1-based pages), or [] if there are none."""
+    try:
+        return Document.open(pdf_path).outline()
+    except Exception as e:
+        logging.warning(f"Could not read the PDF outline: {e}")
+        return []
+
 
-        
 
 def get_text_of_pdf_pages(pdf_pages, start_page, end_page):
+    if isinstance(pdf_pages, PageStore):
+        # one contiguous slice of the map, decoded once
+        return pdf_pages.get_text_range(start_page, end_page)
     text = ""
     for page_num in range(start_page-1, end_page):
         text += pdf_pages[page_num][0]
@@ -507,9 +659,7 @@ def get_text_of_pdf_pages_with_labels(pdf_pages, start_page, end_page):
     return text
 
 def get_number_of_pages(pdf_path):
-    pdf_reader = PyPDF2.PdfReader(pdf_path)
-    num = len(pdf_reader.pages)
-    return num
+    return Document.open(pdf_path).page_count
 
 
 
@@ -586,6 +736,20 @@ def remove_structure_text(data):
     return data
 
 
+def materialize_structure_text(data):
+    """Replace lazy PageRangeText node text with the str it reads from the page store."""
+    if isinstance(data, dict):
+        if isinstance(data.get('text'), PageRangeText):
+            data['text'] = str(data['text'])
+        for key in ('structure', 'nodes'):
+            if key in data:
+                materialize_structure_text(data[key])
+    elif isinstance(data, list):
+        for item in data:
+            materialize_structure_text(item)
+    return data
+
+
 def check_token_limit(structure, limit=110000):
     list = structure_to_list(structure)
     for node in list:
@@ -636,7 +800,11 @@ def add_node_text(node, pdf_pages):
     if isinstance(node, dict):
         start_page = node.get('start_index')
         end_page = node.get('end_index')
-        node['text'] = get_text_of_pdf_pages(pdf_pages, start_page, end_page)
+        if isinstance(pdf_pages, PageStore):
+            # read from the page store when needed, see materialize_structure_text and json_default
+            node['text'] = PageRangeText(pdf_pages, start_page, end_page)
+        else:
+            node['text'] = get_text_of_pdf_pages(pdf_pages, start_page, end_page)
         if 'nodes' in node:
             add_node_text(node['nodes'], pdf_pages)
     elif isinstance(node, list):
@@ -649,7 +817,10 @@ def add_node_text_with_labels(node, pdf_pages):
     if isinstance(node, dict):
         start_page = node.get('start_index')
         end_page = node.get('end_index')
-        node['text'] = get_text_of_pdf_pages_with_labels(pdf_pages, start_page, end_page)
+        if isinstance(pdf_pages, PageStore):
+            node['text'] = PageRangeText(pdf_pages, start_page, end_page, with_labels=True)
+        else:
+            node['text'] = get_text_of_pdf_pages_with_labels(pdf_pages, start_page, end_page)
         if 'nodes' in node:
             add_node_text_with_labels(node['nodes'], pdf_pages)
     elif isinstance(node, list):
@@ -666,7 +837,7 @@ async def generate_node_summary(node, model=None):
     
     Directly return the description, do not include any other text.
     """
-    response = await llm_model.generate_async(prompt)
+    response = await get_llm(model).generate_async(prompt)
     return response
 
 
@@ -711,7 +882,7 @@ def generate_doc_description(structure, model=None):
     
     Directly return the description, do not include any other text.
     """
-    response = llm_model.generate(prompt)
+    response = get_llm(model).generate(prompt)
     return response
 
 
@@ -766,4 +937,63 @@ class ConfigLoader:
 
         self._validate_keys(user_dict)
         merged = {**self._default_dict, **user_dict}
-        return config(**merged)
\ No newline at end of file
+        return config(**merged)
+
+
+_default_model_name = None
+
+def get_llm(model=None):
+    """
+    Return the shared model instance for `model` (opt.model), defaulting to the
+    model configured in config.yaml. Every pipeline stage asking for the same
+    model gets the same instance, so the weights are loaded once per process.
+    """
+    global _default_model_name
+    if model is None:
+        if _default_model_name is None:
+            _default_model_name = ConfigLoader().load().model
+        model = _default_model_name
+    return get_model(model)
+
+
+def configure_llm_cache(opt):
+    """
+    Enable ("yes"), disable ("no") or empty and then enable ("clear") the on-disk
+    LLM response cache used by every shared model, according to opt.llm_cache.
+    Only deterministic backends are cached (OpenAI models at temperature 0 and
+    greedy GPT2); Qwen and Llama sample, so the registry warns and they bypass it.
+    """
+    if opt.llm_cache == 'no':
+        set_response_cache(None)
+        return None
+    cache = get_response_cache()
+    if cache is None or cache.path != opt.llm_cache_path:
+        cache = ResponseCache(opt.llm_cache_path, max_size_mb=opt.llm_cache_max_mb)
+    if opt.llm_cache == 'clear':
+        cache.clear()
+    set_response_cache(cache)
+    return cache
+
+
+def configure_title_matcher(opt):
+    """Decide clear title checks locally ("yes") or send all of them to the LLM ("no"), according to opt.title_matcher."""
+    if opt.title_matcher == 'no':
+        set_title_matcher(None)
+        return None
+    matcher = TitleMatcher(yes_threshold=opt.title_match_yes_threshold, no_threshold=opt.title_match_no_threshold)
+    set_title_matcher(matcher)
+    return matcher
+
+
+def configure_rate_limiter(opt):
+    """Limit API requests per minute, tokens per minute and requests in flight (0 means unlimited)."""
+    if not (opt.llm_requests_per_minute or opt.llm_tokens_per_minute or opt.llm_max_concurrency):
+        set_rate_limiter(None)
+        return None
+    limiter = RateLimiter(
+        requests_per_minute=opt.llm_requests_per_minute,
+        tokens_per_minute=opt.llm_tokens_per_minute,
+        max_concurrency=opt.llm_max_concurrency,
+    )
+    set_rate_limiter(limiter)
+    return limiter
@@ -0,0 +1,46 @@
+import argparse
+import sys
+
+from pageindex.batch import collect_documents, index_corpus
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Index a corpus of PDF and Markdown documents in parallel')
+    parser.add_argument('inputs', nargs='*', help='Directories, glob patterns or document paths')
+    parser.add_argument('--manifest', type=str, help='File listing documents, one path per line or a JSON list')
+    parser.add_argument('--output-dir', type=str, default='./tests/results', help='Where structures and the report are written')
+    parser.add_argument('--workers', type=int, default=0,
+                      help='Worker processes (0: one per core for API models, one for local models)')
+    parser.add_argument('--force', action='store_true', help='Re-index documents that are up to date')
+
+    parser.add_argument('--model', type=str, default=None, help='Model to use (default from config.yaml)')
+    parser.add_argument('--if-add-node-id', type=str, default=None, help='Whether to add node id to the node')
+    parser.add_argument('--if-add-node-summary', type=str, default=None, help='Whether to add summary to the node')
+    parser.add_argument('--if-add-doc-description', type=str, default=None, help='Whether to add doc description to the doc')
+    parser.add_argument('--if-add-node-text', type=str, default=None, help='Whether to add text to the node')
+    parser.add_argument('--llm-cache', type=str, default=None, choices=['yes', 'no', 'clear'],
+                      help='Reuse cached deterministic LLM responses (yes), bypass the cache (no), or empty it first (clear)')
+    args = parser.parse_args()
+
+    documents = collect_documents(args.inputs, manifest=args.manifest)
+    if not documents:
+        parser.error('no PDF or Markdown documents found')
+
+    user_opt = {
+        key: value for key, value in {
+            'model': args.model,
+            'if_add_node_id': args.if_add_node_id,
+            'if_add_node_summary': args.if_add_node_summary,
+            'if_add_doc_description': args.if_add_doc_description,
+            'if_add_node_text': args.if_add_node_text,
+            'llm_cache': args.llm_cache,
+        }.items() if value is not None
+    }
+    report = index_corpus(documents, args.output_dir, user_opt=user_opt, workers=args.workers, force=args.force)
+
+    print(f"\n{'document':<60} {'status':<8} {'seconds':>8}")
+    for entry in report['documents']:
+        seconds = '' if entry['seconds'] is None else f"{entry['seconds']:.2f}"
+        print(f"{entry['document'][-60:]:<60} {entry['status']:<8} {seconds:>8}")
+    print(f"\n{report['indexed']} indexed, {report['skipped']} skipped, {report['failed']} failed "
+          f"in {report['wall_seconds']:.2f}s")
+    sys.exit(1 if report['failed'] else 0)
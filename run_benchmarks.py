@@ -0,0 +1,337 @@
+import argparse
+import os
+import time
+
+import PyPDF2
+
+from pageindex.models.tokenizer_registry import get_encoder, count_tokens_many, clear_tokenizer_cache
+
+PDF_DIR = './tests/pdfs'
+
+
+def list_pdfs(pdf_dir):
+    return sorted(
+        os.path.join(pdf_dir, name) for name in os.listdir(pdf_dir)
+        if name.lower().endswith('.pdf')
+    )
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_tokenizer(args):
+    """Per-call tokenizer loading vs. the cached registry vs. batched counting."""
+    from transformers import AutoTokenizer
+
+    def uncached_counts(texts):
+        # what count_tokens used to do: reload the tokenizer for every text
+        counts = []
+        for text in texts:
+            tokenizer = AutoTokenizer.from_pretrained(args.model, trust_remote_code=True)
+            counts.append(len(tokenizer.encode(text)) if text else 0)
+        return counts
+
+    def cached_counts(texts):
+        encoder = get_encoder(args.model)
+        return [len(encoder.encode(text)) if text else 0 for text in texts]
+
+    print(f"{'document':<60} {'pages':>5} {'uncached/pg':>12} {'cached':>9} {'batched':>9}")
+    for pdf_path in list_pdfs(args.pdf_dir):
+        texts = [page.extract_text() for page in PyPDF2.PdfReader(pdf_path).pages]
+        sample = texts[:args.uncached_pages]
+
+        _, uncached_time = timed(uncached_counts, sample)
+        clear_tokenizer_cache()
+        get_encoder(args.model)  # warm the registry, load time is paid once per process
+        cached, cached_time = timed(cached_counts, texts)
+        batched, batched_time = timed(count_tokens_many, texts, model=args.model)
+        assert cached == batched
+
+        name = os.path.basename(pdf_path)[:60]
+        per_page = uncached_time / max(len(sample), 1)
+        print(f"{name:<60} {len(texts):>5} {per_page:>11.3f}s {cached_time:>8.3f}s {batched_time:>8.3f}s")
+
+
+def bench_batching(args):
+    """Throughput of concurrent prompts on a small CPU model with and without micro-batching."""
+    import asyncio
+    from pageindex.models import GPT2Model
+
+    pdf_path = list_pdfs(args.pdf_dir)[0]
+    pages = [page.extract_text() for page in PyPDF2.PdfReader(pdf_path).pages]
+    prompts = [f"Summarize: {page[:300]}" for page in pages if page.strip()][:args.num_prompts]
+
+    async def run_all(model):
+        return await asyncio.gather(*[model.generate_async(prompt) for prompt in prompts])
+
+    print(f"{len(prompts)} prompts, {args.max_new_tokens} new tokens each")
+    for max_batch_size in (1, args.max_batch_size):
+        model = GPT2Model(max_new_tokens=args.max_new_tokens, max_batch_size=max_batch_size,
+                          max_in_flight=len(prompts), max_wait_ms=args.max_wait_ms)
+        model.generate("warm up")
+        _, elapsed = timed(asyncio.run, run_all(model))
+        print(f"max_batch_size={max_batch_size:<3} {elapsed:8.2f}s  {len(prompts) / elapsed:6.2f} prompts/s")
+
+
+def bench_toc_modes(args):
+    """Wall-clock TOC generation for documents without a TOC: sequential vs. parallel page groups."""
+    from pageindex.models import set_response_cache
+    from pageindex.page_index import process_no_toc
+    from pageindex.utils import get_page_tokens, JsonLogger
+
+    # every call must reach the model, otherwise the second run only measures cache hits
+    set_response_cache(None)
+    print(f"{'document':<60} {'mode':<10} {'items':>5} {'time':>9}")
+    for pdf_path in list_pdfs(args.pdf_dir):
+        page_list = get_page_tokens(pdf_path, model=args.model)
+        logger = JsonLogger(pdf_path)
+        name = os.path.basename(pdf_path)[:60]
+        for mode in ('sequential', 'parallel'):
+            toc, elapsed = timed(process_no_toc, page_list, model=args.model, logger=logger,
+                                 mode=mode, max_workers=args.workers)
+            print(f"{name:<60} {mode:<10} {len(toc):>5} {elapsed:>8.2f}s")
+        logger.close()
+
+
+def bench_openai_client(args):
+    """GPTModel against a local mock chat-completions server: pooled clients, rate limits and Retry-After."""
+    import asyncio
+    import json
+    import random
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from pageindex.models import GPTModel, RateLimiter
+
+    stats = {'requests': 0, 'throttled': 0, 'in_flight': 0, 'peak_in_flight': 0}
+    lock = threading.Lock()
+
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            with lock:
+                stats['requests'] += 1
+                stats['in_flight'] += 1
+                stats['peak_in_flight'] = max(stats['peak_in_flight'], stats['in_flight'])
+                throttled = random.random() < args.throttle_rate
+                stats['throttled'] += throttled
+            time.sleep(args.latency_ms / 1000)
+            if throttled:
+                body, status, headers = b'{"error": {"message": "rate limited"}}', 429, {'Retry-After': '0.2'}
+            else:
+                body, status, headers = json.dumps({
+                    'id': 'mock', 'object': 'chat.completion', 'created': 0, 'model': 'gpt-mock',
+                    'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': 'ok'}}],
+                    'usage': {'prompt_tokens': 10, 'completion_tokens': 1, 'total_tokens': 11},
+                }).encode(), 200, {}
+            self.send_response(status)
+            for name, value in {'Content-Type': 'application/json', 'Content-Length': str(len(body)), **headers}.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+            with lock:
+                stats['in_flight'] -= 1
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    limiter = RateLimiter(requests_per_minute=args.rpm, max_concurrency=args.max_concurrency)
+    model = GPTModel('gpt-mock', api_key='mock', base_url=f'http://127.0.0.1:{server.server_port}/v1',
+                     sleep_time=5, base_delay=0.1, rate_limiter=limiter)
+
+    async def run_all():
+        return await asyncio.gather(*[model.generate_async(f'prompt {i}') for i in range(args.num_requests)])
+
+    responses, elapsed = timed(asyncio.run, run_all())
+    server.shutdown()
+    print(f"{len(responses)} requests in {elapsed:.2f}s, {sum(r == 'ok' for r in responses)} ok")
+    print(f"server saw {stats['requests']} calls, {stats['throttled']} throttled, peak concurrency {stats['peak_in_flight']}")
+
+
+def bench_carried_state(args):
+    """Prompt tokens and time of generate_toc_continue with the full TOC vs. the compact carried state."""
+    from pageindex.models import set_response_cache
+    from pageindex.page_index import process_no_toc
+    from pageindex.utils import get_llm, get_page_tokens, JsonLogger
+
+    set_response_cache(None)
+    llm = get_llm(args.model)
+    generate = llm.generate
+    calls = []
+
+    def recording_generate(prompt, *gen_args, **gen_kwargs):
+        start = time.perf_counter()
+        result = generate(prompt, *gen_args, **gen_kwargs)
+        if 'Previous tree structure' in prompt:
+            calls.append((count_tokens_many([prompt], model=args.model)[0], time.perf_counter() - start))
+        return result
+
+    llm.generate = recording_generate
+    print(f"{'document':<50} {'pages':>5} {'state':>7} {'calls':>5} {'prompt tokens':>13} {'continue':>9} "
+          f"{'total':>9} {'items':>5} {'same toc':>8}")
+    try:
+        for pdf_path in list_pdfs(args.pdf_dir):
+            page_list = get_page_tokens(pdf_path, model=args.model)
+            if len(page_list) < args.min_pages:
+                continue
+            logger = JsonLogger(pdf_path)
+            name = os.path.basename(pdf_path)[:50]
+            tocs = []
+            for state_entries in (0, args.entries):
+                calls.clear()
+                toc, elapsed = timed(process_no_toc, page_list, model=args.model, logger=logger,
+                                     state_entries=state_entries)
+                tocs.append([(item.get('structure'), item.get('title'), item.get('physical_index')) for item in toc])
+                label = 'full' if not state_entries else f'last {state_entries}'
+                same = '' if len(tocs) == 1 else ('yes' if tocs[0] == tocs[1] else 'no')
+                print(f"{name:<50} {len(page_list):>5} {label:>7} {len(calls):>5} "
+                      f"{sum(tokens for tokens, _ in calls):>13} {sum(t for _, t in calls):>8.2f}s "
+                      f"{elapsed:>8.2f}s {len(toc):>5} {same:>8}")
+            logger.close()
+    finally:
+        del llm.generate
+
+
+def _page_store_peak_rss(pdf_path, mode, model, node_pages, result_queue):
+    # runs in a fresh process so that ru_maxrss only covers this mode
+    import json
+    import resource
+    from pageindex.page_store import json_default
+    from pageindex.utils import get_page_tokens, get_page_store, add_node_text, materialize_structure_text
+
+    if mode == 'mmap':
+        page_list = get_page_store(pdf_path, model=model)
+    else:
+        page_list = get_page_tokens(pdf_path, model=model)
+    # a chapter per node_pages pages, each with one section per page, like a deep tree
+    structure = []
+    for start in range(1, len(page_list) + 1, node_pages):
+        end = min(start + node_pages - 1, len(page_list))
+        children = [{'start_index': page, 'end_index': page} for page in range(start, end + 1)]
+        structure.append({'start_index': start, 'end_index': end, 'nodes': children})
+    add_node_text(structure, page_list)
+    if mode == 'mmap':
+        # as page_index_main does before returning the tree
+        materialize_structure_text(structure)
+    with open(os.devnull, 'w', encoding='utf-8') as f:
+        json.dump(structure, f, default=json_default)
+    result_queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def bench_page_store(args):
+    """Peak RSS of page parsing plus node text on the largest PDF: in-memory page_list vs. mmap PageStore."""
+    import multiprocessing
+
+    pdf_path = max(list_pdfs(args.pdf_dir), key=os.path.getsize)
+    print(f"{os.path.basename(pdf_path)} ({os.path.getsize(pdf_path) / 2**20:.1f} MB)")
+    context = multiprocessing.get_context('spawn')
+    peaks = {}
+    for mode in ('memory', 'mmap'):
+        result_queue = context.Queue()
+        process = context.Process(target=_page_store_peak_rss,
+                                  args=(pdf_path, mode, args.model, args.node_pages, result_queue))
+        start = time.perf_counter()
+        process.start()
+        # the result is one float, so joining before reading the queue cannot block
+        process.join()
+        if process.exitcode != 0:
+            print(f"{mode:<7} failed with exit code {process.exitcode}")
+            continue
+        peaks[mode] = result_queue.get()
+        print(f"{mode:<7} peak RSS {peaks[mode]:8.1f} MB  {time.perf_counter() - start:7.2f}s")
+    if len(peaks) == 2:
+        print(f"mmap saves {peaks['memory'] - peaks['mmap']:.1f} MB ({1 - peaks['mmap'] / peaks['memory']:.0%})")
+
+
+def synthetic_markdown(num_headings, seed=0):
+    """Markdown with num_headings sections nested up to six levels deep under one title."""
+    import random
+
+    rng = random.Random(seed)
+    lines = ['---', 'title: synthetic', '---', 'Document', '========', 'Introduction paragraph.']
+    level = 1
+    for i in range(num_headings - 1):
+        level = rng.randint(2, min(level + 1, 6))
+        lines.append(f"{'#' * level} Section {i}")
+        lines.append(' '.join(f'word{rng.randint(0, 999)}' for _ in range(rng.randint(5, 60))))
+        if i % 50 == 0:
+            lines.extend(['```', '# a comment, not a heading', '```'])
+        elif i % 50 == 25:
+            lines.extend(['', '    # indented code', '', '<div>', '# inside html', '</div>', '', '~~~', '# fenced', '~~~'])
+    return '\n'.join(lines)
+
+
+def bench_markdown(args):
+    """Markdown scanning, subtree token counts and thinning on synthetic documents of growing size."""
+    from pageindex.page_index_md import (extract_nodes_from_markdown, extract_node_text_content,
+                                         update_node_list_with_text_token_count, tree_thinning_for_index)
+
+    print(f"{'headings':>9} {'scan':>8} {'tokens':>8} {'thinning':>9} {'us/heading':>11}")
+    for num_headings in sorted(args.headings):
+        content = synthetic_markdown(num_headings)
+        (node_list, lines), scan_time = timed(extract_nodes_from_markdown, content)
+        nodes = extract_node_text_content(node_list, lines)
+        counted, count_time = timed(update_node_list_with_text_token_count, nodes, model=args.model)
+        thinned, thin_time = timed(tree_thinning_for_index, counted, args.threshold, model=args.model)
+        total = scan_time + count_time + thin_time
+        print(f"{len(nodes):>9} {scan_time:>7.2f}s {count_time:>7.2f}s {thin_time:>8.2f}s "
+              f"{total / len(nodes) * 1e6:>10.1f}  ({len(thinned)} nodes after thinning)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for the PageIndex pipeline')
+    parser.add_argument('--pdf-dir', type=str, default=PDF_DIR, help='Folder with the sample PDFs')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    tokenizer_parser = subparsers.add_parser('tokenizer', help='Token counting with and without the tokenizer registry')
+    tokenizer_parser.add_argument('--model', type=str, default='Qwen/Qwen3-8B', help='Tokenizer to benchmark')
+    tokenizer_parser.add_argument('--uncached-pages', type=int, default=10,
+                                  help='Pages per document timed with per-call tokenizer loading')
+    tokenizer_parser.set_defaults(func=bench_tokenizer)
+
+    batching_parser = subparsers.add_parser('batching', help='Local-model throughput with dynamic request batching')
+    batching_parser.add_argument('--num-prompts', type=int, default=32, help='Number of concurrent prompts')
+    batching_parser.add_argument('--max-batch-size', type=int, default=16, help='Batch size to compare against 1')
+    batching_parser.add_argument('--max-wait-ms', type=int, default=20, help='Batch collection window')
+    batching_parser.add_argument('--max-new-tokens', type=int, default=32, help='Tokens generated per prompt')
+    batching_parser.set_defaults(func=bench_batching)
+
+    toc_parser = subparsers.add_parser('toc-modes', help='Sequential vs. parallel TOC generation for documents without a TOC')
+    toc_parser.add_argument('--model', type=str, default='Qwen/Qwen3-4B-Instruct-2507', help='Model used for TOC generation')
+    toc_parser.add_argument('--workers', type=int, default=4, help='Concurrent page groups in parallel mode')
+    toc_parser.set_defaults(func=bench_toc_modes)
+
+    carried_parser = subparsers.add_parser('carried-state', help='Full vs. compact TOC state carried into generate_toc_continue')
+    carried_parser.add_argument('--model', type=str, default='Qwen/Qwen3-4B-Instruct-2507', help='Model used for TOC generation')
+    carried_parser.add_argument('--entries', type=int, default=20, help='TOC entries carried in the compact state')
+    carried_parser.add_argument('--min-pages', type=int, default=200, help='Skip documents with fewer pages')
+    carried_parser.set_defaults(func=bench_carried_state)
+
+    openai_parser = subparsers.add_parser('openai-client', help='OpenAI client limits and retries against a local mock server')
+    openai_parser.add_argument('--num-requests', type=int, default=200, help='Concurrent generate_async calls')
+    openai_parser.add_argument('--max-concurrency', type=int, default=16, help='Requests in flight allowed by the limiter')
+    openai_parser.add_argument('--rpm', type=int, default=6000, help='Requests per minute allowed by the limiter')
+    openai_parser.add_argument('--latency-ms', type=int, default=50, help='Mock server response time')
+    openai_parser.add_argument('--throttle-rate', type=float, default=0.1, help='Share of calls answered with 429')
+    openai_parser.set_defaults(func=bench_openai_client)
+
+    store_parser = subparsers.add_parser('page-store', help='Peak memory of the in-memory page list vs. the mmap page store')
+    store_parser.add_argument('--model', type=str, default='Qwen/Qwen3-8B', help='Tokenizer used for page token counts')
+    store_parser.add_argument('--node-pages', type=int, default=20, help='Pages per top-level node of the synthetic tree')
+    store_parser.set_defaults(func=bench_page_store)
+
+    markdown_parser = subparsers.add_parser('markdown', help='Scaling of the markdown tree pipeline on synthetic documents')
+    markdown_parser.add_argument('--model', type=str, default='gpt-4o-2024-11-20', help='Tokenizer used for node token counts')
+    markdown_parser.add_argument('--headings', type=int, nargs='+', default=[6250, 12500, 25000, 50000],
+                                 help='Document sizes in headings')
+    markdown_parser.add_argument('--threshold', type=int, default=5000, help='Thinning threshold in tokens')
+    markdown_parser.set_defaults(func=bench_markdown)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -1,8 +1,8 @@
 import argparse
 import os
-import json
 from pageindex import *
 from pageindex.page_index_md import md_to_tree
+from pageindex.tree_writer import OUTPUT_FORMATS, output_suffix, write_tree
 
 if __name__ == "__main__":
     # Set up argument parser
@@ -27,6 +27,16 @@ if __name__ == "__main__":
                       help='Whether to add doc description to the doc')
     parser.add_argument('--if-add-node-text', type=str, default='no',
                       help='Whether to add text to the node')
+    parser.add_argument('--llm-cache', type=str, default='no', choices=['yes', 'no', 'clear'],
+                      help='Reuse cached deterministic LLM responses (yes), bypass the cache (no), or empty it first (clear)')
+    parser.add_argument('--incremental', type=str, default='no', choices=['yes', 'no'],
+                      help='Reuse the index of unchanged pages from the previous run of this PDF')
+    parser.add_argument('--incremental-base', type=str, default='',
+                      help='Index state of an earlier version to diff against, e.g. results/index_state/<old draft>.index.json')
+    parser.add_argument('--output-format', type=str, default='json', choices=list(OUTPUT_FORMATS),
+                      help='json (indented), compact (no whitespace) or jsonl (one node per line with parent_id)')
+    parser.add_argument('--compression', type=str, default='none', choices=['none', 'gzip', 'zstd'],
+                      help='Compress the output file (zstd needs the zstandard package)')
                       
     # Markdown specific arguments
     parser.add_argument('--if-thinning', type=str, default='no',
@@ -36,6 +46,7 @@ if __name__ == "__main__":
     parser.add_argument('--summary-token-threshold', type=int, default=200,
                       help='Token threshold for generating summaries (markdown only)')
     args = parser.parse_args()
+    compression = None if args.compression == 'none' else args.compression
     
     # Validate that exactly one file type is specified
     if not args.pdf_path and not args.md_path:
@@ -60,21 +71,24 @@ if __name__ == "__main__":
             if_add_node_id=args.if_add_node_id,
             if_add_node_summary=args.if_add_node_summary,
             if_add_doc_description=args.if_add_doc_description,
-            if_add_node_text=args.if_add_node_text
+            if_add_node_text=args.if_add_node_text,
+            llm_cache=args.llm_cache,
+            incremental=args.incremental,
+            incremental_base=args.incremental_base
         )
 
         # Process the PDF
-        toc_with_page_number = page_index_main(args.pdf_path, opt)
+        # with the mmap page store, node text stays in it until write_tree reaches the node
+        toc_with_page_number = page_index_main(args.pdf_path, opt, lazy_text=True)
         print('Parsing done, saving to file...')
         
         # Save results
         pdf_name = os.path.splitext(os.path.basename(args.pdf_path))[0]    
         output_dir = './tests/results'
-        output_file = f'{output_dir}/{pdf_name}_structure.json'
+        output_file = f'{output_dir}/{pdf_name}_structure' + output_suffix(args.output_format, compression)
         os.makedirs(output_dir, exist_ok=True)
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(toc_with_page_number, f, indent=2)
+        write_tree(toc_with_page_number, output_file, args.output_format, compression)
         
         print(f'Tree structure saved to: {output_file}')
             
@@ -92,7 +106,7 @@ if __name__ == "__main__":
         import asyncio
         
         # Use ConfigLoader to get consistent defaults (matching PDF behavior)
-        from pageindex.utils import ConfigLoader
+        from pageindex.utils import ConfigLoader, configure_llm_cache, configure_rate_limiter
         config_loader = ConfigLoader()
         
         # Create options dict with user args
@@ -101,11 +115,14 @@ if __name__ == "__main__":
             'if_add_node_summary': args.if_add_node_summary,
             'if_add_doc_description': args.if_add_doc_description,
             'if_add_node_text': args.if_add_node_text,
-            'if_add_node_id': args.if_add_node_id
+            'if_add_node_id': args.if_add_node_id,
+            'llm_cache': args.llm_cache
         }
         
         # Load config with defaults from config.yaml
         opt = config_loader.load(user_opt)
+        configure_llm_cache(opt)
+        configure_rate_limiter(opt)
         
         toc_with_page_number = asyncio.run(md_to_tree(
             md_path=args.md_path,
@@ -124,10 +141,9 @@ if __name__ == "__main__":
         # Save results
         md_name = os.path.splitext(os.path.basename(args.md_path))[0]    
         output_dir = './tests/results'
-        output_file = f'{output_dir}/{md_name}_structure.json'
+        output_file = f'{output_dir}/{md_name}_structure' + output_suffix(args.output_format, compression)
         os.makedirs(output_dir, exist_ok=True)
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(toc_with_page_number, f, indent=2, ensure_ascii=False)
+        write_tree(toc_with_page_number, output_file, args.output_format, compression)
         
         print(f'Tree structure saved to: {output_file}')
\ No newline at end of file
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pageindex.models.inference_worker import InferenceWorker
+
+
+def test_concurrent_submissions_run_one_batch_at_a_time_on_one_thread():
+    threads = set()
+    running = []
+    overlaps = []
+    lock = threading.Lock()
+
+    def batch_fn(items):
+        with lock:
+            threads.add(threading.current_thread().name)
+            running.append(1)
+            overlaps.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+        return [item * 2 for item in items]
+
+    worker = InferenceWorker(name='test-inference', batch_fn=batch_fn, max_batch_size=4, max_wait_ms=5)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        sync_results = list(executor.map(worker.run_batch_item_sync, range(16)))
+
+    async def submit_all():
+        return await asyncio.gather(*(worker.run_batch_item(item) for item in range(16, 32)))
+
+    async_results = asyncio.run(submit_all())
+
+    assert sync_results + async_results == [item * 2 for item in range(32)]
+    assert threads == {'test-inference'}
+    assert max(overlaps) == 1
+    # items were micro-batched, not run one by one
+    assert len(overlaps) < 32
+
+
+def test_blocking_call_from_the_worker_thread_fails_instead_of_deadlocking():
+    worker = InferenceWorker(name='test-inference', batch_fn=lambda items: [worker.run_batch_item_sync(0) for _ in items])
+
+    with pytest.raises(RuntimeError):
+        worker.submit_batch_item(1).result(timeout=5)
+
+
+def test_hf_generate_batch_leaves_the_shared_tokenizer_unchanged():
+    torch = pytest.importorskip('torch')
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    from pageindex.models.inference_worker import hf_generate_batch
+
+    backend = Tokenizer(models.WordLevel({'<eos>': 0, 'a': 1, 'b': 2, '<unk>': 3}, unk_token='<unk>'))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, eos_token='<eos>')
+
+    class EchoModel:
+        device = torch.device('cpu')
+
+        def generate(self, input_ids, attention_mask, **kwargs):
+            # "generates" token b twice after every prompt
+            return torch.cat([input_ids, torch.full((input_ids.shape[0], 2), 2)], dim=1)
+
+    outputs = hf_generate_batch(EchoModel(), tokenizer, ['a', 'a b a'])
+
+    assert outputs == [[2, 2], [2, 2]]
+    assert tokenizer.pad_token is None
+    assert tokenizer.padding_side == 'right'
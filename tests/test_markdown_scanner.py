@@ -0,0 +1,55 @@
+from pageindex.markdown_scanner import MarkdownScanner, iter_markdown_headings
+
+
+def headings(text):
+    return [(heading['node_title'], heading['level'], heading['line_num'])
+            for heading in iter_markdown_headings(text.split('\n'))]
+
+
+def test_atx_and_setext_headings():
+    text = "# Title #\n\nOverview\nof the work\n========\n\nDetails\n---\n####### not a heading\n#hashtag\n"
+    assert headings(text) == [('Title', 1, 1), ('Overview of the work', 1, 3), ('Details', 2, 7)]
+
+
+def test_code_html_and_front_matter_are_skipped():
+    text = "\n".join([
+        "---",
+        "title: Report",
+        "# not a heading",
+        "---",
+        "# Intro",
+        "```python",
+        "# comment",
+        "```",
+        "~~~~",
+        "# still code",
+        "```",
+        "~~~~",
+        "    # indented code",
+        "<div>",
+        "# inside html",
+        "",
+        "<!--",
+        "# commented out",
+        "-->",
+        "## Next",
+    ])
+    assert headings(text) == [('Intro', 1, 5), ('Next', 2, 20)]
+
+
+def test_dashes_after_lists_and_breaks_are_not_setext_underlines():
+    text = "- item\n---\n\n***\n---\n\nText\n\n---\n"
+    assert headings(text) == []
+
+
+def test_unclosed_front_matter_is_scanned_as_markdown():
+    assert headings("---\n# Intro\ntext") == [('Intro', 1, 2)]
+
+
+def test_offsets_point_at_the_heading_line():
+    text = "intro\n\n## Part\nbody\nSetext\n===\n"
+    scanner = MarkdownScanner()
+    found = [heading for line in text.split('\n') for heading in scanner.feed(line)] + scanner.close()
+    # a setext heading starts at the first line of its paragraph
+    assert [heading['node_title'] for heading in found] == ['Part', 'body Setext']
+    assert [text[heading['offset']:].split('\n')[0] for heading in found] == ['## Part', 'body']
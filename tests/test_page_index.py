@@ -0,0 +1,237 @@
+import asyncio
+import importlib
+import json
+import re
+from types import SimpleNamespace
+
+from pageindex.page_index import (compact_toc_state, find_toc_pages, merge_partial_tocs, missing_page_number_windows,
+                                  process_no_toc, shift_structure, verify_toc)
+
+# the package re-exports a page_index function that shadows the module's name
+page_index_module = importlib.import_module('pageindex.page_index')
+
+
+def tagged_pages(first, last):
+    return ''.join(f'<physical_index_{page}>\npage {page}\n<physical_index_{page}>\n\n' for page in range(first, last + 1))
+
+
+def test_merge_partial_tocs_continues_a_section_split_by_a_group_boundary():
+    # the second group starts on page 3, inside section 2, and numbers its sections from 1 again
+    partial_tocs = [
+        [
+            {'structure': '1', 'title': 'Introduction', 'physical_index': '<physical_index_1>'},
+            {'structure': '2', 'title': 'Methods', 'physical_index': '<physical_index_2>'},
+            {'structure': '2.1', 'title': 'Data', 'physical_index': '<physical_index_3>'},
+        ],
+        [
+            {'structure': '1', 'title': 'Data', 'physical_index': '<physical_index_3>'},
+            {'structure': '2', 'title': 'Models', 'physical_index': '<physical_index_4>'},
+            {'structure': '2.1', 'title': 'Training', 'physical_index': '<physical_index_5>'},
+        ],
+    ]
+    merged = merge_partial_tocs(partial_tocs, [tagged_pages(1, 3), tagged_pages(3, 5)])
+
+    assert [(item['structure'], item['title'], item['physical_index']) for item in merged] == [
+        ('1', 'Introduction', 1),
+        ('2', 'Methods', 2),
+        ('2.1', 'Data', 3),
+        ('2.2', 'Models', 4),
+        ('2.2.1', 'Training', 5),
+    ]
+
+
+def test_shift_structure_adopts_the_anchor_parent_path_when_the_group_nests_deeper():
+    # the group numbered the anchor 1.1.1, the merged TOC has it as 2.1
+    partial_toc = [
+        {'structure': '1.1.1', 'title': 'Data'},
+        {'structure': '1.1.2', 'title': 'Models'},
+        {'structure': '1.1.2.1', 'title': 'Training'},
+        {'structure': '1.2', 'title': 'Results'},
+        {'structure': '2', 'title': 'Discussion'},
+    ]
+    shift_structure(partial_toc, ['1', '1', '1'], ['2', '1'])
+
+    assert [item['structure'] for item in partial_toc] == ['2.1', '2.2', '2.2.1', '2', '2']
+
+
+def test_find_toc_pages_stops_asking_the_llm_after_the_toc_ends(monkeypatch):
+    # the TOC is on pages 1 and 2 of a 20 page window; page 3 ends it
+    asked = []
+
+    def toc_detector_single_page(content, model=None):
+        asked.append(content)
+        return 'yes' if content in ('page 1', 'page 2') else 'no'
+
+    monkeypatch.setattr(page_index_module, 'toc_detector_single_page', toc_detector_single_page)
+    page_list = [(f'page {i}', 2) for i in range(40)]
+    for workers, expected_calls in ((1, 4), (2, 4), (3, 6)):
+        asked.clear()
+        opt = SimpleNamespace(toc_check_page_num=20, toc_prefilter='no', toc_detection_workers=workers, model=None)
+
+        assert find_toc_pages(0, page_list, opt) == [1, 2]
+        # one call per page up to the first 'no' after the TOC, plus the rest of that page's batch
+        assert len(asked) == expected_calls
+
+
+class FakeLLM:
+    def __init__(self, context_window, reply_tokens):
+        self.limits = (context_window, reply_tokens)
+
+    def context_limits(self):
+        return self.limits
+
+
+class NullLogger:
+    def info(self, message):
+        pass
+
+
+def test_process_no_toc_keeps_every_prompt_within_the_context_as_the_carried_state_grows(monkeypatch):
+    context_window, reply_tokens = 4000, 500
+
+    def count_tokens(text, model=None):
+        return len(text.split())
+
+    def sections(first, count):
+        return [{'structure': str(first + i + 1), 'title': 'a long section title of eight words',
+                 'physical_index': '<physical_index_1>'} for i in range(count)]
+
+    prompt_tokens = []
+
+    def generate_toc_init(part, model=None):
+        prompt_tokens.append(count_tokens(page_index_module._toc_init_prompt(part)))
+        return sections(0, 60)
+
+    def generate_toc_continue(toc_content, part, model=None, state_entries=20):
+        prompt_tokens.append(count_tokens(page_index_module._toc_continue_prompt(toc_content, part, state_entries)))
+        # the first continuation grows the carried state by more than the rest of its group leaves free
+        return sections(len(toc_content), 100 if len(toc_content) < 100 else 0)
+
+    monkeypatch.setattr(page_index_module, 'count_tokens', count_tokens)
+    monkeypatch.setattr(page_index_module, 'count_tokens_many',
+                        lambda texts, model=None: [count_tokens(text) for text in texts])
+    monkeypatch.setattr(page_index_module, 'get_llm', lambda model=None: FakeLLM(context_window, reply_tokens))
+    monkeypatch.setattr(page_index_module, 'generate_toc_init', generate_toc_init)
+    monkeypatch.setattr(page_index_module, 'generate_toc_continue', generate_toc_continue)
+
+    page_list = [(' '.join(['word'] * 100), 100) for _ in range(59)]
+    process_no_toc(page_list, logger=NullLogger(), state_entries=0)
+
+    assert max(prompt_tokens) <= context_window - reply_tokens
+    # the second group had to be split again after its first part grew the state
+    assert len(prompt_tokens) > 3
+
+
+class FakeVerifier:
+    """Answers batched verification prompts, 'no' for titles named Missing."""
+
+    def __init__(self):
+        self.prompts = []
+
+    async def generate_async(self, prompt):
+        self.prompts.append(prompt)
+        titles = re.findall(r'^\s*\d+\. (.+) \(physical_index_\d+\)$', prompt, re.MULTILINE)
+        return json.dumps({'answers': ['no' if title == 'Missing' else 'yes' for title in titles]})
+
+
+def test_verify_toc_checks_adjacent_pages_with_one_prompt(monkeypatch):
+    llm = FakeVerifier()
+    monkeypatch.setattr(page_index_module, 'get_llm', lambda model=None: llm)
+    monkeypatch.setattr(page_index_module, 'get_title_matcher', lambda: None)
+
+    page_list = [(f'page {page}', 100) for page in range(1, 9)]
+    toc = [
+        {'title': 'Introduction', 'physical_index': 1},
+        {'title': 'Scope', 'physical_index': 1},
+        {'title': 'Methods', 'physical_index': 2},
+        {'title': 'Missing', 'physical_index': 3},
+        {'title': 'Results', 'physical_index': 6},
+        {'title': 'Discussion', 'physical_index': 7},
+        {'title': 'Unplaced', 'physical_index': None},
+    ]
+    accuracy, incorrect = asyncio.run(verify_toc(page_list, toc, batch_max_tokens=1000))
+
+    # pages 1-3 and 6-7 are two runs of adjacent pages
+    assert len(llm.prompts) == 2
+    assert accuracy == 5 / 6
+    assert [(result['list_index'], result['title']) for result in incorrect] == [(3, 'Missing')]
+
+
+def test_missing_page_number_windows_asks_once_per_window():
+    page_list = [(f'page {page}', 10) for page in range(1, 11)]
+    toc_items = [
+        {'title': 'A', 'physical_index': 1},
+        {'title': 'B'},
+        {'title': 'C', 'physical_index': 4},
+        {'title': 'D', 'physical_index': 6},
+        {'title': 'E'},
+        {'title': 'F'},
+        {'title': 'G', 'physical_index': 6},
+        {'title': 'H'},
+    ]
+    # B lies on pages 1-4, E and F both on page 6, H after page 6
+    assert missing_page_number_windows(toc_items, page_list) == [(1, 4, [1]), (6, 6, [4, 5]), (6, 10, [7])]
+
+
+def parse_toc_state(state):
+    # the full state is one indented JSON list, the compact one a JSON object per line
+    if state.lstrip().startswith('['):
+        return json.loads(state)
+    return [json.loads(line) for line in state.splitlines()]
+
+
+def number_headings(part, state):
+    """Number the 'H1 ...' / 'H2 ...' headings of part after the last entry of state, like the model would."""
+    structures = [item['structure'] for item in state]
+    last = structures[-1].split('.') if structures else ['0']
+    entries = []
+    for page, text in re.findall(r'<physical_index_(\d+)>\n(.*?)\n<physical_index_\d+>', part, re.DOTALL):
+        for level, title in re.findall(r'^H([12]) (\S+)', text, re.MULTILINE):
+            if level == '1':
+                last = [str(int(last[0]) + 1)]
+            else:
+                parent = last[0]
+                # the section a subsection continues has to be visible in the carried state
+                assert parent in structures + [entry['structure'] for entry in entries]
+                last = [parent, str(int(last[1]) + 1) if len(last) > 1 else '1']
+            entries.append({'structure': '.'.join(last), 'title': title, 'physical_index': f'<physical_index_{page}>'})
+    return entries
+
+
+def test_compact_toc_state_yields_the_same_toc_as_the_full_state(monkeypatch):
+    def count_tokens(text, model=None):
+        return len(text.split())
+
+    state_tokens = {}
+
+    def generate_toc_init(part, model=None):
+        return number_headings(part, [])
+
+    def generate_toc_continue(toc_content, part, model=None, state_entries=20):
+        state = compact_toc_state(toc_content, state_entries)
+        state_tokens.setdefault(state_entries, []).append(count_tokens(state))
+        return number_headings(part, parse_toc_state(state))
+
+    monkeypatch.setattr(page_index_module, 'count_tokens', count_tokens)
+    monkeypatch.setattr(page_index_module, 'count_tokens_many',
+                        lambda texts, model=None: [count_tokens(text) for text in texts])
+    monkeypatch.setattr(page_index_module, 'get_llm', lambda model=None: FakeLLM(100000, 1000))
+    monkeypatch.setattr(page_index_module, 'generate_toc_init', generate_toc_init)
+    monkeypatch.setattr(page_index_module, 'generate_toc_continue', generate_toc_continue)
+
+    # one page per group; chapter 2 runs over pages 2-7, so its own entry scrolls out of a 2 entry state
+    headings = ['H1 Intro', 'H1 Methods\nH2 Data', 'H2 Sampling', 'H2 Cleaning', 'H2 Features',
+                'H2 Models', 'H2 Training', 'H1 Results\nH2 Accuracy', 'H2 Errors', 'H1 Outlook']
+    page_list = [(text + '\n' + ' '.join(['word'] * 400), 400) for text in headings]
+
+    tocs = {
+        state_entries: process_no_toc(page_list, logger=NullLogger(), max_group_tokens=500, state_entries=state_entries)
+        for state_entries in (0, 2)
+    }
+
+    assert tocs[2] == tocs[0]
+    assert [item['structure'] for item in tocs[0]] == [
+        '1', '2', '2.1', '2.2', '2.3', '2.4', '2.5', '2.6', '3', '3.1', '3.2', '4']
+    assert tocs[0][6]['physical_index'] == 6
+    # the full state grows with every group, the compact one stays bounded
+    assert state_tokens[2][-1] < state_tokens[0][-1]
@@ -0,0 +1,71 @@
+import asyncio
+import importlib
+
+from pageindex.page_index_md import (extract_node_text_content, extract_nodes_from_markdown, md_to_tree,
+                                     tree_thinning_for_index, update_node_list_with_text_token_count)
+
+page_index_md_module = importlib.import_module('pageindex.page_index_md')
+
+MARKDOWN = """# Guide
+Intro text.
+
+## Install
+pip install it
+
+### From source
+git clone
+
+## Usage
+run it
+
+# Reference
+api
+"""
+
+
+def word_counts(texts, model=None):
+    return [len(text.split()) for text in texts]
+
+
+def test_node_text_runs_from_the_heading_to_the_next_one():
+    node_list, lines = extract_nodes_from_markdown(MARKDOWN)
+    nodes = extract_node_text_content(node_list, lines)
+
+    assert [(node['title'], node['level'], node['line_num']) for node in nodes] == [
+        ('Guide', 1, 1), ('Install', 2, 4), ('From source', 3, 7), ('Usage', 2, 10), ('Reference', 1, 13),
+    ]
+    assert nodes[0]['text'] == '# Guide\nIntro text.'
+    assert nodes[2]['text'] == '### From source\ngit clone'
+    assert nodes[-1]['text'] == '# Reference\napi'
+
+
+def test_subtree_token_counts_match_counting_each_subtree(monkeypatch):
+    monkeypatch.setattr(page_index_md_module, 'count_tokens_many', word_counts)
+    node_list, lines = extract_nodes_from_markdown(MARKDOWN)
+    nodes = update_node_list_with_text_token_count(extract_node_text_content(node_list, lines))
+
+    def subtree_text(i):
+        end = next((j for j in range(i + 1, len(nodes)) if nodes[j]['level'] <= nodes[i]['level']), len(nodes))
+        return ' '.join(node['text'] for node in nodes[i:end])
+
+    assert [node['text_token_count'] for node in nodes] == [len(subtree_text(i).split()) for i in range(len(nodes))]
+
+    thinned = tree_thinning_for_index(nodes, min_node_token=12)
+    # Install and its child are merged; Guide (18 words) and the leaves stay
+    assert [node['title'] for node in thinned] == ['Guide', 'Install', 'Usage', 'Reference']
+    assert thinned[1]['text'] == '## Install\npip install it\n\n### From source\ngit clone'
+
+
+def test_md_to_tree_nests_sections(tmp_path, monkeypatch):
+    monkeypatch.setattr(page_index_md_module, 'count_tokens_many', word_counts)
+    path = tmp_path / 'guide.md'
+    path.write_text(MARKDOWN, encoding='utf-8')
+
+    result = asyncio.run(md_to_tree(str(path), if_thinning=True, min_token_threshold=12, if_add_node_text='yes'))
+
+    assert result['doc_name'] == 'guide'
+    guide, reference = result['structure']
+    assert [node['title'] for node in guide['nodes']] == ['Install', 'Usage']
+    assert 'nodes' not in guide['nodes'][0]
+    assert reference['text'] == '# Reference\napi'
+    assert [guide['node_id'], guide['nodes'][0]['node_id'], reference['node_id']] == ['0000', '0001', '0003']
@@ -0,0 +1,47 @@
+from pageindex.page_offsets import fit_page_offsets, match_page_pairs, parse_page_label, physical_index_for_page
+
+
+def test_parse_page_label():
+    assert parse_page_label(12) == ('arabic', 12)
+    assert parse_page_label(' 7 ') == ('arabic', 7)
+    assert parse_page_label('xiv') == ('roman', 14)
+    assert parse_page_label('IX') == ('roman', 9)
+    assert parse_page_label('A-1') is None
+    assert parse_page_label(True) is None
+    assert parse_page_label(None) is None
+
+
+def test_match_page_pairs_uses_normalized_titles():
+    toc_page = [{'title': '1. Introduction', 'page': 1}, {'title': 'Methods', 'page': 4}]
+    toc_physical_index = [
+        {'title': 'INTRODUCTION', 'physical_index': 9},
+        {'title': 'Methods', 'physical_index': 2},
+        {'title': 'Unlisted', 'physical_index': 15},
+    ]
+    assert match_page_pairs(toc_page, toc_physical_index, start_page_index=5) == [
+        {'title': 'INTRODUCTION', 'page': 1, 'physical_index': 9},
+    ]
+
+
+def test_fit_page_offsets_finds_segments_per_numbering():
+    pairs = (
+        # roman front matter starts on physical page 3
+        [{'page': label, 'physical_index': page + 2} for page, label in ((1, 'i'), (3, 'iii'), (5, 'v'))]
+        # chapters start at offset 8, an annex of 4 unnumbered pages follows page 40
+        + [{'page': page, 'physical_index': page + 8} for page in (1, 10, 25, 40)]
+        + [{'page': page, 'physical_index': page + 12} for page in (41, 50, 60)]
+        # one mismatched pair is ignored
+        + [{'page': 30, 'physical_index': 99}]
+    )
+    segments = fit_page_offsets(pairs)
+
+    assert segments == {'roman': [(1, 2)], 'arabic': [(1, 8), (41, 12)]}
+    assert physical_index_for_page(segments, 'iv') == 6
+    assert physical_index_for_page(segments, 33) == 41
+    assert physical_index_for_page(segments, '55') == 67
+    assert physical_index_for_page(segments, 'Annex') is None
+
+
+def test_fit_page_offsets_falls_back_to_the_most_common_offset():
+    pairs = [{'page': 1, 'physical_index': 3}, {'page': 5, 'physical_index': 8}, {'page': 9, 'physical_index': 11}]
+    assert fit_page_offsets(pairs) == {'arabic': [(1, 2)]}
@@ -0,0 +1,51 @@
+import copy
+import gc
+import json
+import os
+
+from pageindex.page_store import PageRangeText, PageStore, json_default
+from pageindex.utils import add_node_text, add_node_text_with_labels, get_text_of_pdf_pages
+
+PAGES = [('Einführung\nÜberblick', 5), ('', 0), ('Méthodes — données 😀', 7), ('Results\n', 2), ('end', 1)]
+
+
+def test_page_store_reads_like_the_page_list():
+    store = PageStore.create(PAGES)
+
+    assert len(store) == len(PAGES)
+    assert list(store) == PAGES
+    assert [store[i] for i in range(len(PAGES))] == PAGES
+    assert store[-1] == PAGES[-1]
+    assert list(store[1:4]) == PAGES[1:4]
+    assert list(store[1:4][1:]) == PAGES[2:4]
+    assert store[::2] == PAGES[::2]
+    for first in range(1, len(PAGES) + 1):
+        for last in range(first, len(PAGES) + 1):
+            assert store.get_text_range(first, last) == get_text_of_pdf_pages(PAGES, first, last)
+            assert store.token_count(first, last) == sum(tokens for _, tokens in PAGES[first - 1:last])
+
+
+def test_lazy_node_text_matches_the_in_memory_text():
+    store = PageStore.create(PAGES)
+    tree = [{'title': 'A', 'start_index': 1, 'end_index': 3,
+             'nodes': [{'title': 'A.1', 'start_index': 3, 'end_index': 5}]}]
+
+    for add_text in (add_node_text, add_node_text_with_labels):
+        expected, lazy = copy.deepcopy(tree), copy.deepcopy(tree)
+        add_text(expected, PAGES)
+        add_text(lazy, store)
+
+        assert isinstance(lazy[0]['text'], PageRangeText)
+        assert str(lazy[0]['nodes'][0]['text']) == expected[0]['nodes'][0]['text']
+        assert json.dumps(lazy, default=json_default) == json.dumps(expected)
+
+
+def test_temporary_file_is_removed_while_a_view_is_alive():
+    store = PageStore.create(PAGES)
+    path = store.path
+    view = store.raw_range(1, 1)
+    del store
+    gc.collect()
+
+    assert not os.path.exists(path)
+    assert str(view, 'utf-8') == PAGES[0][0]
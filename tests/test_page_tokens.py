@@ -0,0 +1,29 @@
+import os
+from io import BytesIO
+
+import pytest
+
+from pageindex.models.tokenizer_registry import count_tokens_many
+from pageindex.utils import get_page_tokens
+
+PDF_PATH = os.path.join(os.path.dirname(__file__), 'pdfs', 'CDR_Verteidigung_in_der_Tiefe-V1.1_de.pdf')
+MODEL = 'gpt-4o-2024-11-20'
+
+
+@pytest.fixture
+def tokenizer():
+    try:
+        count_tokens_many(['probe'], model=MODEL)
+    except Exception as e:
+        pytest.skip(f'tokenizer for {MODEL} is not available: {e}')
+
+
+@pytest.mark.parametrize('source', ['path', 'bytes'])
+def test_parallel_page_extraction_matches_serial(tokenizer, source):
+    serial = get_page_tokens(PDF_PATH, model=MODEL, num_workers=1)
+    with open(PDF_PATH, 'rb') as f:
+        pdf = PDF_PATH if source == 'path' else BytesIO(f.read())
+    parallel = get_page_tokens(pdf, model=MODEL, num_workers=2, chunk_size=16)
+
+    assert len(serial) > 16
+    assert parallel == serial
@@ -0,0 +1,31 @@
+import pytest
+
+from pageindex.prompt_packer import MIN_GROUP_TOKENS, iter_fitted_groups, prompt_token_budget
+
+
+class FakeLLM:
+    def __init__(self, context_window, reply_tokens):
+        self.limits = (context_window, reply_tokens)
+
+    def context_limits(self):
+        return self.limits
+
+
+def test_prompt_token_budget_never_exceeds_the_context():
+    llm = FakeLLM(8192, 2048)
+    assert prompt_token_budget(llm, 1000) == 8192 - 2048 - 1000 - 256
+    assert prompt_token_budget(llm, 1000, max_tokens=3000) == 3000
+    assert prompt_token_budget(llm, 1000, max_tokens=100) == MIN_GROUP_TOKENS
+    with pytest.raises(ValueError):
+        prompt_token_budget(llm, 5500)
+
+
+def test_iter_fitted_groups_skips_a_group_left_with_only_the_overlap_page():
+    pages = [(f'<physical_index_{page}>\npage {page}\n<physical_index_{page}>\n\n', 100) for page in (1, 2, 3)]
+    groups = [pages[0:2], pages[1:3]]
+    # the carried state grows after the first group, so the second no longer fits with its overlap page
+    budgets = iter([200, 100, 100, 100])
+
+    fitted = list(iter_fitted_groups(groups, lambda: next(budgets), model='gpt-4o'))
+
+    assert fitted == [pages[0:2], pages[2:3]]
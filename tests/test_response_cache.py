@@ -0,0 +1,72 @@
+import asyncio
+import logging
+
+from pageindex.models import ResponseCache
+from pageindex.models import registry
+from pageindex.models.BaseModel import BaseModel
+
+
+class CountingModel(BaseModel):
+    def __init__(self, model_name, params):
+        super().__init__(model_name)
+        self.params = params
+        self.calls = 0
+
+    def generation_params(self):
+        return self.params
+
+    def _generate(self, prompt, chat_history=None, include_finish_reason=False):
+        self.calls += 1
+        response = f"answer to {prompt}"
+        return (response, "finished") if include_finish_reason else response
+
+    async def _generate_async(self, prompt):
+        self.calls += 1
+        return f"answer to {prompt}"
+
+
+def test_deterministic_responses_are_served_from_the_cache(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = ResponseCache(path)
+    model = CountingModel('greedy', {'do_sample': False})
+    model.cache = cache
+
+    assert model.generate('a') == 'answer to a'
+    assert model.generate('a', include_finish_reason=True) == ('answer to a', 'finished')
+    assert asyncio.run(model.generate_async('a')) == 'answer to a'
+    assert model.generate('b') == 'answer to b'
+    assert model.calls == 2
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (2, 2, 2)
+    cache.close()
+
+    # a fresh process reopening the file still hits
+    reopened = ResponseCache(path)
+    model.cache = reopened
+    assert model.generate('b') == 'answer to b'
+    assert model.calls == 2
+    assert (reopened.hits, reopened.misses) == (1, 0)
+
+    reopened.clear()
+    assert model.generate('b') == 'answer to b'
+    assert model.calls == 3
+    reopened.close()
+
+
+def test_sampling_models_bypass_the_cache_with_a_warning(tmp_path, caplog):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    model = CountingModel('sampler', {'do_sample': True, 'temperature': 0.7})
+    registry._models[('test', 'sampler', 'auto')] = model
+    try:
+        with caplog.at_level(logging.WARNING):
+            registry.set_response_cache(cache)
+        assert 'sampler samples its responses' in caplog.text
+
+        model.generate('a')
+        model.generate('a')
+        assert model.calls == 2
+        assert cache.stats()['entries'] == 0
+    finally:
+        registry.set_response_cache(None)
+        registry._models.pop(('test', 'sampler', 'auto'))
+        cache.close()
@@ -0,0 +1,43 @@
+from pageindex.title_matcher import TitleMatcher, heading_match, normalize_text, strip_numbering, title_similarity
+
+
+def test_normalize_text_folds_hyphenation_case_and_punctuation():
+    assert normalize_text('Risk Manage-\n  ment:  Overview!') == 'risk management overview'
+
+
+def test_strip_numbering_removes_section_prefixes():
+    assert strip_numbering('2.3.1 Results') == 'Results'
+    assert strip_numbering('Chapter IV. Outlook') == 'Outlook'
+    assert strip_numbering('Appendix A.1 Tables') == 'Tables'
+
+
+def test_title_similarity():
+    assert title_similarity('3. Data Collection', 'Intro\ndata  collection\nmore') == 1.0
+    assert title_similarity('Data Collection Plan', 'the plan for data') == 2 / 3
+    assert title_similarity('Results', 'nothing relevant here') == 0.0
+
+
+def test_heading_match_needs_a_line_start_or_a_long_title():
+    body = 'Intro\nWe discuss the results of the survey in the next section.\n'
+    assert not heading_match('Results', body)
+    assert heading_match('Results', body + '4 Results\nThe survey shows')
+    assert heading_match('Results of the survey in', body)
+
+
+def test_appears_leaves_short_titles_in_body_text_to_the_llm():
+    matcher = TitleMatcher()
+    body = 'Intro\nWe discuss the results of the survey in the next section.\n'
+    assert matcher.appears('Results', body) is None
+    assert matcher.appears('4. Results', '4 Results\nThe survey shows') == 'yes'
+    assert matcher.appears('Budget Planning', body) == 'no'
+    assert matcher.stats() == {'local_yes': 1, 'local_no': 1, 'borderline': 1, 'llm_calls_avoided': 2}
+
+
+def test_starts_and_find_page():
+    matcher = TitleMatcher()
+    assert matcher.starts('Methods', 'Methods\nWe used') == 'yes'
+    assert matcher.starts('Methods', 'Results\nsee below\nMethods\nWe used') is None
+
+    pages = {1: 'Introduction\ntext', 2: 'Methods\ntext', 3: 'Results\ntext'}
+    assert matcher.find_page('Methods', pages) == 2
+    assert matcher.find_page('Appendix', pages) is None
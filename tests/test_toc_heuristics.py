@@ -0,0 +1,20 @@
+from pageindex.toc_heuristics import classify_toc_page
+
+
+def test_dotted_toc_with_heading_is_accepted_locally():
+    page = 'Table of Contents\n' + '\n'.join(f'{i} Chapter {i} ........ {i * 10}' for i in range(1, 8))
+    assert classify_toc_page(page)[0] == 'yes'
+
+
+def test_running_text_is_rejected_locally():
+    sentence = 'The committee reviewed the proposal in detail and agreed to revisit the budget next year'
+    page = '\n'.join([sentence] * 12)
+    decision, signals = classify_toc_page(page)
+    assert decision == 'no'
+    assert signals['prose_lines'] == 1
+
+
+def test_toc_without_page_numbers_goes_to_the_llm():
+    # no keyword, leaders or page numbers, but nothing that says it is not a TOC either
+    page = '\n'.join(['Introduction', 'Background', 'Methods', 'Results', 'Discussion', 'Outlook'])
+    assert classify_toc_page(page)[0] is None
@@ -0,0 +1,31 @@
+from pageindex.page_store import PageRangeText, PageStore
+from pageindex.tree_writer import iter_jsonl_nodes, iter_nodes, read_jsonl_tree, write_tree
+from pageindex.utils import add_node_text
+
+
+def test_generated_node_ids_do_not_clash_with_existing_ones(tmp_path):
+    structure = [
+        {'title': 'A', 'nodes': [{'title': 'A.1', 'node_id': '0000'}]},
+        {'title': 'B', 'node_id': '0001', 'nodes': [{'title': 'B.1'}]},
+    ]
+    ids = [node_id for _, node_id, _ in iter_nodes(structure)]
+    assert len(set(ids)) == len(ids)
+
+    path = str(tmp_path / 'tree.jsonl')
+    write_tree(structure, path, fmt='jsonl')
+    roots = read_jsonl_tree(path)
+    assert [node['title'] for node in roots] == ['A', 'B']
+    assert [child['title'] for child in roots[0]['nodes']] == ['A.1']
+    assert [child['title'] for child in roots[1]['nodes']] == ['B.1']
+
+
+def test_lazy_node_text_is_read_from_the_page_store_when_written(tmp_path):
+    store = PageStore.create([('first page', 2), ('second page', 2), ('third page', 2)])
+    structure = [{'title': 'A', 'start_index': 1, 'end_index': 2,
+                  'nodes': [{'title': 'A.1', 'start_index': 2, 'end_index': 3}]}]
+    add_node_text(structure, store)
+
+    path = str(tmp_path / 'tree.jsonl')
+    write_tree({'doc_name': 'doc.pdf', 'structure': structure}, path, fmt='jsonl')
+    assert [node['text'] for node in iter_jsonl_nodes(path)] == ['first pagesecond page', 'second pagethird page']
+    assert isinstance(structure[0]['text'], PageRangeText)
@@ -0,0 +1,20 @@
+from io import BytesIO
+
+import pymupdf
+
+from pageindex.models import tokenizer_registry
+from pageindex.utils import count_tokens, get_pdf_name
+
+
+def test_count_tokens_is_the_registry_function():
+    assert count_tokens is tokenizer_registry.count_tokens
+
+
+def test_get_pdf_name_sanitizes_the_title_of_an_in_memory_pdf():
+    pdf = pymupdf.open()
+    pdf.new_page()
+    pdf.set_metadata({'title': 'Annual report 2023/24'})
+    data = pdf.tobytes()
+
+    assert get_pdf_name(BytesIO(data)) == 'Annual report 2023-24'
+    assert get_pdf_name('/tmp/reports/annual.pdf') == 'annual.pdf'
@@ -1,94 +1,42 @@
-import fitz
 import json
 import uuid
-import re
-import unicodedata
 import os
 import argparse
 
+from pageindex.document import Document
+from pageindex.outline_text import NormalizedPages, slice_sections
+
 def generate_node_id():
     return str(uuid.uuid4())[:8]
 
 
 def get_outline(doc):
     #[level, title, page_number, ...]
-    return doc.get_toc(simple=True)
+    return doc.outline()
 
 
 def get_text_from_range(doc, start, end):
     text = ""
     for p in range(start - 1, end):
-        text += doc.load_page(p).get_text() + "\n"
+        text += doc.page_text(p) + "\n"
     return text.strip()
 
 def build_tree_with_toc(doc, outline):
     nodes = []
     stack = []
 
-    full_text_by_page = [doc.load_page(p).get_text() for p in range(doc.page_count)]
-
-    def normalize(s: str) -> str:
-        s = unicodedata.normalize("NFKC", s)
-        s = re.sub(r"\s+", " ", s)
-        return s
-
-    # def make_pattern(title: str):
-    #     clean = re.sub(r"^\d+(?:\.\d+)*\.\s*", "", title).strip()
-
-    #     return re.compile(
-    #         r"(?:\d+(?:\.\d+)*\.\s*)?" + re.escape(clean),
-    #         flags=re.MULTILINE
-    #     )
-
-    def make_pattern(title: str):
-        clean = re.sub(r"^\d+(?:\.\d+)*\.\s*", "", title).strip()
-
-        escaped = re.escape(clean)
-        flexible = re.sub(r"\\ ", r"\\s+", escaped)
-        pattern_str = r"(?:\d+(?:\.\d+)*\.\s*)?" + flexible
-
-        return re.compile(pattern_str, flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
-
-    def get_text_by_title(start_page, end_page, title, next_title=None):
-        text = "".join(full_text_by_page[start_page - 1:end_page])
-        norm_text = normalize(text)
-        # print("text:", norm_text)
-        norm_title = normalize(title)
-        # print("title:", norm_title)
-        norm_next = normalize(next_title) if next_title else None
-        # print("next_title:", norm_next)
-
-
-
-        pattern_title = make_pattern(norm_title)
-        match_title = pattern_title.search(norm_text)
-
-        if not match_title:
-            return norm_text.strip()
-
-        start_pos = match_title.start()
-
-        if norm_next:
-
-            pattern_next = make_pattern(norm_next)
-            match_next = pattern_next.search(norm_text, match_title.end())
-            if match_next:
-                return norm_text[start_pos:match_next.start()].strip()
-
-
-        return norm_text[start_pos:].strip()
+    # normalized once, every section is a slice of this buffer
+    pages = NormalizedPages(doc.page_texts())
 
+    entries = []
     for i, (level, title, start_idx) in enumerate(outline):
-
         if i < len(outline) - 1:
-            end_idx = outline[i + 1][2]
-            next_title = outline[i + 1][1]
+            entries.append((start_idx, outline[i + 1][2], title, outline[i + 1][1]))
         else:
-            end_idx = doc.page_count
-            next_title = None
-
+            entries.append((start_idx, doc.page_count, title, None))
+    texts = slice_sections(pages, entries)
 
-        text = get_text_by_title(start_idx, end_idx, title, next_title)
+    for (level, title, start_idx), text in zip(outline, texts):
 
         # prompt = f"""
         # You are given a part of a document, your task is to generate a description of the partial document about what are main points covered in the partial document.
@@ -125,7 +73,9 @@ def build_tree_with_toc(doc, outline):
     return nodes
 
 def extract_tree(pdf_path):
-    doc = fitz.open(pdf_path)
+    # accepts a path or an already opened Document, the file is parsed once either way
+    doc = Document.open(pdf_path, pdf_parser="PyMuPDF")
+    pdf_path = doc.path or doc.name
     # metadata = doc.metadata
     outline = get_outline(doc)
 
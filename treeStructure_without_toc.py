@@ -1,13 +1,11 @@
 import argparse
 import os
 import json
-import fitz
 import uuid
-import re
-import unicodedata
 
 from pageindex import *
 from pageindex.page_index_md import md_to_tree
+from pageindex.outline_text import NormalizedPages, slice_sections
 
 
 def generate_node_id():
@@ -16,9 +14,9 @@ def generate_node_id():
 def get_outline(pdf_path):
     if pdf_path:
         # Validate PDF file
-        if not pdf_path.lower().endswith('.pdf'):
+        if isinstance(pdf_path, str) and not pdf_path.lower().endswith('.pdf'):
             raise ValueError("PDF file must have .pdf extension")
-        if not os.path.isfile(pdf_path):
+        if isinstance(pdf_path, str) and not os.path.isfile(pdf_path):
             raise ValueError(f"PDF file not found: {pdf_path}")
         # Process PDF file
         # Configure options
@@ -43,80 +41,29 @@ def get_outline(pdf_path):
 def get_text_from_range(doc, start, end):
     text = ""
     for p in range(start - 1, end):
-        text += doc.load_page(p).get_text() + "\n"
+        text += doc.page_text(p) + "\n"
     return text.strip()
 
 def build_tree_with_toc(doc, outline):
     nodes = []
     stack = []
 
-    full_text_by_page = [doc.load_page(p).get_text() for p in range(doc.page_count)]
+    # normalized once, every section is a slice of this buffer
+    pages = NormalizedPages(doc.page_texts())
 
-    def normalize(s: str) -> str:
-        s = unicodedata.normalize("NFKC", s)
-        s = re.sub(r"\s+", " ", s)
-        return s
-
-    def make_pattern(title: str):
-        clean = re.sub(r"^\d+(?:\.\d+)*\.\s*", "", title).strip()
-
-        escaped = re.escape(clean)
-        flexible = re.sub(r"\\ ", r"\\s+", escaped)
-        pattern_str = r"(?:\d+(?:\.\d+)*\.\s*)?" + flexible
-
-        # return re.compile(
-        #     r"(?:\d+(?:\.\d+)*\.\s*)?" + re.escape(clean),
-        #     flags=re.MULTILINE
-        # )
-        return re.compile(pattern_str, flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
-    
     def get_level(structure_str):
         return len(structure_str.split("."))
-    
-    def get_text_by_title(start_page, end_page, title, next_title=None):
-        text = "".join(full_text_by_page[start_page - 1:end_page])
-        norm_text = normalize(text)
-        # print("text:", norm_text)
-        norm_title = normalize(title)
-        # print("title:", norm_title)
-        norm_next = normalize(next_title) if next_title else None
-        # print("next_title:", norm_next)
-
-        pattern_title = make_pattern(norm_title)
-        match_title = pattern_title.search(norm_text)
-
-        if not match_title:
-            return norm_text.strip()
-        
-        start_pos = match_title.start()
-
-        if norm_next:
 
-            pattern_next = make_pattern(norm_next)
-            match_next = pattern_next.search(norm_text, match_title.end())
-            if match_next:
-                return norm_text[start_pos:match_next.start()].strip()
-
-
-        return norm_text[start_pos:].strip()
-    
+    outline = [json.loads(value) if isinstance(value, str) else value for value in outline]
+    entries = []
     for i, value in enumerate(outline):
-        print('type of value', type(value))
-        # print('value:', value)
-
-        if isinstance(value, str):
-            value = json.loads(value)
-            print('type:', type(value))
-            print('value', value)
-
-        if i < len(outline) -1:
-            end_idx = outline[i + 1]['physical_index']
-            next_title = outline[i + 1]['title']
+        if i < len(outline) - 1:
+            entries.append((value['physical_index'], outline[i + 1]['physical_index'], value['title'], outline[i + 1]['title']))
         else:
-            end_idx = doc.page_count
-            next_title = None
-        
-        text = get_text_by_title(value['physical_index'], end_idx, value['title'], next_title)
+            entries.append((value['physical_index'], doc.page_count, value['title'], None))
+    texts = slice_sections(pages, entries)
+
+    for value, text in zip(outline, texts):
 
         node =  {
             "title": value['title'],
@@ -142,9 +89,11 @@ def build_tree_with_toc(doc, outline):
     return nodes
 
 def extract_tree(pdf_path):
-    doc = fitz.open(pdf_path)
+    # accepts a path or an already opened Document, the file is parsed once either way
+    doc = Document.open(pdf_path, pdf_parser="PyMuPDF")
+    pdf_path = doc.path or doc.name
     # metadata = doc.metadata
-    outline = get_outline(pdf_path)
+    outline = get_outline(doc)
 
     if not outline:
         print("can't create outline.")